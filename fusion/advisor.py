@@ -0,0 +1,54 @@
+""" Move hints computed away from the render loop.
+
+The search runs in a SearchPool, so the game process only pays for a
+non-blocking poll of the pipes once per frame. A new board cancels the
+search of the previous one.
+"""
+import os
+
+from fusion.engine import DIRECTIONS
+from fusion.parallel import SearchPool
+
+
+class Advisor:
+
+    def __init__(self, workers=None, strategy="expectimax", **options):
+        workers = workers or max(os.cpu_count() - 1, 1)
+        options = options or ({"depth": 3} if strategy == "expectimax" else {})
+        self.pool = SearchPool(workers, strategy, capacity=8, **options)
+        self.board = None
+        self.ticket = None
+        self.stale = []
+        self.hint = None
+
+    def request(self, board):
+        """ Start searching board, unless it's the one already searched. """
+        if board == self.board:
+            return
+        if self.ticket is not None:
+            self.pool.cancel()
+            self.stale.append(self.ticket)
+            self.ticket = None
+        self.hint = None
+        # with the ring buffer full of cancelled searches, retry on the next call
+        if len(self.pool.pending) < self.pool.capacity:
+            self.board = board
+            self.ticket = self.pool.submit([board])
+
+    def poll(self):
+        """ Return the hint of the last requested board, None while it's computed. """
+        # cancelled searches still answer, in order
+        while self.stale and self.pool.ready(self.stale[0]):
+            self.pool.collect(self.stale.pop(0))
+        if self.ticket is not None and not self.stale and self.pool.ready(self.ticket):
+            scores = self.pool.collect(self.ticket)[0]
+            self.ticket = None
+            if (scores > float("-inf")).any():
+                self.hint = DIRECTIONS[int(scores.argmax())]
+        return self.hint
+
+    def close(self):
+        self.pool.cancel()
+        for ticket in self.stale + ([self.ticket] if self.ticket is not None else []):
+            self.pool.collect(ticket)
+        self.pool.close()
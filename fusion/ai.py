@@ -0,0 +1,163 @@
+""" AI players.
+
+A policy is a function (board, rng) -> direction, called only on boards that
+still have a legal move. make_policy() builds them by name.
+"""
+from math import isqrt
+
+from fusion.engine import DIRECTIONS, empty_cells, legal_moves, move, move_outcomes, reward, spawn, spawn_outcomes
+
+# preferred directions of the corner strategy (keeps the heavy nuclides top left)
+CORNER_ORDER = ("up", "left", "right", "down")
+
+_weights_cache = {}
+
+
+def snake_weights(size):
+    """ Return cell weights decreasing along a snake path from the top left corner. """
+    if size not in _weights_cache:
+        weights = [0.0] * (size * size)
+        rank = 0
+        for i in range(size):
+            cols = range(size) if i % 2 == 0 else range(size - 1, -1, -1)
+            for j in cols:
+                weights[i * size + j] = (size * size - rank) / (size * size)
+                rank += 1
+        _weights_cache[size] = weights
+    return _weights_cache[size]
+
+def heuristic(board):
+    """ Cheap evaluation: empty cells plus heavy nuclides along the snake path. """
+    weights = snake_weights(isqrt(len(board)))
+    return 2 * len(empty_cells(board)) + sum(code * w for code, w in zip(board, weights))
+
+
+def random_policy(board, rng):
+    return rng.choice(legal_moves(board))
+
+def greedy_policy(board, rng):
+    """ Take the move with the biggest reward, then the most empty cells. """
+    best, best_value = None, None
+    for direction in DIRECTIONS:
+        after, moved, reactions = move(board, direction)
+        if moved:
+            value = (reward(reactions), len(empty_cells(after)))
+            if best_value is None or value > best_value:
+                best, best_value = direction, value
+    return best
+
+def corner_policy(board, rng):
+    legal = legal_moves(board)
+    for direction in CORNER_ORDER:
+        if direction in legal:
+            return direction
+
+
+def expectimax(board, depth, evaluate, cache=None):
+    """ Return (value, direction) of the best move searching depth moves ahead.
+
+    The leaves are afterstates (the board right after a move, before the
+    spawn) and are scored by evaluate(board); a finished game is worth 0.
+    """
+    cache = {} if cache is None else cache
+    best_value, best = 0.0, None
+    for direction in DIRECTIONS:
+        value = expectimax_score(board, direction, depth, evaluate, cache)
+        if value is not None and (best is None or value > best_value):
+            best_value, best = value, direction
+    return best_value, best
+
+def expectimax_score(board, direction, depth, evaluate, cache):
+    """ Return the value of one move, None if it doesn't move anything. """
+    outcomes = move_outcomes(board, direction)
+    if outcomes[0][1] == board:
+        return None
+    return sum(
+        p * (reward(reactions) + chance_value(after, depth - 1, evaluate, cache))
+        for p, after, reactions in outcomes
+    )
+
+def chance_value(after, depth, evaluate, cache):
+    """ Return the expected value of an afterstate; cache is a dict or anything with get() and []=. """
+    if depth <= 0:
+        return evaluate(after)
+    key = (after, depth)
+    value = cache.get(key)
+    if value is None:
+        value = sum(p * expectimax(board, depth, evaluate, cache)[0] for p, board in spawn_outcomes(after))
+        cache[key] = value
+    return value
+
+def make_expectimax_policy(depth=2, evaluate=heuristic):
+    def policy(board, rng):
+        return expectimax(board, depth, evaluate)[1]
+    return policy
+
+
+def rollout(board, rng, length):
+    """ Return the reward of a random game of at most length moves. """
+    total = 0
+    for _ in range(length):
+        legal = legal_moves(board)
+        if not legal:
+            break
+        after, _, reactions = move(board, rng.choice(legal), rng)
+        total += reward(reactions)
+        board = spawn(after, rng)
+    return total
+
+def rollout_score(board, direction, rng, rollouts, length):
+    """ Return the reward of one move plus the mean reward of random rollouts after it. """
+    if not move(board, direction)[1]:
+        return None
+    total = 0
+    for _ in range(rollouts):
+        after, _, reactions = move(board, direction, rng)
+        total += reward(reactions) + rollout(spawn(after, rng), rng, length)
+    return total / rollouts
+
+def make_rollout_policy(rollouts=20, length=20):
+    """ Pick the move with the best mean reward over random rollouts. """
+    def policy(board, rng):
+        best, best_value = None, None
+        for direction in DIRECTIONS:
+            value = rollout_score(board, direction, rng, rollouts, length)
+            if value is not None and (best_value is None or value > best_value):
+                best, best_value = direction, value
+        return best
+    return policy
+
+
+STRATEGIES = ["random", "greedy", "corner", "expectimax", "rollout"]
+
+def make_evaluate(ntuple=None):
+    """ Return the leaf evaluator: the n-tuple network in directory ntuple, or the heuristic. """
+    if ntuple:
+        from fusion.ntuple import NTupleNetwork
+        return NTupleNetwork(ntuple).evaluate
+    return heuristic
+
+def make_policy(name, depth=2, rollouts=20, length=20, ntuple=None):
+    """ Build a policy by name. With ntuple (a network directory) expectimax
+    uses the n-tuple network as leaf evaluator instead of the heuristic. """
+    if name == "random":
+        return random_policy
+    if name == "greedy":
+        return greedy_policy
+    if name == "corner":
+        return corner_policy
+    if name == "expectimax":
+        return make_expectimax_policy(depth, make_evaluate(ntuple))
+    if name == "rollout":
+        return make_rollout_policy(rollouts, length)
+    raise ValueError(f"unknown strategy: {name}")
+
+def make_scorer(name, depth=2, rollouts=20, length=20, ntuple=None):
+    """ Return score(board, direction, rng, cache) -> value of one move (None if illegal),
+    for the search strategies that can be split by direction. """
+    if name == "expectimax":
+        evaluate = make_evaluate(ntuple)
+        return lambda board, direction, rng, cache: expectimax_score(board, direction, depth, evaluate, cache)
+    if name == "rollout":
+        return lambda board, direction, rng, cache: rollout_score(board, direction, rng, rollouts, length)
+    raise ValueError(f"{name} can't be split by direction")
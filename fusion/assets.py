@@ -0,0 +1,122 @@
+""" Images scaled once and cached on disk.
+
+Sprites are loaded on first use, smoothscaled to the size asked for and
+saved as raw RGBA in images/__cache__, keyed by the hash of the source file
+and the size, so the next launches skip decoding and scaling. Any other
+surface that is slow to draw and depends only on known inputs (e.g. the
+tiles) can be cached the same way with cached().
+
+Every window size has its own files, so both caches are bounded: the
+surfaces in memory drop the least recently used, the files on disk the
+least recently used (by mtime) beyond MAX_FILES, counted on the first write
+and then every PRUNE_EVERY writes rather than on each one. Surfaces may be
+built by another thread (the renderer's, after a resize); the files are
+written under unique temporary names, so two writers never share one.
+
+    assets = Assets("images")
+    proton = assets.sprite("proton", 40)
+"""
+import hashlib, os, tempfile, threading
+
+import pygame
+
+from fusion.glyphs import LRUCache
+
+CACHE_VERSION = 1
+MAX_SURFACES = 512 # in memory
+MAX_FILES = 2048 # on disk
+PRUNE_EVERY = 64 # files written between two prunes
+
+
+class Assets:
+
+    def __init__(self, directory="images", extension=".png"):
+        self.directory = directory
+        self.extension = extension
+        self.cache_dir = os.path.join(directory, "__cache__")
+        self.sources = {}  # name -> loaded source image
+        self.hashes = {}   # name -> hash of the source file
+        self.surfaces = LRUCache(MAX_SURFACES) # cache file name -> surface
+        self.lock = threading.Lock() # for the LRU order, shared by the threads
+        self.writes = 0 # cache files written
+
+    def path(self, name):
+        return os.path.join(self.directory, name + self.extension)
+
+    def source_hash(self, name):
+        if name not in self.hashes:
+            with open(self.path(name), "rb") as f:
+                self.hashes[name] = hashlib.sha1(f.read()).hexdigest()[:16]
+        return self.hashes[name]
+
+    def source(self, name):
+        if name not in self.sources:
+            self.sources[name] = pygame.image.load(self.path(name)).convert_alpha()
+        return self.sources[name]
+
+    def sprite(self, name, size):
+        """ Return the image name scaled to size, an int for a square or (w, h). """
+        if isinstance(size, int):
+            size = (size, size)
+        key = f"{name}.{self.source_hash(name)}"
+        return self.cached(key, size, lambda: pygame.transform.smoothscale(self.source(name), size))
+
+    def average_color(self, name):
+        """ Return the average color of the opaque part of an image. """
+        color = pygame.Color(pygame.transform.average_color(self.sprite(name, 32), consider_alpha=True))
+        color.a = 255
+        return color
+
+    def cached(self, key, size, build):
+        """ Return the surface of size (w, h) stored under key, made with build() the first time. """
+        w, h = size
+        filename = f"{key}.{w}x{h}.v{CACHE_VERSION}.rgba"
+        with self.lock:
+            surf = self.surfaces.get(filename)
+        if surf is not None:
+            return surf
+
+        path = os.path.join(self.cache_dir, filename)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) == w * h * 4:
+                surf = pygame.image.frombytes(data, (w, h), "RGBA").convert_alpha()
+                os.utime(path) # recently used: pruned last
+        except OSError:
+            pass
+        if surf is None:
+            surf = build()
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(".tmp", dir=self.cache_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(pygame.image.tobytes(surf, "RGBA"))
+                os.replace(tmp, path)
+            except OSError:
+                pass # read-only install: draw every time
+            else:
+                with self.lock:
+                    prune = self.writes % PRUNE_EVERY == 0
+                    self.writes += 1
+                if prune:
+                    self.prune()
+        with self.lock:
+            self.surfaces.put(filename, surf)
+        return surf
+
+    def prune(self):
+        """ Delete the least recently used cache files beyond MAX_FILES. """
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                files = [entry for entry in entries if entry.name.endswith(".rgba")]
+        except OSError:
+            return
+        if len(files) <= MAX_FILES:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass # already gone, pruned by another process
@@ -0,0 +1,167 @@
+""" Screenshots and recordings written by a background thread.
+
+The game thread only copies the frame into one of a few preallocated
+surfaces (a blit) and queues it; the thread encodes and writes it. When all
+the surfaces are waiting to be written the frame is dropped instead of
+making the game wait. Everything goes to captures/:
+
+    screenshot-20240105-183012-123.png          stills (s)
+    rec-20240105-183100/000001.png ...          recording as numbered frames (v)
+    rec-20240105-183100.rgb + .json             recording as raw RGB24 video
+
+A raw recording becomes a video with the command in its .json, e.g.
+
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s 1280x720 -r 60 -i rec-....rgb rec.mp4
+"""
+import json, os, queue, struct, sys, threading, time, zlib
+from datetime import datetime
+
+import pygame
+
+MODES = ["frames", "raw"]
+# 24 bit surfaces whose pixels are R, G, B bytes in memory
+RGB_MASKS = (0x0000FF, 0x00FF00, 0xFF0000, 0) if sys.byteorder == "little" else (0xFF0000, 0x00FF00, 0x0000FF, 0)
+
+
+def timestamp():
+    now = datetime.now()
+    return now.strftime("%Y%m%d-%H%M%S-") + f"{now.microsecond // 1000:03d}"
+
+
+def write_rows(surf, write):
+    """ Pass every row of an RGB_MASKS surface to write(), as memoryviews of its pixels. """
+    w, h = surf.get_size()
+    pitch = surf.get_pitch()
+    proxy = surf.get_buffer()
+    with memoryview(proxy) as data:
+        for y in range(h):
+            write(data[y * pitch:y * pitch + 3 * w])
+    del proxy # unlocks the surface
+
+def write_png(path, surf, level=6):
+    """ Save an RGB_MASKS surface as a PNG. pygame.image.save holds the GIL
+    while encoding, zlib doesn't, so the game thread keeps running. """
+    w, h = surf.get_size()
+    compressor = zlib.compressobj(level)
+    parts = []
+    # every row starts with its filter type, 0: none
+    write_rows(surf, lambda row: parts.append(compressor.compress(b"\x00" + row)))
+    parts.append(compressor.flush())
+    def chunk(kind, body):
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(body, zlib.crc32(kind)))
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", b"".join(parts)))
+        f.write(chunk(b"IEND", b""))
+    os.replace(path + ".tmp", path)
+
+
+class FrameCapture(threading.Thread):
+
+    def __init__(self, screen, directory="captures", mode="frames", fps=60, pool_size=8):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.mode = mode
+        self.fps = fps
+        self.size = screen.get_size()
+        # preallocated copies of the screen, reused round and round
+        self.pool = [pygame.Surface(self.size, 0, 24, RGB_MASKS) for _ in range(pool_size)]
+        self.free = queue.Queue()
+        for slot in range(pool_size):
+            self.free.put(slot)
+        self.queue = queue.Queue() # (slot, command), never longer than the pool
+
+        self.recording = None # path of the current recording
+        self.frame = 0
+        self.next_frame_time = 0.0
+        self.dropped = 0
+        self.error = None
+        self.start()
+
+    def grab(self, screen, command):
+        """ Copy the screen and queue it, return False if the frame was dropped. """
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        if screen.get_size() != self.size:
+            # the window was resized: the files keep the size they started with
+            screen = pygame.transform.scale(screen, self.size)
+        self.pool[slot].blit(screen, (0, 0))
+        self.queue.put((slot, command))
+        return True
+
+    def still(self, screen):
+        """ Save a timestamped screenshot. """
+        return self.grab(screen, ("still", os.path.join(self.directory, f"screenshot-{timestamp()}.png")))
+
+    def toggle_recording(self):
+        if self.recording:
+            self.queue.put((None, ("stop", self.recording)))
+            self.recording = None
+            return False
+        self.recording = os.path.join(self.directory, f"rec-{timestamp()}")
+        self.frame = 0
+        self.next_frame_time = time.perf_counter()
+        self.queue.put((None, ("start", self.recording)))
+        return True
+
+    def capture(self, screen):
+        """ Call once per frame: records it if a recording is on and a frame is due. """
+        if not self.recording:
+            return
+        now = time.perf_counter()
+        if now < self.next_frame_time:
+            return
+        # a steady fps in the output, whatever the game's frame rate
+        self.next_frame_time = max(self.next_frame_time + 1 / self.fps, now - 1 / self.fps)
+        self.frame += 1
+        self.grab(screen, ("frame", self.recording, self.frame))
+
+    def run(self):
+        video = None
+        while True:
+            slot, command = self.queue.get()
+            try:
+                if command is None:
+                    break
+                kind, path = command[:2]
+                if kind == "start":
+                    os.makedirs(path if self.mode == "frames" else self.directory, exist_ok=True)
+                    if self.mode == "raw":
+                        video = open(path + ".rgb", "wb")
+                        w, h = self.size
+                        with open(path + ".json", "w") as f:
+                            json.dump({
+                                "width": w, "height": h, "fps": self.fps, "pix_fmt": "rgb24",
+                                "ffmpeg": f"ffmpeg -f rawvideo -pix_fmt rgb24 -s {w}x{h} -r {self.fps} -i {os.path.basename(path)}.rgb {os.path.basename(path)}.mp4",
+                            }, f, indent=2)
+                elif kind == "stop":
+                    if video:
+                        video.close()
+                        video = None
+                elif kind == "still":
+                    os.makedirs(self.directory, exist_ok=True)
+                    write_png(path, self.pool[slot])
+                elif kind == "frame":
+                    if video:
+                        write_rows(self.pool[slot], video.write)
+                    elif self.mode == "frames":
+                        # a fast compression level, recordings are big anyway
+                        write_png(os.path.join(path, f"{command[2]:06d}.png"), self.pool[slot], level=1)
+            except (OSError, pygame.error) as e:
+                self.error = e # keep going: a failed capture must not stop the game
+            finally:
+                if slot is not None:
+                    self.free.put(slot)
+        if video:
+            video.close()
+
+    def close(self):
+        """ Finish writing what's queued and stop the thread. """
+        if self.recording:
+            self.toggle_recording()
+        self.queue.put((None, None))
+        self.join()
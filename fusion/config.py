@@ -0,0 +1,56 @@
+""" Window layout and colors of the game. """
+import os
+from collections import namedtuple
+
+from fusion.rules import ELEMENT_COLORS
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+
+# game config
+SCREEN_WIDTH, SCREEN_HEIGHT  = 1280, 720
+GRID_SIZE = 4 # number of rows and columns
+TILE_BORDER_RADIUS = 4
+
+# everything that depends on the size of the window
+Layout = namedtuple("Layout", [
+    "width", "height", "tile_size", "tile_padding", "table_size",
+    "table_offset_x", "table_offset_y", "tile_speed", "font_element", "font_z",
+])
+
+def make_layout(width, height):
+    """ Return the Layout of the board in a window of width x height. """
+    tile_size = int(min(width, height) // (1.85 + 1.15 * GRID_SIZE))
+    tile_padding = 0.15 * tile_size
+    table_size = tile_size * GRID_SIZE + (GRID_SIZE - 1) * tile_padding
+    return Layout(
+        width, height, tile_size, tile_padding, table_size,
+        (width - table_size) // 2, (height - table_size) // 2,
+        (tile_size + tile_padding) / (2/30), # a cell every 2 frames at 30 FPS
+        tile_size * 3 // 4, tile_size * 2 // 6, # font sizes
+    )
+
+# the window as it opens
+LAYOUT = make_layout(SCREEN_WIDTH, SCREEN_HEIGHT)
+TILE_SIZE = LAYOUT.tile_size
+TILE_PADDING = LAYOUT.tile_padding
+TABLE_SIZE = LAYOUT.table_size
+TABLE_OFFSET_X = LAYOUT.table_offset_x
+TABLE_OFFSET_Y = LAYOUT.table_offset_y
+TILE_SPEED = LAYOUT.tile_speed
+SIM_STEP = 1 / 120 # seconds of game logic per simulation step, whatever the frame rate
+MAX_FRAME = 0.25 # longer frames are simulated as this long, not caught up with
+FONT_ELEMENT = LAYOUT.font_element
+FONT_Z = LAYOUT.font_z
+FONT_HUD = 50
+TILES_VERSION = 1
+
+# game colors
+COLORS = {
+    "background": "#faf9ed",
+    "board": "#b9afa0",
+    "empty_tile": "#ccc3b3",
+    "text": "#8b8376",
+    "text_outline": "#5f4a41",
+    "hint": (95, 74, 65, 140),
+    **ELEMENT_COLORS # tile colors, from the rule set
+}
@@ -0,0 +1,223 @@
+""" Self-play dataset of transitions in memory-mapped shards.
+
+Every generator process steps its own VectorEnv and owns its shards, so no
+transition is ever pickled between processes. Inside a generator the batches
+go through a bounded queue to a flush thread that copies them into the
+current shard, a preallocated .npy memmap of a structured dtype. A finished
+shard is renamed to its final name and appended to the generator's
+index_<worker>.jsonl; a run killed in the middle only loses the shard being
+written and resumes from the index.
+
+    python -m fusion.dataset write --out selfplay --transitions 100000000 --workers 8
+    python -m fusion.dataset info --out selfplay
+
+Reading is zero-copy: Dataset(path)[i] and Dataset(path).shards() are views
+of the memmaps.
+"""
+import argparse, glob, json, os, queue, threading, time
+from multiprocessing import Process
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from fusion.engine import DIRECTIONS
+from fusion.env import VectorEnv, random_actions
+
+POLICIES = ["random", "greedy"]
+
+
+def transition_dtype(size):
+    cells = size * size
+    return np.dtype([
+        ("board", np.uint8, (cells,)),
+        ("legal", bool, (len(DIRECTIONS),)),
+        ("action", np.uint8),
+        ("reward", np.float32),
+        ("next_board", np.uint8, (cells,)),
+        ("done", bool),
+    ])
+
+def greedy_actions(env, legal, rng):
+    """ Return the legal action with the biggest reward, ties broken at random. """
+    scores = np.stack([env.tables.move(env.boards, d)[1] for d in range(len(DIRECTIONS))], axis=1)
+    scores = scores + rng.random(scores.shape)
+    scores[~legal] = -1
+    return scores.argmax(axis=1)
+
+
+class ShardWriter(threading.Thread):
+    """ Background thread moving batches from a bounded queue into the shards. """
+
+    def __init__(self, path, worker, dtype, shard_size, total, shard_index, max_batches=8):
+        super().__init__(daemon=True)
+        self.path = path
+        self.worker = worker
+        self.dtype = dtype
+        self.shard_size = shard_size
+        self.remaining = total
+        self.shard_index = shard_index
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.error = None
+
+    def shard_path(self, index):
+        return os.path.join(self.path, f"shard_w{self.worker:03d}_{index:05d}.npy")
+
+    def run(self):
+        try:
+            pending = None
+            while self.remaining > 0:
+                rows = min(self.shard_size, self.remaining)
+                final = self.shard_path(self.shard_index)
+                shard = open_memmap(final + ".tmp", mode="w+", dtype=self.dtype, shape=(rows,))
+                filled = 0
+                while filled < rows:
+                    batch = pending if pending is not None else self.queue.get()
+                    n = min(len(batch), rows - filled)
+                    shard[filled:filled + n] = batch[:n]
+                    filled += n
+                    # the rest of the batch goes to the next shard
+                    pending = batch[n:] if n < len(batch) else None
+                shard.flush()
+                del shard
+                os.replace(final + ".tmp", final)
+                with open(os.path.join(self.path, f"index_w{self.worker:03d}.jsonl"), "a") as f:
+                    f.write(json.dumps({"shard": os.path.basename(final), "rows": rows}) + "\n")
+                self.remaining -= rows
+                self.shard_index += 1
+        except Exception as e:
+            self.error = e
+
+    def put(self, batch):
+        """ Queue a batch, blocking while the buffer is full. Return False if the thread died. """
+        while self.is_alive():
+            try:
+                self.queue.put(batch, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+def read_index(path, worker=None):
+    pattern = "index_w*.jsonl" if worker is None else f"index_w{worker:03d}.jsonl"
+    entries = []
+    for index_path in sorted(glob.glob(os.path.join(path, pattern))):
+        with open(index_path) as f:
+            entries += [json.loads(line) for line in f if line.endswith("\n")]
+    return entries
+
+def _generate(path, worker, total, size, num_envs, shard_size, policy, seed):
+    done = read_index(path, worker)
+    remaining = total - sum(e["rows"] for e in done)
+    if remaining <= 0:
+        return
+
+    writer = ShardWriter(path, worker, transition_dtype(size), shard_size, remaining, len(done))
+    writer.start()
+    env = VectorEnv(num_envs, size)
+    rng = np.random.default_rng([seed, worker, len(done)])
+    obs, info = env.reset(seed=[seed, worker, len(done)])
+    start, produced = time.time(), 0
+    while produced < remaining:
+        batch = np.empty(num_envs, dtype=writer.dtype)
+        batch["board"] = env.boards
+        batch["legal"] = info["legal"]
+        actions = greedy_actions(env, info["legal"], rng) if policy == "greedy" else random_actions(info["legal"], rng)
+        batch["action"] = actions
+        obs, rewards, dones, info = env.step(actions)
+        batch["reward"] = rewards
+        batch["next_board"] = env.boards
+        batch["done"] = dones
+        if dones.any():
+            # next_board of a finished game is its last board, not the new game
+            batch["next_board"][dones] = info["final_boards"]
+        if not writer.put(batch):
+            break
+        produced += num_envs
+    writer.join()
+    if writer.error:
+        raise writer.error
+    rate = remaining / (time.time() - start)
+    print(f"[worker {worker}] {remaining} transitions, {rate:,.0f}/s", flush=True)
+
+def write(path, transitions, workers=1, size=4, num_envs=256, shard_size=1 << 20, policy="random", seed=0):
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "dataset.json")
+    meta = {"size": size, "transitions": transitions, "workers": workers, "policy": policy, "seed": seed}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            saved = json.load(f)
+        if saved != meta:
+            raise ValueError(f"{path} was started with {saved}")
+    else:
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    per_worker = [transitions // workers + (k < transitions % workers) for k in range(workers)]
+    processes = [
+        Process(target=_generate, args=(path, k, per_worker[k], size, num_envs, shard_size, policy, seed))
+        for k in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return Dataset(path)
+
+
+class Dataset:
+    """ Read-only view of a dataset, shards are memory-mapped. """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = read_index(path)
+        self._shards = [None] * len(self.entries)
+        self.offsets = np.cumsum([0] + [e["rows"] for e in self.entries])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, k):
+        if self._shards[k] is None:
+            self._shards[k] = np.load(os.path.join(self.path, self.entries[k]["shard"]), mmap_mode="r")
+        return self._shards[k]
+
+    def shards(self):
+        for k in range(len(self.entries)):
+            yield self.shard(k)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        k = int(np.searchsorted(self.offsets, i, side="right")) - 1
+        return self.shard(k)[i - self.offsets[k]]
+
+    def batches(self, batch_size):
+        """ Yield consecutive views of at most batch_size transitions (never across shards). """
+        for shard in self.shards():
+            for lo in range(0, len(shard), batch_size):
+                yield shard[lo:lo + batch_size]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write or inspect a self-play dataset.")
+    parser.add_argument("command", choices=["write", "info"])
+    parser.add_argument("--out", default="selfplay")
+    parser.add_argument("--transitions", type=float, default=1e6)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--envs", type=int, default=256, help="games stepped together per worker")
+    parser.add_argument("--shard-size", type=int, default=1 << 20, help="transitions per shard")
+    parser.add_argument("--policy", default="random", choices=POLICIES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "write":
+        start = time.time()
+        dataset = write(args.out, int(args.transitions), args.workers, args.size, args.envs, args.shard_size, args.policy, args.seed)
+        print(f"{len(dataset)} transitions in {time.time() - start:.1f}s")
+    else:
+        dataset = Dataset(args.out)
+        rewards = sum(float(shard["reward"].sum()) for shard in dataset.shards())
+        dones = sum(int(shard["done"].sum()) for shard in dataset.shards())
+        print(f"{len(dataset)} transitions in {len(dataset.entries)} shards, {dones} games ended, mean reward {rewards / max(len(dataset), 1):.3f}")
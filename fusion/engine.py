@@ -0,0 +1,210 @@
+""" Headless game engine.
+
+A board is a tuple of nuclide codes (see rules.py) in row-major order, 0 being
+an empty cell. The sliding and merging behave exactly like move_tiles() in
+fusion/game.py, without any Tile object or pygame surface.
+"""
+import itertools
+from collections import Counter
+from math import isqrt
+from random import Random
+
+from fusion.rules import BRANCHES, MERGE, NUCLIDES, OUTCOMES, REACTION_KEYS, SPAWN_CODES, alias_sample
+
+DIRECTIONS = ("left", "up", "right", "down")
+
+_lines_cache = {}
+_slide_cache = {}
+
+
+def get_lines(size, direction):
+    """ Return the board indices of every line, ordered in the sliding direction. """
+    key = (size, direction)
+    if key not in _lines_cache:
+        rows = [[i * size + j for j in range(size)] for i in range(size)]
+        cols = [[i * size + j for i in range(size)] for j in range(size)]
+        lines = {
+            "left": rows,
+            "right": [row[::-1] for row in rows],
+            "up": cols,
+            "down": [col[::-1] for col in cols],
+        }[direction]
+        _lines_cache[key] = tuple(tuple(line) for line in lines)
+    return _lines_cache[key]
+
+def slide(line):
+    """ Cached slide_uncached(). """
+    if line not in _slide_cache:
+        _slide_cache[line] = slide_uncached(line)
+    return _slide_cache[line]
+
+def slide_uncached(line):
+    """ Slide one line towards index 0.
+
+    Return the new line, the reactions as (passive, active, product, index
+    in the line) and (j, new_j) for every tile that slides, which the
+    animations follow (move_targets()). A tile can take part in one merge per move, and the
+    product can't merge again until the next move, so the layout doesn't depend
+    on which product a branching reaction gives: the line has the main one.
+    """
+    new_line = [0] * len(line)
+    merged = [False] * len(line)
+    reactions = []
+    targets = []
+    for j, code in enumerate(line):
+        if code == 0:
+            continue
+        new_j = j
+        while new_j > 0:
+            target = new_line[new_j - 1]
+            if target == 0:
+                new_j -= 1
+                continue
+            product = MERGE[target][code]
+            if not merged[new_j - 1] and product:
+                new_j -= 1
+                merged[new_j] = True
+                reactions.append((target, code, product, new_j))
+                code = product
+            break
+        new_line[new_j] = code
+        if new_j != j:
+            targets.append((j, new_j))
+
+    return tuple(new_line), tuple(reactions), tuple(targets)
+
+def move_targets(board, direction):
+    """ Return (from, to) board indices of the tiles a move slides, merging ones included. """
+    size = isqrt(len(board))
+    targets = []
+    for line in get_lines(size, direction):
+        for j, new_j in slide(tuple(board[i] for i in line))[2]:
+            targets.append((line[j], line[new_j]))
+    return targets
+
+def move(board, direction, rng=None):
+    """ Return (new_board, moved, reactions) after sliding the board.
+
+    The products of branching reactions are drawn with rng, the reactions
+    being (passive, active, product, board index). Without rng every reaction
+    gives its main product.
+    """
+    size = isqrt(len(board))
+    new_board = list(board)
+    all_reactions = []
+    for line in get_lines(size, direction):
+        new_line, reactions, _ = slide(tuple(board[i] for i in line))
+        for i, code in zip(line, new_line):
+            new_board[i] = code
+        for passive, active, main, j in reactions:
+            table = BRANCHES[passive][active]
+            if table is not None and rng is not None:
+                main = OUTCOMES[passive][active][alias_sample(table, rng.random)][1]
+                new_board[line[j]] = main
+            all_reactions.append((passive, active, main, line[j]))
+    new_board = tuple(new_board)
+    return new_board, new_board != board, all_reactions
+
+def move_outcomes(board, direction):
+    """ Return every (probability, new_board, reactions) a move can give, for chance nodes. """
+    new_board, moved, reactions = move(board, direction)
+    branching = [k for k, r in enumerate(reactions) if BRANCHES[r[0]][r[1]] is not None]
+    if not branching:
+        return [(1.0, new_board, reactions)]
+
+    outcomes = []
+    choices = [OUTCOMES[reactions[k][0]][reactions[k][1]] for k in branching]
+    for combination in itertools.product(*choices):
+        p = 1.0
+        board_k, reactions_k = list(new_board), list(reactions)
+        for k, (p_k, code, _) in zip(branching, combination):
+            passive, active, _, cell = reactions[k]
+            p *= p_k
+            board_k[cell] = code
+            reactions_k[k] = (passive, active, code, cell)
+        outcomes.append((p, tuple(board_k), reactions_k))
+    return outcomes
+
+def legal_moves(board):
+    return [d for d in DIRECTIONS if move(board, d)[1]]
+
+def empty_cells(board):
+    return [i for i, code in enumerate(board) if code == 0]
+
+def spawn_outcomes(board):
+    """ Return every (probability, board) that can follow a spawn. """
+    empty = empty_cells(board)
+    outcomes = []
+    for i in empty:
+        for code, p in SPAWN_CODES:
+            new_board = list(board)
+            new_board[i] = code
+            outcomes.append((p / len(empty), tuple(new_board)))
+    return outcomes
+
+def spawn(board, rng):
+    """ Put a random nuclide in a random empty cell. """
+    empty = empty_cells(board)
+    if not empty:
+        return board
+    r = rng.random()
+    for code, p in SPAWN_CODES:
+        r -= p
+        if r < 0:
+            break
+    new_board = list(board)
+    new_board[rng.choice(empty)] = code
+    return tuple(new_board)
+
+def new_game_board(size, rng):
+    board = (0,) * (size * size)
+    for _ in range(2):
+        board = spawn(board, rng)
+    return board
+
+def reaction_key(reaction):
+    """ Return the RULES key of a reaction. """
+    return REACTION_KEYS[reaction[0]][reaction[1]]
+
+def reward(reactions):
+    """ Return the sum of the mass numbers of the products, like the 2048 score. """
+    return sum(NUCLIDES[product - 1][1] for _, _, product, _ in reactions)
+
+
+class Game:
+    """ A seeded headless game. The keyword arguments restore one in progress
+    (fusion/snapshot.py): its RNG, board, moves, score and reaction counts. """
+
+    def __init__(self, size=4, seed=None, *, rng=None, board=None, moves=0, score=0, reactions=None):
+        self.size = size
+        self.seed = seed
+        self.rng = Random(seed) if rng is None else rng
+        self.board = new_game_board(size, self.rng) if board is None else board
+        self.moves = moves
+        self.score = score
+        self.reactions = Counter() if reactions is None else reactions
+        # the last move before its spawn, for replays
+        self.afterstate = None
+        self.last_reactions = []
+
+    def step(self, direction):
+        """ Play a move, return False if it doesn't move anything. """
+        board, moved, reactions = move(self.board, direction, self.rng)
+        if not moved:
+            return False
+        self.afterstate, self.last_reactions = board, reactions
+        for reaction in reactions:
+            self.reactions[reaction_key(reaction)] += 1
+        self.score += reward(reactions)
+        self.board = spawn(board, self.rng)
+        self.moves += 1
+        return True
+
+    def legal_moves(self):
+        return legal_moves(self.board)
+
+    def is_over(self):
+        return not self.legal_moves()
+
+    def highest(self):
+        return max(self.board)
@@ -0,0 +1,361 @@
+""" Gym-style vectorized environment for reinforcement learning.
+
+A batch of boards is a uint8 array (num_envs, size*size) of nuclide codes and
+every move is a handful of numpy operations on the whole batch: the result of
+sliding any line is precomputed in MoveTables. Actions are indices into
+engine.DIRECTIONS, the reward is engine.reward() (mass numbers of the
+products) and an action that doesn't move anything does nothing.
+
+    env = VectorEnv(256)
+    obs, info = env.reset(seed=0)
+    obs, rewards, dones, info = env.step(actions)   # info["legal"]: (256, 4) mask
+
+AsyncVectorEnv has the same API and splits the batch across subprocesses
+that write straight into shared memory.
+
+    python -m fusion.env --envs 1024 --steps 1000 --workers 4
+"""
+import argparse, os, time
+from itertools import product
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from fusion.engine import DIRECTIONS, get_lines, reward, slide_uncached
+from fusion.rules import BRANCHES, NUCLIDES, OUTCOMES, SPAWN_CODES
+
+BASE = len(NUCLIDES) + 1
+
+_tables_cache = {}
+
+
+class MoveTables:
+    """ Result of sliding every possible line of a board size.
+
+    The lines hold the main product of every reaction; branch_pos and
+    branch_id give, for every line, where a branching reaction left its
+    product and which alias table redraws it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        count = BASE ** size
+        self.new_lines = np.zeros((count, size), dtype=np.uint8)
+        self.rewards = np.zeros(count, dtype=np.int32)
+        self.reactions = np.zeros(count, dtype=np.int8)
+        self.branch_pos = np.full((count, size // 2), -1, dtype=np.int8)
+        self.branch_id = np.zeros((count, size // 2), dtype=np.int16)
+        tables = {}
+        for key, line in enumerate(product(range(BASE), repeat=size)):
+            # product() counts with the last cell changing fastest, the keys
+            # use the first cell as lowest digit
+            new_line, reactions, _ = slide_uncached(line[::-1])
+            self.new_lines[key] = new_line
+            self.rewards[key] = reward(reactions)
+            self.reactions[key] = len(reactions)
+            slot = 0
+            for passive, active, _, j in reactions:
+                if BRANCHES[passive][active] is not None:
+                    pair = (min(passive, active), max(passive, active))
+                    self.branch_pos[key, slot] = j
+                    self.branch_id[key, slot] = tables.setdefault(pair, len(tables))
+                    slot += 1
+        self.moved = (self.new_lines != self.line_codes(count)).any(axis=1)
+
+        # alias tables of the branching reactions, padded to the longest one
+        width = max([len(OUTCOMES[a][b]) for a, b in tables] + [1])
+        self.alias_prob = np.ones((len(tables), width))
+        self.alias_index = np.zeros((len(tables), width), dtype=np.int64)
+        self.branch_codes = np.zeros((len(tables), width), dtype=np.uint8)
+        self.branch_mass = np.zeros((len(tables), width), dtype=np.int32)
+        self.branch_count = np.ones(len(tables), dtype=np.int64)
+        self.main_mass = np.zeros(len(tables), dtype=np.int32)
+        for (a, b), t in tables.items():
+            probabilities, aliases = BRANCHES[a][b]
+            outcomes = OUTCOMES[a][b]
+            n = len(outcomes)
+            self.alias_prob[t, :n] = probabilities
+            self.alias_index[t, :n] = aliases
+            self.branch_codes[t, :n] = [code for _, code, _ in outcomes]
+            self.branch_mass[t, :n] = [NUCLIDES[code - 1][1] for _, code, _ in outcomes]
+            self.branch_count[t] = n
+            self.main_mass[t] = NUCLIDES[max(outcomes)[1] - 1][1]
+
+        self.lines = np.array([get_lines(size, d) for d in DIRECTIONS], dtype=np.int64)
+        self.powers = BASE ** np.arange(size, dtype=np.int64)
+
+    def line_codes(self, count):
+        keys = np.arange(count, dtype=np.int64)
+        return np.stack([keys // BASE ** k % BASE for k in range(self.size)], axis=1)
+
+    def keys(self, boards, d):
+        """ Return the table key of every line of boards in direction d, shape (n, size). """
+        return (boards[:, self.lines[d]].astype(np.int64) * self.powers).sum(axis=-1)
+
+    def move(self, boards, d, rng=None):
+        """ Return (new_boards, rewards, reactions) of boards moved in direction d.
+
+        With rng the branching reactions are drawn, else they give their main product.
+        """
+        keys = self.keys(boards, d)
+        new_lines = self.new_lines[keys]
+        rewards = self.rewards[keys].sum(axis=1)
+        if rng is not None and len(self.main_mass):
+            rows, lines, slots = np.nonzero(self.branch_pos[keys] >= 0)
+            if len(rows):
+                t = self.branch_id[keys[rows, lines], slots]
+                u = rng.random(len(t)) * self.branch_count[t]
+                i = u.astype(np.int64)
+                k = np.where(u - i < self.alias_prob[t, i], i, self.alias_index[t, i])
+                new_lines[rows, lines, self.branch_pos[keys[rows, lines], slots]] = self.branch_codes[t, k]
+                np.add.at(rewards, rows, self.branch_mass[t, k] - self.main_mass[t])
+        new_boards = np.empty_like(boards)
+        new_boards[:, self.lines[d]] = new_lines
+        return new_boards, rewards, self.reactions[keys].sum(axis=1)
+
+    def legal(self, boards):
+        """ Return the (n, 4) mask of the directions that move something. """
+        return np.stack([self.moved[self.keys(boards, d)].any(axis=1) for d in range(len(DIRECTIONS))], axis=1)
+
+def get_tables(size):
+    if size not in _tables_cache:
+        _tables_cache[size] = MoveTables(size)
+    return _tables_cache[size]
+
+
+def spawn_many(boards, rng):
+    """ Put a random nuclide in a random empty cell of every board, in place. """
+    if len(boards) == 0:
+        return
+    noise = rng.random(boards.shape)
+    noise[boards != 0] = -1
+    cells = noise.argmax(axis=1)
+    has_empty = noise[np.arange(len(boards)), cells] >= 0
+
+    codes = np.array([code for code, _ in SPAWN_CODES], dtype=np.uint8)
+    cumulative = np.cumsum([p for _, p in SPAWN_CODES])
+    values = codes[np.minimum(np.searchsorted(cumulative, rng.random(len(boards)), side="right"), len(codes) - 1)]
+    rows = np.flatnonzero(has_empty)
+    boards[rows, cells[rows]] = values[rows]
+
+def one_hot(boards, size):
+    """ Return (n, BASE, size, size) planes, plane k is 1 where the code is k. """
+    planes = np.eye(BASE, dtype=np.uint8)[boards]
+    return planes.transpose(0, 2, 1).reshape(len(boards), BASE, size, size)
+
+
+class VectorEnv:
+    """ num_envs games stepped together in this process.
+
+    The arrays returned by reset() and step() are the environment's own
+    buffers, updated in place by the next call. Finished games restart on
+    their own; their last board is in info["final_boards"].
+    """
+
+    def __init__(self, num_envs, size=4, obs_mode="codes", buffers=None):
+        self.num_envs = num_envs
+        self.size = size
+        self.obs_mode = obs_mode
+        self.tables = get_tables(size)
+        self.rng = np.random.default_rng()
+
+        cells = size * size
+        buffers = buffers or {
+            "boards": np.zeros((num_envs, cells), dtype=np.uint8),
+            "rewards": np.zeros(num_envs, dtype=np.float32),
+            "dones": np.zeros(num_envs, dtype=bool),
+            "legal": np.zeros((num_envs, len(DIRECTIONS)), dtype=bool),
+        }
+        self.boards = buffers["boards"]
+        self.rewards = buffers["rewards"]
+        self.dones = buffers["dones"]
+        self.legal = buffers["legal"]
+        self.episode_moves = np.zeros(num_envs, dtype=np.int64)
+        self.episode_rewards = np.zeros(num_envs, dtype=np.int64)
+
+    def observe(self):
+        boards = self.boards.reshape(self.num_envs, self.size, self.size)
+        if self.obs_mode == "onehot":
+            return one_hot(self.boards, self.size)
+        return boards
+
+    def reset_boards(self, rows):
+        self.boards[rows] = 0
+        for _ in range(2):
+            sub = self.boards[rows]
+            spawn_many(sub, self.rng)
+            self.boards[rows] = sub
+        self.episode_moves[rows] = 0
+        self.episode_rewards[rows] = 0
+
+    def reset(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.reset_boards(np.arange(self.num_envs))
+        self.legal[:] = self.tables.legal(self.boards)
+        self.rewards[:] = 0
+        self.dones[:] = False
+        return self.observe(), {"legal": self.legal}
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        before = self.boards.copy()
+        self.rewards[:] = 0
+        reactions = np.zeros(self.num_envs, dtype=np.int64)
+        for d in range(len(DIRECTIONS)):
+            rows = np.flatnonzero(actions == d)
+            if len(rows):
+                new_boards, rewards, counts = self.tables.move(before[rows], d, self.rng)
+                self.boards[rows] = new_boards
+                self.rewards[rows] = rewards
+                reactions[rows] = counts
+
+        # spawn only where the move did something, like the game
+        moved = np.flatnonzero((self.boards != before).any(axis=1))
+        sub = self.boards[moved]
+        spawn_many(sub, self.rng)
+        self.boards[moved] = sub
+        self.episode_moves[moved] += 1
+        self.episode_rewards += self.rewards.astype(np.int64)
+
+        self.legal[:] = self.tables.legal(self.boards)
+        self.dones[:] = ~self.legal.any(axis=1)
+        info = {"legal": self.legal, "reactions": reactions}
+        done = np.flatnonzero(self.dones)
+        if len(done):
+            info["final_boards"] = self.boards[done].copy()
+            info["episode_moves"] = self.episode_moves[done].copy()
+            info["episode_rewards"] = self.episode_rewards[done].copy()
+            self.reset_boards(done)
+            self.legal[done] = self.tables.legal(self.boards[done])
+        return self.observe(), self.rewards, self.dones, info
+
+
+def _async_worker(conn, names, shapes, lo, hi, size, index):
+    memories = {name: SharedMemory(name=names[name]) for name in names}
+    arrays = {name: np.ndarray(shape, dtype, buffer=memories[name].buf) for name, (shape, dtype) in shapes.items()}
+    env = VectorEnv(hi - lo, size, buffers={name: arrays[name][lo:hi] for name in ["boards", "rewards", "dones", "legal"]})
+    actions = arrays["actions"][lo:hi]
+    try:
+        while True:
+            command, seed = conn.recv()
+            if command == "reset":
+                env.rng = np.random.default_rng(None if seed is None else [seed, index])
+                env.reset_boards(np.arange(env.num_envs))
+                env.legal[:] = env.tables.legal(env.boards)
+                env.dones[:] = False
+            elif command == "step":
+                env.step(actions)
+            elif command == "close":
+                break
+            conn.send(True)
+    finally:
+        del actions, env, arrays
+        for memory in memories.values():
+            memory.close()
+
+
+class AsyncVectorEnv:
+    """ VectorEnv split across worker processes sharing the buffers.
+
+    Only a short command goes through the pipes; boards, rewards, dones,
+    legal masks and actions live in shared memory. info only has the legal
+    mask: the final boards of finished games stay in the workers.
+    """
+
+    def __init__(self, num_envs, workers=None, size=4, obs_mode="codes"):
+        self.num_envs = num_envs
+        self.size = size
+        self.obs_mode = obs_mode
+        workers = min(workers or os.cpu_count(), num_envs)
+        get_tables(size)  # built once here, inherited by forked workers
+
+        cells = size * size
+        self.shapes = {
+            "boards": ((num_envs, cells), np.uint8),
+            "rewards": ((num_envs,), np.float32),
+            "dones": ((num_envs,), bool),
+            "legal": ((num_envs, len(DIRECTIONS)), bool),
+            "actions": ((num_envs,), np.int64),
+        }
+        self.memories, arrays = {}, {}
+        for name, (shape, dtype) in self.shapes.items():
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            self.memories[name] = SharedMemory(create=True, size=nbytes)
+            arrays[name] = np.ndarray(shape, dtype, buffer=self.memories[name].buf)
+        self.boards, self.rewards, self.dones = arrays["boards"], arrays["rewards"], arrays["dones"]
+        self.legal, self.actions = arrays["legal"], arrays["actions"]
+
+        names = {name: memory.name for name, memory in self.memories.items()}
+        bounds = np.linspace(0, num_envs, workers + 1).astype(int)
+        self.conns, self.processes = [], []
+        for k in range(workers):
+            parent, child = Pipe()
+            p = Process(target=_async_worker, args=(child, names, self.shapes, bounds[k], bounds[k + 1], size, k), daemon=True)
+            p.start()
+            self.conns.append(parent)
+            self.processes.append(p)
+
+    def _call(self, command, seed=None):
+        for conn in self.conns:
+            conn.send((command, seed))
+        for conn in self.conns:
+            conn.recv()
+
+    def observe(self):
+        if self.obs_mode == "onehot":
+            return one_hot(self.boards, self.size)
+        return self.boards.reshape(self.num_envs, self.size, self.size)
+
+    def reset(self, seed=None):
+        self._call("reset", seed)
+        return self.observe(), {"legal": self.legal}
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self._call("step")
+        return self.observe(), self.rewards, self.dones, {"legal": self.legal}
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("close", None))
+        for p in self.processes:
+            p.join()
+        del self.boards, self.rewards, self.dones, self.legal, self.actions
+        for memory in self.memories.values():
+            memory.close()
+            memory.unlink()
+
+
+def random_actions(legal, rng):
+    """ Return a random legal action per board (0 where nothing is legal). """
+    noise = rng.random(legal.shape)
+    noise[~legal] = -1
+    return noise.argmax(axis=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the step throughput of the vectorized environment.")
+    parser.add_argument("--envs", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=0, help="0: synchronous, in process")
+    parser.add_argument("--obs", default="codes", choices=["codes", "onehot"])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.workers:
+        env = AsyncVectorEnv(args.envs, args.workers, args.size, args.obs)
+    else:
+        env = VectorEnv(args.envs, args.size, args.obs)
+    print(f"setup: {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(0)
+    obs, info = env.reset(seed=0)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        obs, rewards, dones, info = env.step(random_actions(info["legal"], rng))
+    elapsed = time.perf_counter() - start
+    print(f"{args.envs * args.steps / elapsed:,.0f} steps/s ({args.envs} envs x {args.steps} steps in {elapsed:.2f}s)")
+    if args.workers:
+        env.close()
@@ -0,0 +1,504 @@
+""" The game in its window: tiles sliding on the grid, played with the arrow keys.
+
+    python main.py
+"""
+import time
+from random import choice, random
+
+import pygame
+
+from fusion.capture import FrameCapture
+from fusion.config import GRID_SIZE, MAX_FRAME, SCREEN_HEIGHT, SCREEN_WIDTH, SIM_STEP
+from fusion.history import History
+from fusion.renderer import Renderer
+from fusion.rules import CODES, NUCLIDES, REACTION_KEYS, RULESET, SPAWN_CODES
+
+renderer = None # set by run(), once the display is open
+score = 0 # mass number of everything made by fusion
+
+
+class Tile:
+    instances = []
+
+    def __init__(self, value, position):
+        # self.value = [a, z],  a: atomic number, z: atomic mass number
+        self.value = value
+        self.row, self.col = position
+        self.pos = list(get_pos(self.row, self.col))
+        self.prev_pos = self.pos.copy() # before the last simulation step
+
+        self.new_value = None
+        self.target_row, self.target_col = None, None
+        self.moving = False
+        
+        self.merging = False
+        self.merging_output = None
+
+        self.create_surf()
+        Tile.instances.append(self)
+
+    # def create_surf(self):
+    #     surf = pygame.Surface((TILE_SIZE,TILE_SIZE), pygame.SRCALPHA)
+    #     rect = surf.get_frect()
+
+    #     # draw tile
+    #     color = COLORS[self.value[0]]
+    #     pygame.draw.rect(surf, color, rect, border_radius=TILE_BORDER_RADIUS)
+
+    #     # draw value (protons and neutrons)
+    #     a, z = self.value
+    #     num_protons, num_neutrons = a, z - a
+
+    #     particles = []
+    #     for i in range(max(num_protons, num_protons)):
+    #         for particle in ["proton", "neutron"]:
+    #             if particle == "proton":
+    #                 if i >= num_protons:
+    #                     continue
+    #                 k = max(num_protons, 1)
+    #             else:
+    #                 if i >= num_neutrons:
+    #                     continue
+    #                 k = max(num_neutrons, 1)
+                
+    #             ball_radius = i+TILE_SIZE//8
+                
+    #             const = len(particles) + time.time()
+    #             angle = const + i * (2 * 3.14159 / k)
+    #             x = rect.centerx + int(ball_radius * 1.5 * math.cos(angle))
+    #             y = rect.centery + int(ball_radius * 1.5 * math.sin(angle))
+    #             particles.append((x, y, particle))
+
+    #     # Draw the particles
+    #     for x, y, name in particles:
+    #         img = images[name]
+    #         size = img.width/2
+    #         surf.blit(img, (x-size,y-size))
+
+    #     x, y = rect.move(0,5).center
+
+    #     font_element = pygame.font.Font(None, TILE_SIZE * 3 // 4)
+    #     text_with_outline(surf, ELEMENTS[a], font_element, COLORS["text"], COLORS["text_outline"], x, y, 1)
+
+    #     x, y = (TILE_SIZE/12, TILE_SIZE/12)
+    #     font_z = pygame.font.Font(None, TILE_SIZE * 2 // 6)
+    #     text_with_outline(surf, str(z), font_z, COLORS["text"], COLORS["text_outline"], x, y, 1, position="topleft")
+
+    #     self.image = surf
+
+    def create_surf(self):
+        # the tiles of the same nuclide share one surface from the atlas
+        self.image = renderer.tile_surface(*self.value)
+
+    def move_to(self, row, col):
+        if (row, col) != (self.row, self.col):
+            self.moving = True
+            self.target_row, self.target_col = row, col
+    
+    def update(self, dt, new_board):
+        global score
+        if not self.moving: 
+            return
+        
+        # find the distance to the target
+        target_x, target_y = get_pos(self.target_row, self.target_col)
+        dx, dy = (target_x - self.pos[0], target_y - self.pos[1])
+        distance = (dx**2 + dy**2)**0.5
+
+        step = renderer.layout.tile_speed * dt
+        if distance > step:
+            # change tile position
+            self.pos[0] += step * dx / distance
+            self.pos[1] += step * dy / distance
+        else:
+            # stop animation
+            self.moving = False
+            self.row, self.col = self.target_row, self.target_col
+            self.pos = list(get_pos(self.row, self.col))
+
+            if self.merging:
+                new_tile_value = self.merging_output["value"]
+                new_tile_pos = self.merging_output["position"]
+                spawn_tile(new_board, new_tile_value, new_tile_pos)
+                score += new_tile_value[1]
+                x, y = get_pos(*new_tile_pos)
+                half = renderer.layout.tile_size / 2
+                renderer.particles.emit(self.merging_output["side"], x + half, y + half)
+                
+                self.merging_output["passive_tile"].kill()
+                self.kill()
+
+    def draw(self, screen, alpha=1.0):
+        # between the last two simulation steps, alpha of the way
+        x = self.prev_pos[0] + (self.pos[0] - self.prev_pos[0]) * alpha
+        y = self.prev_pos[1] + (self.pos[1] - self.prev_pos[1]) * alpha
+        screen.blit(self.image, (x, y))
+    
+    def kill(self):
+        Tile.instances.remove(self)
+
+
+def get_pos(i,j, layout=None):
+    layout = layout or renderer.layout
+    x = layout.table_offset_x + j*(layout.tile_padding+layout.tile_size)
+    y = layout.table_offset_y + i*(layout.tile_padding+layout.tile_size)
+    return x, y
+
+def encrypt(tile1, tile2):
+    """ Return the rule key of the reaction of two tiles, None if they don't react. """
+    # the compiled table, the same the engine uses, whatever the order of the tiles
+    return REACTION_KEYS[CODES[tuple(tile1.value)]][CODES[tuple(tile2.value)]]
+
+def decrypt(text):
+    """ Return the main product [a, z] and the side products (particles and light nuclides). """
+    main_product, *side = text.split("-")
+    output = [int(n) for n in main_product.split(",")]
+    
+    return output, side
+
+def rotate(board, n=1, clockwise=True):
+        dim = len(board)
+
+        def cw_rotation(i,j):
+            new_i, new_j = i, j
+            for _ in range(n):
+                new_i, new_j = (new_j, dim - 1 - new_i)
+            return new_i, new_j
+
+        def ccw_rotation(i,j):
+            new_i, new_j = i, j
+            for _ in range(n):
+                new_i, new_j = (dim - 1 - new_j, new_i)
+            return new_i, new_j
+
+        forward, backward = (cw_rotation, ccw_rotation) if clockwise else (ccw_rotation, cw_rotation)
+
+        new_board = [[None for _ in range(dim)] for __ in range(dim)]
+        for i in range(dim):
+            for j in range(dim):
+                new_i, new_j = forward(i,j)
+                new_board[new_i][new_j] = board[i][j]
+        
+        return new_board, backward
+
+def is_available(board, tile, i, new_j):
+    """ Return True if the tile can go to the target tile. """
+    # check if the current tile can move
+    if tile.merging or (new_j == 0):
+        return False
+
+    tile_to_check = board[i][new_j-1]
+
+    # tile_to_check is empty
+    if tile_to_check is None:
+        return True
+
+    # tile_to_check is a Tile object
+    if tile_to_check.merging or not can_merge(tile_to_check, tile):
+        return False
+    else:
+        # merge the two tiles
+        tile.merging = True
+        tile.merging_output = find_merger_output(tile_to_check, tile)
+        return True
+
+def can_merge(tile1, tile2):
+    return encrypt(tile1, tile2) is not None
+
+def find_merger_output(passive_tile, active_tile):
+    text = encrypt(passive_tile, active_tile)
+    new_value, side = decrypt(RULESET.sample_products(text, random))
+
+    new_pos = (passive_tile.row, passive_tile.col)
+    if passive_tile.target_row is not None:
+        new_pos = (passive_tile.target_row, passive_tile.target_col)
+
+    return {"value": new_value, "side": side, "position": new_pos, "passive_tile": passive_tile}
+
+def move_tiles(board, direction):
+    rotations = {"left": 0, "up": 1, "right": 2, "down": 3}
+    
+    board_rotated, converter = rotate(board, n=rotations[direction], clockwise=False)
+    new_board = [[None for _ in range(GRID_SIZE)] for __ in range(GRID_SIZE)]
+    will_be_animated = False
+
+    for i,row in enumerate(board_rotated):
+        for j,tile in enumerate(row):
+            if (tile is None) or (j == 0):
+                new_board[i][j] = tile
+                continue
+            
+            # find where to move tiles
+            new_j = j
+            stop = False
+            while not stop:
+                if is_available(new_board, tile, i, new_j):
+                    new_j -= 1
+                else:
+                    stop = True
+            new_board[i][new_j] = tile
+            
+            # move tiles
+            if j != new_j:
+                target_i, target_j = converter(i,new_j)
+                tile.move_to(target_i, target_j)
+                will_be_animated = True
+    
+    new_board, _ = rotate(new_board, n=rotations[direction])
+    return new_board, will_be_animated
+
+def new_game():
+    global score
+    Tile.instances = []
+    score = 0
+    board = [[None for _ in range(GRID_SIZE)] for __ in range(GRID_SIZE)]
+    for _ in range(2): 
+        spawn_tile(board)
+    state = "input"
+
+    return board, state
+
+def new_game_all():
+    Tile.instances = []
+    board = [[None for _ in range(GRID_SIZE)] for __ in range(GRID_SIZE)]
+    allowed_values = [1,2,3,4,6,7,8,10,12,14]
+    for i in range(GRID_SIZE):
+        for j in range(GRID_SIZE):
+            v = i*GRID_SIZE+j+1
+            if v in allowed_values:
+                spawn_tile(board, value=[v,2*v], pos=(i,j))
+    state = "input"
+
+    return board, state
+
+def update_tiles(game_board, new_game_board, dt):
+    """ Move the tiles of a move one frame on, return True when the animation ends. """
+    # update position and check if animation ends
+    stop_animation = True
+    for row in game_board:
+        for tile in row:
+            if tile is None:
+                continue
+
+            tile.update(dt, new_game_board)
+            if tile.moving:
+                stop_animation = False
+
+    return stop_animation
+
+def save_positions():
+    """ Remember where the tiles are before a simulation step, for the interpolated drawing. """
+    for tile in Tile.instances:
+        tile.prev_pos[:] = tile.pos
+
+def resize(size):
+    """ Fit the game to a window of size: the tiles keep their place on the
+    grid, halfway through a move too, and take the new tile surfaces. """
+    old = renderer.layout
+    if not renderer.resize(size):
+        return
+    new = renderer.layout
+    scale = (new.tile_size + new.tile_padding) / (old.tile_size + old.tile_padding)
+    for tile in Tile.instances:
+        for pos in (tile.pos, tile.prev_pos):
+            pos[0] = new.table_offset_x + (pos[0] - old.table_offset_x) * scale
+            pos[1] = new.table_offset_y + (pos[1] - old.table_offset_y) * scale
+        tile.create_surf()
+
+def decode_board(codes):
+    """ Return a new board of tiles from a compact board, the opposite of encode_board(). """
+    Tile.instances = []
+    board = [[None for _ in range(GRID_SIZE)] for __ in range(GRID_SIZE)]
+    for index, code in enumerate(codes):
+        if code:
+            i, j = divmod(index, GRID_SIZE)
+            spawn_tile(board, value=list(NUCLIDES[code - 1]), pos=(i, j))
+    return board
+
+def encode_board(board):
+    """ Return the compact board (tuple of nuclide codes) used by the engine and the AIs. """
+    return tuple(0 if tile is None else CODES[tuple(tile.value)] for row in board for tile in row)
+
+def restore(position):
+    """ Return the board of tiles of a (board, score) history position, without animation. """
+    global score
+    codes, score = position
+    return decode_board(codes), "input"
+
+def random_empty_tiles(game_board):
+    empty_tiles = [(i,j) for i,row in enumerate(game_board) for j,tile in enumerate(row) if tile is None]
+    return empty_tiles
+
+
+def spawn_tile(game_board, value=None, pos=None):
+    if value is None:
+        # the spawn table of the rule set, sampled like engine.spawn()
+        r = random()
+        for code, p in SPAWN_CODES:
+            r -= p
+            if r < 0:
+                break
+        value = list(NUCLIDES[code - 1])
+    
+    if pos:
+        game_board[pos[0]][pos[1]] = Tile(value, pos)
+    else:
+        empty_tiles = random_empty_tiles(game_board)
+        if empty_tiles:
+            row, col = choice(empty_tiles)
+            game_board[row][col] = Tile(value, (row,col))
+        else:
+            # TODO: Game over
+            pass
+    
+
+
+def run(report=None, capture_mode="frames"):
+    """ Open the window and play until it's closed. With report (a dict of
+    times since launch) print how long the startup took; capture_mode is how
+    recordings are written, "frames" or "raw" (see fusion/capture.py). """
+    global renderer, score
+    # initialize pygame
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT ), pygame.RESIZABLE)
+    pygame.display.set_caption("2048 - Nuclear Synthesis")
+    clock = pygame.time.Clock()
+    if report is not None:
+        report["display init"] = time.perf_counter()
+
+    renderer = Renderer(screen)
+    # screenshots (s) and recordings (v), written by another thread
+    capture = FrameCapture(screen, mode=capture_mode)
+
+    # new game instance
+    game_board, state = new_game()
+    # z: undo, y: redo
+    history = History(GRID_SIZE * GRID_SIZE)
+    history.push(encode_board(game_board), score)
+    if report is not None:
+        report["asset load"] = time.perf_counter()
+
+    show_info = False
+    show_hint = False # i: show the move suggested by the AI
+    auto_play = False # a: play the suggested moves
+    advisor = None
+    # the game logic and the animations advance by fixed SIM_STEP steps, as
+    # many as the time of the frame holds; the tiles are drawn between the
+    # last two steps so the motion stays smooth at any frame rate
+    accumulator = 0.0
+    running = True
+    while running:
+        dt = min(clock.tick() / 1000, MAX_FRAME)
+        accumulator += dt
+
+        # events
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEORESIZE:
+                # scaled caches at once, the sharp ones come from another thread
+                resize(event.size)
+                screen = renderer.screen
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_h:
+                    show_info = not show_info
+                elif event.key == pygame.K_s:
+                    capture.still(screen)
+                elif event.key == pygame.K_v:
+                    capture.toggle_recording()
+                elif event.key == pygame.K_i:
+                    show_hint = not show_hint
+                    auto_play = auto_play and show_hint
+                elif event.key == pygame.K_a:
+                    auto_play = not auto_play
+                    show_hint = show_hint or auto_play
+                elif event.key == pygame.K_z:
+                    # during the animation undo cancels the move being played
+                    position = history.current() if state == "animation" else history.undo()
+                    if position:
+                        game_board, state = restore(position)
+                elif event.key == pygame.K_y and state == "input":
+                    position = history.redo()
+                    if position:
+                        game_board, state = restore(position)
+
+        # the search runs in other processes, here we only poll it
+        if show_hint and advisor is None:
+            from fusion.advisor import Advisor # numpy and the AIs, only if asked for
+            advisor = Advisor()
+
+        # update game state
+        match state:
+            case "input":
+                keys = pygame.key.get_just_pressed()
+                direction = None
+
+                # restart the game
+                if keys[pygame.K_r]:
+                    game_board, state = new_game()
+                    history = History(GRID_SIZE * GRID_SIZE)
+                    history.push(encode_board(game_board), score)
+
+                # move tiles
+                if keys[pygame.K_LEFT]:
+                    direction = "left"
+                elif keys[pygame.K_UP]:
+                    direction = "up"
+                elif keys[pygame.K_RIGHT]:
+                    direction = "right"
+                elif keys[pygame.K_DOWN]:
+                    direction = "down"
+
+                if show_hint:
+                    advisor.request(encode_board(game_board))
+                    if auto_play and not direction:
+                        direction = advisor.poll()
+
+                if direction:
+                    state = "animation"
+                    new_game_board, will_be_animated = move_tiles(game_board, direction)
+
+        renderer.particles.begin_frame()
+        while accumulator >= SIM_STEP:
+            accumulator -= SIM_STEP
+            save_positions()
+            renderer.particles.update(SIM_STEP)
+            if state == "animation" and update_tiles(game_board, new_game_board, SIM_STEP):
+                state = "input"
+                game_board = new_game_board.copy()
+                if will_be_animated:
+                    spawn_tile(game_board)
+                    history.push(encode_board(game_board), score)
+
+        if renderer.poll():
+            for tile in Tile.instances:
+                tile.create_surf()
+
+        # draw on screen
+        renderer.draw_board(Tile.instances, accumulator / SIM_STEP)
+        if show_hint and state == "input" and advisor.poll():
+            renderer.draw_hint(advisor.hint)
+        renderer.draw_score(score)
+        if show_info:
+            renderer.draw_fps(clock.get_fps())
+
+        capture.capture(screen)
+        pygame.display.flip()
+        if report is not None and "first frame" not in report:
+            report["first frame"] = time.perf_counter()
+            print_report(report)
+
+    if advisor:
+        advisor.close()
+    capture.close()
+    renderer.close()
+    pygame.quit()
+
+def print_report(report):
+    """ Print the time of every startup step, report being {step: perf_counter()} in order. """
+    steps = list(report.items())
+    for (_, previous), (step, t) in zip(steps, steps[1:]):
+        print(f"{step:>14}: {1000 * (t - previous):6.1f} ms")
+    print(f"{'total':>14}: {1000 * (steps[-1][1] - steps[0][1]):6.1f} ms")
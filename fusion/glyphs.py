@@ -0,0 +1,100 @@
+""" Outlined text from a cache of pre-rendered glyphs.
+
+Outlining a string by hand takes two renders and nine blits. Here every
+character is rendered once per style (font size, colors, outline) as two
+layers, the outline and the fill; a string is composed from them the first
+time it's asked for (all the outlines first, so they never cover the
+neighbouring letters) and kept, so drawing it again is a single blit. Both
+caches are bounded and drop the least recently used entries.
+
+pygame's font code isn't thread-safe: every use of a font, by any atlas,
+holds FONT_LOCK (the renderer draws tiles in a background thread after a
+resize, while the game thread draws the HUD).
+"""
+import threading
+from collections import OrderedDict
+
+import pygame
+
+FONT_LOCK = threading.RLock()
+
+
+class LRUCache(OrderedDict):
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+
+    def get(self, key):
+        value = super().get(key)
+        if value is not None:
+            self.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self[key] = value
+        if len(self) > self.capacity:
+            self.popitem(last=False)
+        return value
+
+
+class GlyphAtlas:
+
+    def __init__(self, max_glyphs=2048, max_strings=512):
+        self.fonts = {}
+        self.glyphs = LRUCache(max_glyphs)   # (char, style) -> (outline, fill, advance)
+        self.strings = LRUCache(max_strings) # (text, style) -> surface
+
+    def font(self, size):
+        with FONT_LOCK:
+            if size not in self.fonts:
+                self.fonts[size] = pygame.font.Font(None, size)
+            return self.fonts[size]
+
+    def glyph(self, char, style):
+        key = (char, style)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            size, color, outline_color, thickness = style
+            with FONT_LOCK:
+                font = self.font(size)
+                fill = font.render(char, True, color)
+                edge = font.render(char, True, outline_color) if outline_color is not None and thickness else None
+                advance = font.size(char)[0]
+            w, h = fill.get_size()
+            outline = None
+            if edge is not None:
+                outline = pygame.Surface((w + 2 * thickness, h + 2 * thickness), pygame.SRCALPHA)
+                outline.fblits([
+                    (edge, (thickness + dx, thickness + dy))
+                    for dx in (-thickness, 0, thickness)
+                    for dy in (-thickness, 0, thickness)
+                    if dx or dy
+                ])
+            glyph = self.glyphs.put(key, (outline, fill, advance))
+        return glyph
+
+    def preload(self, chars, size, color, outline_color=None, thickness=1):
+        """ Render the glyphs of chars ahead of time. """
+        for char in chars:
+            self.glyph(char, (size, color, outline_color, thickness))
+
+    def render(self, text, size, color, outline_color=None, thickness=1):
+        """ Return text as a surface, with a border of thickness pixels when outlined. """
+        style = (size, color, outline_color, thickness)
+        key = (text, style)
+        surf = self.strings.get(key)
+        if surf is None:
+            glyphs = [self.glyph(char, style) for char in text]
+            t = thickness if outline_color is not None else 0
+            width = sum(advance for _, _, advance in glyphs) + 2 * t
+            height = self.font(size).get_height() + 2 * t
+            surf = pygame.Surface((max(width, 1), height), pygame.SRCALPHA)
+            for layer in (0, 1):
+                x = 0
+                for glyph in glyphs:
+                    if glyph[layer] is not None:
+                        surf.blit(glyph[layer], (x, 0) if layer == 0 else (x + t, t))
+                    x += glyph[2]
+            surf = self.strings.put(key, surf)
+        return surf
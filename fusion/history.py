@@ -0,0 +1,59 @@
+""" Undo/redo history of a game, as compact boards.
+
+Every position is the board's nuclide codes (one byte per cell) and the
+score, appended to one bytearray and one array: 20 bytes per move on a 4x4
+board, no Tile or surface kept alive, so a 100k move history is 2 MB.
+Undoing or redoing only moves an index; playing a move after an undo drops
+the positions that could be redone.
+
+    history = History(16)
+    history.push(game.board, game.score)    # after every move
+    board, score = history.undo()           # None when there's nothing to undo
+"""
+from array import array
+
+
+class History:
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.boards = bytearray()
+        self.scores = array("I")
+        self.position = 0 # positions up to the current one
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, k):
+        """ Return (board, score) of position k. """
+        if not 0 <= k < len(self.scores):
+            raise IndexError("no such position in the history")
+        return tuple(self.boards[k * self.cells:(k + 1) * self.cells]), self.scores[k]
+
+    def push(self, board, score):
+        """ Add the position after a move, dropping the redoable ones. """
+        del self.boards[self.position * self.cells:]
+        del self.scores[self.position:]
+        self.boards += bytes(board)
+        self.scores.append(score)
+        self.position += 1
+
+    def current(self):
+        return self[self.position - 1] if self.position else None
+
+    def undo(self):
+        """ Go back one move, return its (board, score) or None at the first position. """
+        if self.position <= 1:
+            return None
+        self.position -= 1
+        return self.current()
+
+    def redo(self):
+        """ Go forward one undone move, return its (board, score) or None. """
+        if self.position >= len(self.scores):
+            return None
+        self.position += 1
+        return self.current()
+
+    def nbytes(self):
+        return len(self.boards) + self.scores.itemsize * len(self.scores)
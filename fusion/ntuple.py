@@ -0,0 +1,188 @@
+""" N-tuple network evaluator trained by TD(0) self-play.
+
+The value of a board is the sum of lookup tables indexed by the nuclide codes
+of a few groups of cells (rows, columns and 2x2 squares, through the 8
+symmetries of the board, which share the same table). The weights live in a
+single float32 .npy file opened as a memmap: any number of processes can open
+it read-only and share the same pages, and the training workers update it in
+place without locks (hogwild).
+
+    python -m fusion.ntuple --out ntuple_4x4 --games 100000 --workers 8
+
+The search AIs take net.evaluate as leaf evaluator.
+"""
+import argparse, json, os, time
+from multiprocessing import Process
+from random import Random
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from fusion.engine import DIRECTIONS, move, new_game_board, reward, spawn
+from fusion.rules import NUCLIDES, rules_hash
+
+BASE = len(NUCLIDES) + 1
+
+
+def symmetries(size):
+    """ Return the 8 symmetries of the board as lists mapping cell -> cell. """
+    maps = []
+    for transpose in (False, True):
+        for flip_rows in (False, True):
+            for flip_cols in (False, True):
+                cells = []
+                for i in range(size):
+                    for j in range(size):
+                        r, c = (j, i) if transpose else (i, j)
+                        if flip_rows:
+                            r = size - 1 - r
+                        if flip_cols:
+                            c = size - 1 - c
+                        cells.append(r * size + c)
+                maps.append(cells)
+    return maps
+
+def default_tuples(size):
+    """ Return the rows and 2x2 squares that are different up to symmetry. """
+    lines = [[i * size + j for j in range(size)] for i in range((size + 1) // 2)]
+    squares = [
+        [i * size + j, i * size + j + 1, (i + 1) * size + j, (i + 1) * size + j + 1]
+        for i in range((size - 2) // 2 + 1)
+        for j in range(i, (size - 2) // 2 + 1)
+    ]
+    return lines + squares
+
+
+class NTupleNetwork:
+
+    def __init__(self, path, mode="r"):
+        """ Open a network, mode="r" to evaluate, "r+" to train. """
+        with open(os.path.join(path, "ntuple.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["rules"] != rules_hash():
+            raise ValueError(f"{path} was trained with other rules")
+        self.path = path
+        self.size = self.meta["size"]
+        self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode=mode)
+
+        # every symmetric instance of every tuple: table offset + cells, padded
+        # with the cell size*size which is always empty
+        length = max(len(t) for t in self.meta["tuples"])
+        empty = self.size * self.size
+        offsets, cells = [], []
+        offset = 0
+        for t in self.meta["tuples"]:
+            for sym in symmetries(self.size):
+                offsets.append(offset)
+                cells.append([sym[i] for i in t] + [empty] * (length - len(t)))
+            offset += BASE ** len(t)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.cells = np.array(cells, dtype=np.int64)
+        self.powers = BASE ** np.arange(length, dtype=np.int64)
+
+    @classmethod
+    def create(cls, path, size=4, tuples=None):
+        tuples = tuples or default_tuples(size)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "ntuple.json"), "w") as f:
+            json.dump({"size": size, "tuples": tuples, "rules": rules_hash()}, f, indent=2)
+        total = sum(BASE ** len(t) for t in tuples)
+        weights = open_memmap(os.path.join(path, "weights.npy"), mode="w+", dtype=np.float32, shape=(total,))
+        weights.flush()
+        del weights
+        return cls(path, mode="r+")
+
+    def indices(self, boards):
+        """ Return the table index of every tuple instance, shape (len(boards), instances). """
+        boards = np.asarray(boards, dtype=np.int64).reshape(-1, self.size * self.size)
+        boards = np.pad(boards, ((0, 0), (0, 1)))
+        return self.offsets + (boards[:, self.cells] * self.powers).sum(axis=-1)
+
+    def evaluate_many(self, boards):
+        return self.weights[self.indices(boards)].sum(axis=-1)
+
+    def evaluate(self, board):
+        return float(self.evaluate_many([board])[0])
+
+    def best_move(self, board):
+        """ Return (direction, afterstate, reward) maximizing reward + value, None if the game is over. """
+        options = []
+        for direction in DIRECTIONS:
+            after, moved, reactions = move(board, direction)
+            if moved:
+                options.append((direction, after, reward(reactions)))
+        if not options:
+            return None
+        values = self.evaluate_many([after for _, after, _ in options])
+        values += [r for _, _, r in options]
+        return options[int(values.argmax())]
+
+    def learn(self, board, target, alpha):
+        """ Move the value of board towards target. """
+        idx = self.indices([board])[0]
+        error = target - float(self.weights[idx].sum())
+        np.add.at(self.weights, idx, alpha / len(idx) * error)
+
+    def play(self, rng, alpha=0.0):
+        """ Play a greedy game, learning on the afterstates if alpha > 0. Return (score, moves, highest). """
+        board = new_game_board(self.size, rng)
+        prev_after = None
+        score = moves = 0
+        while True:
+            choice = self.best_move(board)
+            if choice is None:
+                break
+            # the choice assumed the main products, the move may branch
+            after, _, reactions = move(board, choice[0], rng)
+            r = reward(reactions)
+            if alpha and prev_after is not None:
+                self.learn(prev_after, r + self.evaluate(after), alpha)
+            prev_after = after
+            board = spawn(after, rng)
+            score += r
+            moves += 1
+        if alpha and prev_after is not None:
+            self.learn(prev_after, 0.0, alpha)
+        return score, moves, max(board)
+
+
+def _train_worker(path, games, alpha, seed, report):
+    net = NTupleNetwork(path, mode="r+")
+    rng = Random(seed)
+    scores, start = [], time.time()
+    for game in range(1, games + 1):
+        score, moves, highest = net.play(rng, alpha)
+        scores.append(score)
+        if game % report == 0:
+            print(f"[seed {seed}] game {game}: mean score {np.mean(scores):.1f}, {report / (time.time() - start):.1f} games/s", flush=True)
+            scores, start = [], time.time()
+    net.weights.flush()
+
+def train(path, games, workers=1, alpha=0.1, seed=0, size=4, report=1000):
+    """ Train (or keep training) the network in path with hogwild workers. """
+    if not os.path.exists(os.path.join(path, "ntuple.json")):
+        NTupleNetwork.create(path, size)
+    per_worker = [games // workers + (k < games % workers) for k in range(workers)]
+    processes = [
+        Process(target=_train_worker, args=(path, per_worker[k], alpha, seed + k, report))
+        for k in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    return NTupleNetwork(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an n-tuple network by TD self-play.")
+    parser.add_argument("--out", default="ntuple_4x4")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--alpha", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", type=int, default=1000, help="print stats every REPORT games per worker")
+    args = parser.parse_args()
+
+    train(args.out, args.games, args.workers, args.alpha, args.seed, args.size, args.report)
@@ -0,0 +1,91 @@
+""" Nucleus drawings: protons and neutrons packed in the middle of a tile.
+
+The layout of a nuclide (where every nucleon goes and how big it is) is
+computed once per tile size, and so is the drawing, so a tile costs a single
+blit whatever its mass number. The nucleons follow a sunflower spiral, the
+protons spread evenly among the neutrons; with packing the nucleons shrink as
+the nucleus grows, so heavy elements still fit in the tile. When the
+nucleons would be a few pixels wide the nucleus is drawn as a single disc,
+and on tiny tiles not at all (levels of detail).
+"""
+import math
+from functools import lru_cache
+
+import pygame
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+NUCLEUS_RADIUS = 0.4    # of the tile size
+NUCLEON_RADIUS = 0.18   # of the tile size, the biggest a nucleon gets
+OVERLAP = 0.75          # nucleon radius / spiral spacing, < 1 to overlap a bit
+
+# levels of detail
+NUCLEONS, DISC, NONE = 0, 1, 2
+MIN_NUCLEON_PX = 3 # nucleon radius below which the nucleus becomes a disc
+MIN_TILE_PX = 24   # tile size below which the nucleus isn't drawn
+MAX_LAYOUTS = 256  # cached layouts, every nuclide for the last few tile sizes
+
+
+@lru_cache(maxsize=MAX_LAYOUTS)
+def layout(protons, neutrons, tile_size, packing=True):
+    """ Return (nucleon radius, [(x, y, "proton"|"neutron")]) around the tile center, drawing order. """
+    n = protons + neutrons
+    spacing = NUCLEUS_RADIUS * tile_size / (math.sqrt(n) + OVERLAP)
+    radius = OVERLAP * spacing
+    if not packing:
+        radius = NUCLEON_RADIUS * tile_size
+    elif radius > NUCLEON_RADIUS * tile_size:
+        radius = NUCLEON_RADIUS * tile_size
+        spacing = radius / OVERLAP
+
+    nucleons = []
+    for i in range(n):
+        # a proton whenever the running share of protons falls behind
+        kind = "proton" if (i + 1) * protons // n > i * protons // n else "neutron"
+        r = spacing * math.sqrt(i + 0.5) if n > 1 else 0
+        angle = i * GOLDEN_ANGLE
+        nucleons.append((r * math.cos(angle), r * math.sin(angle), kind))
+    # outer nucleons first, the ones in the middle on top
+    return radius, nucleons[::-1]
+
+def level_of_detail(protons, neutrons, tile_size, packing=True):
+    if tile_size < MIN_TILE_PX:
+        return NONE
+    radius, _ = layout(protons, neutrons, tile_size, packing)
+    return NUCLEONS if radius >= MIN_NUCLEON_PX else DISC
+
+
+class NucleusRenderer:
+    """ Draws and caches nuclei for one tile size, with the nucleon sprites of assets. """
+
+    def __init__(self, assets, tile_size, packing=True):
+        self.assets = assets # fusion.assets.Assets with "proton" and "neutron"
+        self.tile_size = tile_size
+        self.packing = packing
+        self.nuclei = {} # (protons, neutrons) -> surface or None
+
+    def render(self, protons, neutrons):
+        """ Return the nucleus as a tile-sized surface (None if too small to draw), cached. """
+        key = (protons, neutrons)
+        if key in self.nuclei:
+            return self.nuclei[key]
+
+        lod = level_of_detail(protons, neutrons, self.tile_size, self.packing)
+        surf = None
+        if lod != NONE:
+            surf = pygame.Surface((self.tile_size, self.tile_size), pygame.SRCALPHA)
+            center = self.tile_size / 2
+            radius, nucleons = layout(protons, neutrons, self.tile_size, self.packing)
+            if lod == NUCLEONS:
+                diameter = max(round(2 * radius), 1)
+                surf.fblits([
+                    (self.assets.sprite(name, diameter), (center + x - diameter / 2, center + y - diameter / 2))
+                    for x, y, name in nucleons
+                ])
+            else:
+                # the average color of the nucleons, weighted by how many there are
+                p, n = (self.assets.average_color(name) for name in ("proton", "neutron"))
+                color = p.lerp(n, neutrons / (protons + neutrons))
+                outer = max((math.hypot(x, y) for x, y, _ in nucleons), default=0) + radius
+                pygame.draw.circle(surf, color, (center, center), max(outer, 1))
+        self.nuclei[key] = surf
+        return surf
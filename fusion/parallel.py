@@ -0,0 +1,248 @@
+""" Search split across processes through shared memory.
+
+The coordinator (SearchPool) writes the boards to search in a ring buffer in
+shared memory and hands every worker a range of tasks, one task being one
+(board, direction) pair. The only message on the pipes is that range, packed
+in 24 bytes; the per-direction scores come back in another shared array.
+Every worker bumps its own progress counter (a single writer per slot, so no
+lock is needed) and checks a shared epoch to drop cancelled work. The
+expectimax workers also share one lockless transposition table.
+
+    pool = SearchPool(workers=8, strategy="expectimax", depth=3)
+    scores = pool.scores(boards)        # (len(boards), 4), -inf where illegal
+    pool.close()
+"""
+import os, struct, time
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from random import Random
+
+import numpy as np
+
+from fusion.ai import make_scorer
+from fusion.engine import DIRECTIONS
+
+RANGE = struct.Struct("qqq") # first task, last task, epoch
+MASK64 = (1 << 64) - 1
+
+# control slots
+EPOCH = 0
+
+
+class SharedTable:
+    """ Lockless transposition table in shared memory.
+
+    A slot holds (key ^ value bits, value bits): a slot half written by
+    another process doesn't match its key and reads as a miss. Colliding
+    entries simply replace each other.
+    """
+
+    def __init__(self, bits, name=None):
+        self.mask = (1 << bits) - 1
+        nbytes = 16 << bits
+        self.memory = SharedMemory(name=name, create=name is None, size=nbytes)
+        view = self.memory.buf[:nbytes]
+        self.keys = view[: 8 << bits].cast("Q")
+        self.values = view[8 << bits:].cast("d")
+        self.bits = view[8 << bits:].cast("Q")
+        view.release()
+
+    def get(self, key):
+        h = hash(key) & MASK64
+        i = h & self.mask
+        bits = self.bits[i]
+        if self.keys[i] ^ bits == h and bits:
+            return self.values[i]
+        return None
+
+    def __setitem__(self, key, value):
+        h = hash(key) & MASK64
+        i = h & self.mask
+        self.values[i] = value
+        self.keys[i] = h ^ self.bits[i]
+
+    def close(self):
+        for view in (self.keys, self.values, self.bits):
+            view.release()
+        self.memory.close()
+
+
+def _attach(name, shape, dtype):
+    memory = SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype, buffer=memory.buf)
+
+def _worker(conn, index, names, capacity, cells, workers, table_bits, options):
+    memories = []
+    def attach(name, shape, dtype):
+        memory, array = _attach(names[name], shape, dtype)
+        memories.append(memory)
+        return array
+    boards = attach("boards", (capacity, cells), np.uint8)
+    results = attach("results", (capacity, len(DIRECTIONS)), np.float64)
+    control = attach("control", (1,), np.int64)
+    progress = attach("progress", (workers,), np.int64)
+    table = SharedTable(table_bits, names["table"])
+
+    score = make_scorer(**options)
+    try:
+        while True:
+            message = conn.recv_bytes()
+            if not message:
+                break
+            lo, hi, epoch = RANGE.unpack(message)
+            for task in range(lo, hi):
+                if control[EPOCH] != epoch:
+                    break
+                slot, d = divmod(task, len(DIRECTIONS))
+                slot %= capacity
+                value = score(tuple(int(c) for c in boards[slot]), DIRECTIONS[d], Random(task), table)
+                results[slot, d] = -np.inf if value is None else value
+                progress[index] += 1
+            conn.send_bytes(b"k")
+    finally:
+        del boards, results, control, progress
+        table.close()
+        for memory in memories:
+            memory.close()
+
+
+class SearchPool:
+    """ Worker processes scoring every direction of batches of boards. """
+
+    def __init__(self, workers=None, strategy="expectimax", size=4, capacity=1024, table_bits=20, **options):
+        self.workers = workers or os.cpu_count()
+        self.capacity = capacity
+        self.cells = size * size
+        self.head = 0
+        self.pending = []
+
+        self.memories = {}
+        arrays = {}
+        for name, shape, dtype in [
+            ("boards", (capacity, self.cells), np.uint8),
+            ("results", (capacity, len(DIRECTIONS)), np.float64),
+            ("control", (1,), np.int64),
+            ("progress", (self.workers,), np.int64),
+        ]:
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.memories[name] = SharedMemory(create=True, size=nbytes)
+            arrays[name] = np.ndarray(shape, dtype, buffer=self.memories[name].buf)
+            arrays[name][:] = 0
+        self.boards, self.results = arrays["boards"], arrays["results"]
+        self.control, self.progress = arrays["control"], arrays["progress"]
+        self.table = SharedTable(table_bits)
+
+        names = {name: memory.name for name, memory in self.memories.items()}
+        names["table"] = self.table.memory.name
+        options = {"name": strategy, **options}
+        self.conns, self.processes = [], []
+        for k in range(self.workers):
+            parent, child = Pipe()
+            p = Process(target=_worker, args=(child, k, names, capacity, self.cells, self.workers, table_bits, options), daemon=True)
+            p.start()
+            self.conns.append(parent)
+            self.processes.append(p)
+
+    def submit(self, boards):
+        """ Queue boards for search, return a ticket for collect(). """
+        n = len(boards)
+        if n > self.capacity - sum(count for _, count in self.pending):
+            raise ValueError("not enough room in the ring buffer, collect() first")
+        start = self.head
+        slots = np.arange(start, start + n) % self.capacity
+        self.boards[slots] = np.asarray(boards, dtype=np.uint8).reshape(n, self.cells)
+        self.results[slots] = np.nan
+        self.head = (start + n) % self.capacity
+
+        # contiguous ranges of (board, direction) tasks, one per worker
+        first = start * len(DIRECTIONS)
+        bounds = np.linspace(first, first + n * len(DIRECTIONS), self.workers + 1).astype(int)
+        epoch = int(self.control[EPOCH])
+        for k, conn in enumerate(self.conns):
+            conn.send_bytes(RANGE.pack(bounds[k], bounds[k + 1], epoch))
+        self.pending.append((start, n))
+        return start, n
+
+    def ready(self, ticket):
+        """ Return True if collect(ticket) wouldn't block. """
+        return bool(self.pending) and self.pending[0] == ticket and all(conn.poll() for conn in self.conns)
+
+    def collect(self, ticket):
+        """ Wait for a ticket (in submit order) and return its (n, 4) scores, -inf where illegal. """
+        if not self.pending or self.pending[0] != ticket:
+            raise ValueError("tickets must be collected in submit order")
+        for conn in self.conns:
+            conn.recv_bytes()
+        self.pending.pop(0)
+        start, n = ticket
+        return self.results[np.arange(start, start + n) % self.capacity].copy()
+
+    def scores(self, boards):
+        results = []
+        for lo in range(0, len(boards), self.capacity):
+            results.append(self.collect(self.submit(boards[lo:lo + self.capacity])))
+        return np.concatenate(results) if results else np.empty((0, len(DIRECTIONS)))
+
+    def best_moves(self, boards):
+        """ Return the best direction of every board, None if the game is over. """
+        return [
+            DIRECTIONS[int(row.argmax())] if np.isfinite(row).any() else None
+            for row in self.scores(boards)
+        ]
+
+    def cancel(self):
+        """ Make the workers drop what they're doing; pending tickets return NaN scores. """
+        self.control[EPOCH] += 1
+
+    def done(self):
+        """ Return the number of tasks finished so far, read without locks. """
+        return int(self.progress.sum())
+
+    def close(self):
+        for conn in self.conns:
+            conn.send_bytes(b"")
+        for p in self.processes:
+            p.join()
+        del self.boards, self.results, self.control, self.progress
+        self.table.close()
+        self.table.memory.unlink()
+        for memory in self.memories.values():
+            memory.close()
+            memory.unlink()
+
+
+if __name__ == "__main__":
+    import argparse
+    from fusion.engine import Game
+
+    parser = argparse.ArgumentParser(description="Compare in-process and shared-memory search.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--boards", type=int, default=64)
+    parser.add_argument("--strategy", default="expectimax", choices=["expectimax", "rollout"])
+    parser.add_argument("--depth", type=int, default=2)
+    args = parser.parse_args()
+
+    # positions from a few random games
+    boards, rng = [], Random(0)
+    while len(boards) < args.boards:
+        game = Game(seed=len(boards))
+        for _ in range(rng.randrange(10, 60)):
+            if game.is_over():
+                break
+            game.step(rng.choice(game.legal_moves()))
+        boards.append(game.board)
+
+    options = {"depth": args.depth} if args.strategy == "expectimax" else {}
+    score = make_scorer(args.strategy, **options)
+    start = time.perf_counter()
+    for board in boards:
+        for direction in DIRECTIONS:
+            score(board, direction, Random(0), {})
+    serial = time.perf_counter() - start
+
+    pool = SearchPool(args.workers, args.strategy, **options)
+    start = time.perf_counter()
+    pool.scores(boards)
+    parallel = time.perf_counter() - start
+    pool.close()
+    print(f"{args.boards} boards: {serial:.2f}s in process, {parallel:.2f}s with {args.workers} workers")
@@ -0,0 +1,119 @@
+""" Side products of the reactions drawn as particles.
+
+All the particles live in preallocated numpy arrays (position, velocity,
+age, kind) moved together by update(), once per frame or simulation step;
+the sprites are rendered once, with a few levels of transparency to fade
+them out. The pool has a fixed capacity and every rendered frame (from one
+begin_frame() to the next) can start at most `budget` new particles: the
+rest is dropped, so any number of simultaneous merges costs the same.
+"""
+import numpy as np
+import pygame
+
+# e: electron, p: positron, g: photon, n: neutrino, anything else is a nuclide
+KINDS = {"g": 0, "n": 1, "p": 2, "e": 3}
+NUCLEUS = 4
+
+# per kind: color, radius and speed (in tile sizes), lifetime (s), how many per product
+STYLES = {
+    0: ("#fff3a0", 0.035, 6.0, 0.35, 6),  # photons: a quick flash of rays
+    1: ("#e4e4ff", 0.02, 9.0, 0.5, 2),    # neutrinos: barely visible, fast
+    2: ("#ff6b6b", 0.04, 3.0, 0.6, 1),    # positrons
+    3: ("#5fa8ff", 0.04, 3.0, 0.6, 1),    # electrons
+    NUCLEUS: ("#c0392b", 0.08, 1.5, 0.8, 1),
+}
+ALPHA_LEVELS = 8
+DRAG = 0.97 # velocity kept after 1/60 s
+
+
+def create_sprites(tile_size):
+    """ Return sprites[kind][level], level 0 being the most transparent. """
+    sprites = {}
+    for kind, (color, radius, _, _, _) in STYLES.items():
+        r = max(int(radius * tile_size), 2)
+        base = pygame.Surface((4 * r, 4 * r), pygame.SRCALPHA)
+        glow = pygame.Color(color)
+        glow.a = 70
+        pygame.draw.circle(base, glow, (2 * r, 2 * r), 2 * r)
+        pygame.draw.circle(base, color, (2 * r, 2 * r), r)
+        levels = []
+        for level in range(ALPHA_LEVELS):
+            sprite = base.copy()
+            alpha = 255 * (level + 1) // ALPHA_LEVELS
+            sprite.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+            levels.append(sprite)
+        sprites[kind] = levels
+    return sprites
+
+
+class ParticleSystem:
+
+    def __init__(self, tile_size, capacity=512, budget=128, seed=None):
+        self.tile_size = tile_size
+        self.capacity = capacity
+        self.budget = budget
+        self.spawned = 0 # new particles in the current frame
+        # visual only: its own RNG, the game's one stays untouched
+        self.rng = np.random.default_rng(seed)
+
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.age = np.zeros(capacity, dtype=np.float32)
+        self.life = np.ones(capacity, dtype=np.float32)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        self.set_sprites(create_sprites(tile_size))
+
+    def set_sprites(self, sprites):
+        """ Draw with other sprites (rendered for another tile size). """
+        self.sprites = sprites
+        self.offsets = {kind: levels[0].get_width() / 2 for kind, levels in sprites.items()}
+
+    def emit(self, products, x, y):
+        """ Start the particles of the side products of a reaction at (x, y). """
+        for product in products:
+            kind = KINDS.get(product, NUCLEUS)
+            _, _, speed, life, count = STYLES[kind]
+            count = min(count, self.budget - self.spawned)
+            if count <= 0:
+                return
+            slots = np.flatnonzero(~self.alive)[:count]
+            n = len(slots)
+            if n == 0:
+                return
+            angles = self.rng.uniform(0, 2 * np.pi, n)
+            speeds = speed * self.tile_size * self.rng.uniform(0.6, 1.0, n)
+            self.pos[slots] = (x, y)
+            self.vel[slots, 0] = np.cos(angles) * speeds
+            self.vel[slots, 1] = np.sin(angles) * speeds
+            self.age[slots] = 0
+            self.life[slots] = life * self.rng.uniform(0.8, 1.2, n)
+            self.kind[slots] = kind
+            self.alive[slots] = True
+            self.spawned += n
+
+    def begin_frame(self):
+        """ Start the budget of a new rendered frame. """
+        self.spawned = 0
+
+    def update(self, dt):
+        alive = self.alive
+        if not alive.any():
+            return
+        self.pos[alive] += self.vel[alive] * dt
+        self.vel[alive] *= DRAG ** (dt * 60) # a little drag, the same at any frame rate
+        self.age[alive] += dt
+        self.alive &= self.age < self.life
+
+    def draw(self, surf):
+        alive = np.flatnonzero(self.alive)
+        if len(alive) == 0:
+            return
+        levels = ((1 - self.age[alive] / self.life[alive]) * ALPHA_LEVELS).astype(int).clip(0, ALPHA_LEVELS - 1)
+        kinds = self.kind[alive]
+        pos = self.pos[alive]
+        surf.blits([
+            (self.sprites[k][level], (px - self.offsets[k], py - self.offsets[k]))
+            for k, level, (px, py) in zip(kinds.tolist(), levels.tolist(), pos.tolist())
+        ], doreturn=False)
@@ -0,0 +1,227 @@
+""" Everything drawn on the window: grid, tiles, text, hint arrow and particles.
+
+Importing this module imports pygame; the engine, the rules and the AIs never
+do, so headless tools and worker processes don't pay for it.
+
+What depends on the window size (the grid, the hint arrow, the tiles and the
+particle sprites) lives in one Caches object. When the window is resized the
+current caches are scaled to the new size at once, which is quick and a bit
+blurry, while a background thread renders sharp ones; they replace the
+scaled ones in a single assignment when they're ready (poll()). The thread
+only draws on surfaces of its own, and its text goes through
+glyphs.FONT_LOCK like the game thread's.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+from fusion.assets import Assets
+from fusion.config import COLORS, FONT_HUD, GRID_SIZE, IMAGES_DIR, LAYOUT, TILE_BORDER_RADIUS, TILES_VERSION, make_layout
+from fusion.glyphs import GlyphAtlas
+from fusion.nucleus import NucleusRenderer
+from fusion.particles import ParticleSystem, create_sprites
+from fusion.rules import ELEMENTS, RULESET
+
+
+def draw_grid(layout=LAYOUT):
+    # board
+    x = layout.table_offset_x - layout.tile_padding
+    y = layout.table_offset_y - layout.tile_padding
+    w = layout.table_size + 2 * layout.tile_padding
+    h = layout.table_size + 2 * layout.tile_padding
+
+    grid_surf = pygame.Surface((w,h), pygame.SRCALPHA)
+    grid_rect = grid_surf.get_frect(topleft=(x,y))
+    pygame.draw.rect(grid_surf, COLORS["board"], (0,0,w,h), border_radius=7)
+
+    # empty tiles
+    for i in range(GRID_SIZE):
+        for j in range(GRID_SIZE):
+            tile_x = layout.tile_padding+j*(layout.tile_padding+layout.tile_size)
+            tile_y = layout.tile_padding+i*(layout.tile_padding+layout.tile_size)
+            tile_rect = (tile_x, tile_y, layout.tile_size, layout.tile_size)
+            pygame.draw.rect(grid_surf, COLORS["empty_tile"], tile_rect, border_radius=TILE_BORDER_RADIUS)
+
+    return grid_surf, grid_rect
+
+def create_hint_arrow(layout=LAYOUT):
+    # arrow pointing right, rotated when drawn
+    size = layout.tile_size * 2
+    surf = pygame.Surface((size, size), pygame.SRCALPHA)
+    points = [
+        (0, size*0.4), (size*0.55, size*0.4), (size*0.55, size*0.2),
+        (size, size*0.5),
+        (size*0.55, size*0.8), (size*0.55, size*0.6), (0, size*0.6)
+    ]
+    pygame.draw.polygon(surf, COLORS["hint"], points)
+    return surf
+
+
+class Caches:
+    """ The surfaces drawn for one window size, and what draws the missing tiles. """
+
+    def __init__(self, layout, assets, grid=None, hint_arrow=None, tiles=None, particle_sprites=None):
+        self.layout = layout
+        self.grid_surf, self.grid_rect = grid or draw_grid(layout)
+        self.hint_arrow = hint_arrow or create_hint_arrow(layout)
+        self.tiles = tiles or {} # (a, z) -> surface
+        self.particle_sprites = particle_sprites or create_sprites(layout.tile_size)
+        # fonts and nuclei of their own: caches are built by another thread
+        self.glyphs = GlyphAtlas()
+        self.nuclei = NucleusRenderer(assets, layout.tile_size)
+
+        # the tile atlas depends on all of these, bump TILES_VERSION when draw_tile changes
+        self.tiles_key = hashlib.sha1(repr((
+            TILES_VERSION, RULESET.hash, layout.tile_size, TILE_BORDER_RADIUS, layout.font_element, layout.font_z, COLORS,
+            assets.source_hash("proton"), assets.source_hash("neutron"), pygame.version.ver,
+        )).encode()).hexdigest()[:16]
+
+    def scaled(self, layout, assets):
+        """ Return caches for layout made by scaling these ones, fast. """
+        grid_rect = draw_grid(layout)[1]
+        size = layout.tile_size
+        return Caches(
+            layout, assets,
+            grid=(pygame.transform.scale(self.grid_surf, grid_rect.size), grid_rect),
+            hint_arrow=pygame.transform.scale(self.hint_arrow, (2 * size, 2 * size)),
+            tiles={value: pygame.transform.scale(surf, (size, size)) for value, surf in self.tiles.items()},
+            particle_sprites=self.particle_sprites,
+        )
+
+
+class Renderer:
+    """ The surfaces and caches of the window, made once the display is open. """
+
+    def __init__(self, screen):
+        self.screen = screen
+        # outlined glyphs of the HUD, rendered on first use
+        self.glyphs = GlyphAtlas()
+
+        # images are loaded when first needed, scaled to the size they're drawn at
+        # and cached on disk (images/__cache__)
+        self.assets = Assets(IMAGES_DIR)
+        # self.background = Assets(IMAGES_DIR, ".jpg").sprite("background_blurred", (SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.caches = Caches(make_layout(*screen.get_size()), self.assets)
+
+        # side products of the reactions (photons, neutrinos, positrons, ...)
+        self.particles = ParticleSystem(self.layout.tile_size)
+
+        # the sharp caches being rendered after a resize
+        self.executor = None
+        self.pending = None
+
+    @property
+    def layout(self):
+        return self.caches.layout
+
+    @property
+    def grid_surf(self):
+        return self.caches.grid_surf
+
+    def draw_tile(self, a, z, caches=None):
+        caches = caches or self.caches
+        size = caches.layout.tile_size
+        surf = pygame.Surface((size,size), pygame.SRCALPHA)
+        rect = surf.get_frect()
+
+        # draw tile
+        color = COLORS[a]
+        pygame.draw.rect(surf, color, rect, border_radius=TILE_BORDER_RADIUS)
+
+        # draw value (protons and neutrons), one cached surface per nuclide
+        nucleus_surf = caches.nuclei.render(a, z - a)
+        if nucleus_surf:
+            surf.blit(nucleus_surf, (0, 0))
+
+        x, y = rect.move(0,5).center
+
+        self.text_with_outline(surf, ELEMENTS[a], caches.layout.font_element, COLORS["text"], COLORS["text_outline"], x, y, 1, glyphs=caches.glyphs)
+
+        x, y = (size/12, size/12)
+        self.text_with_outline(surf, str(z), caches.layout.font_z, COLORS["text"], COLORS["text_outline"], x, y, 1, position="topleft", glyphs=caches.glyphs)
+
+        return surf
+
+    def tile_surface(self, a, z, caches=None):
+        """ Return the surface of a nuclide's tile, drawn once and cached on disk. """
+        caches = caches or self.caches
+        if (a, z) not in caches.tiles:
+            key = f"tile.{caches.tiles_key}.{a},{z}"
+            size = caches.layout.tile_size
+            caches.tiles[(a, z)] = self.assets.cached(key, (size, size), lambda: self.draw_tile(a, z, caches))
+        return caches.tiles[(a, z)]
+
+    def resize(self, size):
+        """ Switch to a window of size: scaled caches now, sharp ones from a
+        background thread later. Return False if the layout didn't change. """
+        self.screen = pygame.display.get_surface()
+        layout = make_layout(*size)
+        if layout == self.layout:
+            return False
+        old = self.caches
+        self.caches = old.scaled(layout, self.assets)
+        self.particles.tile_size = layout.tile_size
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="resize")
+        if self.pending:
+            self.pending.cancel() # made useless by this resize, if it hasn't started
+        # the tiles already drawn first, the others when they're needed
+        self.pending = self.executor.submit(self.build, layout, list(old.tiles))
+        return True
+
+    def build(self, layout, values):
+        """ Render the caches of layout with the tiles of values (in the background thread). """
+        caches = Caches(layout, self.assets)
+        for a, z in values:
+            self.tile_surface(a, z, caches)
+        return caches
+
+    def poll(self):
+        """ Swap in the sharp caches if they're ready, return True if so: the
+        tiles must then take their new surfaces. """
+        if not (self.pending and self.pending.done()):
+            return False
+        caches = self.pending.result()
+        self.pending = None
+        if caches.layout != self.layout:
+            return False # resized again since
+        self.caches = caches
+        self.particles.set_sprites(caches.particle_sprites)
+        return True
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    def text_with_outline(self, surf, text, font_size, text_color, outline_color, x, y, outline_thickness, position="center", glyphs=None):
+        # il testo con il contorno viene dalla cache dei glifi: un solo blit
+        text_surface = (glyphs or self.glyphs).render(text, font_size, text_color, outline_color, outline_thickness)
+        if position == "center":
+            text_rect = text_surface.get_frect(center=(x,y))
+        elif position == "topleft":
+            # (x, y) è l'angolo del testo, non del contorno
+            text_rect = text_surface.get_frect(topleft=(x - outline_thickness, y - outline_thickness))
+
+        surf.blit(text_surface, text_rect)
+
+    def draw_hint(self, direction):
+        angle = {"right": 0, "up": 90, "left": 180, "down": 270}[direction]
+        arrow = pygame.transform.rotate(self.caches.hint_arrow, angle)
+        self.screen.blit(arrow, arrow.get_frect(center=(self.layout.width/2, self.layout.height/2)))
+
+    def draw_fps(self, fps):
+        self.screen.blit(self.glyphs.render(f"FPS: {int(fps)}", FONT_HUD, "black"), (10,10))
+
+    def draw_score(self, score):
+        text_surf = self.glyphs.render(f"Score: {score}", FONT_HUD, COLORS["text"], COLORS["text_outline"], 2)
+        self.screen.blit(text_surf, text_surf.get_frect(topright=(self.layout.width - 10, 10)))
+
+    def draw_board(self, tiles, alpha=1.0):
+        self.screen.fill(COLORS["background"])
+        # self.screen.blit(self.background, (0,0))
+        self.screen.blit(self.caches.grid_surf, self.caches.grid_rect)
+        for tile in tiles:
+            tile.draw(self.screen, alpha)
+        self.particles.draw(self.screen)
@@ -0,0 +1,294 @@
+""" Replays of recorded games rendered to video, headless and on all cores.
+
+The games are lines of a tournament or runner JSONL file (strategy + seed),
+whose moves are found again by playing them with the same policy (a game
+that doesn't end with its recorded moves and score is skipped), or games of
+a store (fusion/store.py) with their recorded moves. Every game is cut into
+ranges of moves rendered by worker processes under the SDL dummy driver. A
+worker re-simulates its game with the engine up to the first move of its
+range (the keyframe), builds the tiles from that board and plays the moves
+through the same Tile animation, grid and particles as the window, with a
+fixed time step. The segments are concatenated in order as soon as a game
+is complete:
+
+    python -m fusion.replay tournament.jsonl --top 20 --out reels --workers 8
+
+gives reels/<strategy>-<seed>.rgb (raw RGB24 video, with the ffmpeg command
+to encode it in the .json next to it) or, with --format frames, a directory
+of numbered PNGs per game. --ffmpeg encodes the mp4 directly.
+"""
+import argparse, json, os, shutil, subprocess, time
+from multiprocessing import Pool
+
+import numpy as np
+
+from fusion.ai import make_policy
+from fusion.engine import Game
+from fusion.rules import OUTCOMES
+from fusion.tournament import load_results, play_game
+
+_worker = {}
+
+
+def find_directions(task):
+    """ Play a recorded game again and return its moves, None if it doesn't
+    end with the recorded moves and score (other options, n-tuple network or
+    rules than when it was recorded). """
+    strategy, seed, size, max_moves, options, moves, score = task
+    directions = []
+    result = play_game(make_policy(strategy, **options), size, seed, max_moves, directions)
+    if (result["moves"], result["score"]) != (moves, score):
+        return None
+    return directions
+
+
+def output_size(scale):
+    from fusion.config import SCREEN_HEIGHT, SCREEN_WIDTH
+    # even sizes, as most video codecs want
+    return 2 * round(SCREEN_WIDTH * scale / 2), 2 * round(SCREEN_HEIGHT * scale / 2)
+
+def _init_renderer(fps, scale, seed_particles):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    import pygame
+    from fusion import game
+    from fusion.capture import RGB_MASKS, write_png, write_rows
+    from fusion.config import SCREEN_HEIGHT, SCREEN_WIDTH
+    from fusion.renderer import Renderer
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    game.renderer = Renderer(screen)
+    size = output_size(scale)
+    _worker.update(
+        game=game, screen=screen, fps=fps, seed_particles=seed_particles,
+        write_png=write_png, write_rows=write_rows,
+        frame=pygame.Surface(size, 0, 24, RGB_MASKS),
+        scaled=pygame.Surface(size, 0, screen) if size != screen.get_size() else None,
+        smoothscale=pygame.transform.smoothscale,
+    )
+
+def set_reactions(reactions):
+    """ Make the merges started by move_tiles() give the products the engine drew. """
+    game = _worker["game"]
+    size = game.GRID_SIZE
+    products = {cell: (passive, active, product) for passive, active, product, cell in reactions}
+    for tile in game.Tile.instances:
+        if tile.merging:
+            row, col = tile.merging_output["position"]
+            passive, active, product = products[row * size + col]
+            side = next(side for _, code, side in OUTCOMES[passive][active] if code == product)
+            tile.merging_output["value"] = list(game.NUCLIDES[product - 1])
+            tile.merging_output["side"] = list(side)
+
+def play_move(board, direction, reactions, after_spawn, write):
+    """ Animate one move on the tiles and place its spawn, calling write() after every frame. """
+    game = _worker["game"]
+    dt = 1 / _worker["fps"]
+    new_board, _ = game.move_tiles(board, direction)
+    set_reactions(reactions)
+    while True:
+        game.renderer.particles.begin_frame()
+        done = game.update_tiles(board, new_board, dt)
+        if done:
+            board = new_board.copy()
+            # the spawn is the only cell filled after the move that wasn't before
+            codes = game.encode_board(board)
+            for index, (before, after) in enumerate(zip(codes, after_spawn)):
+                if after and not before:
+                    game.spawn_tile(board, list(game.NUCLIDES[after - 1]), divmod(index, game.GRID_SIZE))
+        game.renderer.particles.update(dt)
+        write()
+        if done:
+            return board
+
+def render_segment(task):
+    """ Render moves [lo, hi) of a game, return (game index, segment, path, frames). """
+    index, segment, seed, size, directions, lo, hi, path, fmt, hold = task
+    game, screen, frame = _worker["game"], _worker["screen"], _worker["frame"]
+    renderer = game.renderer
+    if _worker["seed_particles"]:
+        renderer.particles.rng = np.random.default_rng([seed, segment])
+    renderer.particles.alive[:] = False
+
+    # the keyframe: the engine replays the moves before the segment, the one
+    # just before is animated without being written so the particles flow on
+    warmup = max(lo - 1, 0)
+    engine = Game(size, seed)
+    for direction in directions[:warmup]:
+        engine.step(direction)
+    board = game.decode_board(engine.board)
+    game.score = engine.score
+
+    frames = 0
+    video = open(path, "wb") if fmt == "raw" else None
+    if fmt == "frames":
+        os.makedirs(path, exist_ok=True)
+    def write():
+        nonlocal frames
+        renderer.draw_board(game.Tile.instances)
+        renderer.draw_score(game.score)
+        scaled = _worker["scaled"]
+        if scaled:
+            _worker["smoothscale"](screen, scaled.get_size(), scaled)
+        frame.blit(scaled or screen, (0, 0))
+        if video:
+            _worker["write_rows"](frame, video.write)
+        else:
+            _worker["write_png"](os.path.join(path, f"{frames:06d}.png"), frame, level=1)
+        frames += 1
+
+    try:
+        for m in range(warmup, hi):
+            engine.step(directions[m])
+            output = m >= lo
+            board = play_move(board, directions[m], engine.last_reactions, engine.board, write if output else lambda: None)
+            if game.encode_board(board) != engine.board:
+                raise RuntimeError(f"seed {seed}: the tiles don't match the engine after move {m}")
+            for _ in range(hold if output else 0):
+                renderer.particles.update(1 / _worker["fps"])
+                write()
+        if lo == hi: # no moves to play: one still
+            write()
+    finally:
+        if video:
+            video.close()
+    return index, segment, path, frames
+
+
+def concatenate(parts, out, fmt):
+    """ Join the segments of a game in order and remove them. """
+    if fmt == "raw":
+        with open(out, "wb") as f:
+            for part, _ in parts:
+                with open(part, "rb") as p:
+                    shutil.copyfileobj(p, f, 1 << 22)
+                os.remove(part)
+    else:
+        os.makedirs(out, exist_ok=True)
+        n = 0
+        for part, frames in parts:
+            for k in range(frames):
+                os.replace(os.path.join(part, f"{k:06d}.png"), os.path.join(out, f"{n:06d}.png"))
+                n += 1
+            os.rmdir(part)
+
+def select_games(results, top=None, sort="score"):
+    games = sorted(results, key=lambda r: r[sort], reverse=True)
+    return games[:top] if top else games
+
+def render(results, out, size=4, workers=None, segment=50, fps=30, hold=3, fmt="raw", scale=1.0, last=None, max_moves=None, ffmpeg=False, **policy_options):
+    """ Render the games of results (tournament lines); with last only their last moves. """
+    from fusion.config import GRID_SIZE
+    if size != GRID_SIZE:
+        raise ValueError(f"the window draws {GRID_SIZE}x{GRID_SIZE} boards")
+    os.makedirs(out, exist_ok=True)
+    start = time.time()
+    with Pool(workers, _init_renderer, (fps, scale, True)) as pool:
+        # the moves stored with the games (fusion/store.py), or found again
+        results = [dict(r) for r in results]
+        missing = [r for r in results if r.get("directions") is None]
+        # the options a tournament recorded with the game, if it did
+        tasks = [
+            (r["strategy"], r["seed"], size, max_moves, json.loads(r["options"]) if "options" in r else policy_options, r["moves"], r["score"])
+            for r in missing
+        ]
+        for r, directions in zip(missing, pool.map(find_directions, tasks)):
+            r["directions"] = directions
+            if directions is None:
+                print(f"warning: {r['strategy']}-{r['seed']} doesn't play again as recorded (other options or rules?), skipped")
+        results = [r for r in results if r["directions"] is not None]
+        if missing:
+            print(f"{len(missing)} games played again in {time.time() - start:.1f}s")
+        names = [f"{r['strategy']}-{r['seed']}" for r in results]
+
+        segments = []
+        for index, r in enumerate(results):
+            directions = r["directions"]
+            first = max(len(directions) - last, 0) if last else 0
+            bounds = list(range(first, len(directions), segment)) + [len(directions)]
+            if len(bounds) == 1:
+                bounds = [first, first]
+            for k, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+                path = os.path.join(out, f"{names[index]}.part{k:04d}" + (".rgb" if fmt == "raw" else ""))
+                segments.append((index, k, r["seed"], size, directions, lo, hi, path, fmt, hold))
+
+        # the segments of a game, concatenated when they're all there
+        expected = {}
+        for index, *_ in segments:
+            expected[index] = expected.get(index, 0) + 1
+        parts = {index: {} for index in expected}
+        total_frames = 0
+        for index, k, path, frames in pool.imap_unordered(render_segment, segments):
+            parts[index][k] = (path, frames)
+            total_frames += frames
+            if len(parts[index]) < expected[index]:
+                continue
+            name = os.path.join(out, names[index])
+            target = name + ".rgb" if fmt == "raw" else name
+            concatenate([parts[index][k] for k in sorted(parts[index])], target, fmt)
+            if fmt == "raw":
+                write_meta(name, *output_size(scale), fps, ffmpeg)
+            print(f"{names[index]}: {sum(f for _, f in parts[index].values())} frames")
+    elapsed = time.time() - start
+    print(f"{total_frames} frames in {elapsed:.1f}s ({total_frames / elapsed:.0f} frames/s)")
+
+def write_meta(name, width, height, fps, ffmpeg=False):
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+               "-i", f"{name}.rgb", "-pix_fmt", "yuv420p", f"{name}.mp4"]
+    with open(name + ".json", "w") as f:
+        json.dump({"width": width, "height": height, "fps": fps, "pix_fmt": "rgb24", "ffmpeg": " ".join(command)}, f, indent=2)
+    if ffmpeg:
+        subprocess.run(command, check=True)
+        os.remove(name + ".rgb")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render recorded games to video with worker processes.")
+    parser.add_argument("games", help="JSONL of games (tournament or runner output) or a store of games (.db, see fusion/store.py)")
+    parser.add_argument("--out", default="reels")
+    parser.add_argument("--top", type=int, default=None, help="only the best TOP games")
+    parser.add_argument("--sort", default="score", choices=["score", "moves", "highest_code"])
+    parser.add_argument("--strategy", default=None, help="only the games of this strategy")
+    parser.add_argument("--format", default="raw", choices=["raw", "frames"])
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--scale", type=float, default=0.5, help="output size relative to the window")
+    parser.add_argument("--last", type=int, default=None, help="only the last LAST moves of every game")
+    parser.add_argument("--hold", type=int, default=3, help="frames held after every move")
+    parser.add_argument("--segment", type=int, default=50, help="moves per worker task")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--ffmpeg", action="store_true", help="encode the mp4 with ffmpeg and delete the raw video")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=2, help="expectimax depth")
+    parser.add_argument("--rollouts", type=int, default=20, help="rollouts per move")
+    parser.add_argument("--length", type=int, default=20, help="rollout length")
+    parser.add_argument("--ntuple", default=None, help="n-tuple network used by expectimax")
+    args = parser.parse_args()
+
+    if args.games.endswith(".db"):
+        from fusion.store import connect, load_games
+        games = load_games(connect(args.games), args.top, args.sort, args.strategy)
+    else:
+        results = load_results(args.games)
+        if args.strategy:
+            results = [r for r in results if r["strategy"] == args.strategy]
+        games = select_games(results, args.top, args.sort)
+    render(
+        games,
+        args.out,
+        size=args.size,
+        workers=args.workers,
+        segment=args.segment,
+        fps=args.fps,
+        hold=args.hold,
+        fmt=args.format,
+        scale=args.scale,
+        last=args.last,
+        max_moves=args.max_moves,
+        ffmpeg=args.ffmpeg,
+        depth=args.depth,
+        rollouts=args.rollouts,
+        length=args.length,
+        ntuple=args.ntuple,
+    )
@@ -0,0 +1,253 @@
+""" Rule sets: nuclides, reactions, spawns and colors.
+
+A rule set is a JSON file (see rulesets/full.json):
+
+    "elements":  {atomic number: symbol}
+    "colors":    {atomic number: tile color}
+    "spawn":     {"a,z": probability}
+    "reactions": {"a,z-a,z": "a,z-..."}   reactants -> products (e: electron,
+                 p: positron, g: photon, n: neutrino), or a list of
+                 {"products": "a,z-...", "p": probability} for branching reactions
+
+Loading validates it and compiles it into dense lookup tables indexed by
+nuclide code. The compiled rule set is cached in the user's cache directory
+($XDG_CACHE_HOME, ~/.cache or %LOCALAPPDATA%, keyed by the hash of the file),
+never next to the file, so later launches skip the parsing; a cache file
+that can't be loaded is parsed again and replaced.
+The rule set in use is FUSION_RULES (a name in rulesets/ or a path),
+"full" by default:
+
+    FUSION_RULES=pp python main.py
+"""
+import hashlib, json, os, pickle, tempfile
+
+RULESETS_DIR = os.path.join(os.path.dirname(__file__), "rulesets")
+PARTICLES = {"e", "p", "g", "n"}
+CACHE_VERSION = 2
+
+
+def parse_nuclide(text):
+    """ Return (a, z) for a "a,z" string, None for side particles (e, p, g, n). """
+    if "," not in text:
+        return None
+    a, z = text.split(",")
+    return int(a), int(z)
+
+
+class RuleSet:
+    """ A validated and compiled rule set.
+
+    Code 0 is the empty cell, codes 1.. are the nuclides sorted by (a, z), so a
+    higher code is always a heavier element. merge[c1][c2] is the main product
+    of two nuclides (0: no reaction), outcomes[c1][c2] every possible result
+    as (probability, product code, side products) and branches[c1][c2] the
+    alias table to sample them (None when there's only one).
+    """
+
+    def __init__(self, data, digest):
+        self.name = data.get("name", "")
+        self.hash = digest
+        self.elements = {int(a): symbol for a, symbol in data["elements"].items()}
+        self.colors = {int(a): color for a, color in data["colors"].items()}
+        self.rules = data["reactions"]
+        self.spawn = {parse_nuclide(n): p for n, p in data["spawn"].items()}
+
+        nuclides = set(self.spawn)
+        for key, value in self.rules.items():
+            for part in key.split("-"):
+                nuclides.add(parse_nuclide(part))
+            for _, products in branches(value):
+                nuclides.update(parse_nuclide(part) for part in products.split("-"))
+        nuclides.discard(None)
+        self.nuclides = sorted(nuclides)
+        self.codes = {nuclide: code for code, nuclide in enumerate(self.nuclides, start=1)}
+
+        size = len(self.nuclides) + 1
+        self.merge = [[0] * size for _ in range(size)]
+        self.reaction_keys = [[None] * size for _ in range(size)]
+        self.outcomes = [[()] * size for _ in range(size)]
+        self.branches = [[None] * size for _ in range(size)]
+        for key, value in self.rules.items():
+            reactants = [parse_nuclide(part) for part in key.split("-")]
+            if len(reactants) != 2 or None in reactants:
+                continue # decays (e.g. "4,7-e") can't happen on the board
+            outcomes = []
+            for p, products in branches(value):
+                first, *side = products.split("-")
+                outcomes.append((p, self.codes[parse_nuclide(first)], tuple(side)))
+            c1, c2 = self.codes[reactants[0]], self.codes[reactants[1]]
+            self.merge[c1][c2] = self.merge[c2][c1] = max(outcomes)[1]
+            self.reaction_keys[c1][c2] = self.reaction_keys[c2][c1] = key
+            self.outcomes[c1][c2] = self.outcomes[c2][c1] = tuple(outcomes)
+            if len(outcomes) > 1:
+                table = alias_table([p for p, _, _ in outcomes])
+                self.branches[c1][c2] = self.branches[c2][c1] = table
+        self.spawn_codes = [(self.codes[nuclide], p) for nuclide, p in self.spawn.items()]
+
+    def sample(self, c1, c2, random):
+        """ Return one (probability, product, side products) outcome of a reaction, random() being a uniform [0, 1) float. """
+        table = self.branches[c1][c2]
+        outcomes = self.outcomes[c1][c2]
+        return outcomes[0] if table is None else outcomes[alias_sample(table, random)]
+
+    def sample_products(self, key, random):
+        """ Return the products of one branch of the reaction key, as written in the rules. """
+        value = self.rules[key]
+        if isinstance(value, str):
+            return value
+        c1, c2 = (self.codes[parse_nuclide(part)] for part in key.split("-"))
+        return value[alias_sample(self.branches[c1][c2], random)]["products"]
+
+    def nuclide_name(self, code):
+        if code == 0:
+            return "-"
+        a, z = self.nuclides[code - 1]
+        return f"{self.elements[a]}-{z}"
+
+
+def alias_table(weights):
+    """ Return Vose's alias table (probabilities, aliases) of a discrete distribution. """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    probabilities, aliases = [1.0] * n, list(range(n))
+    small = [i for i, w in enumerate(scaled) if w < 1]
+    large = [i for i, w in enumerate(scaled) if w >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        probabilities[s], aliases[s] = scaled[s], l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    return tuple(probabilities), tuple(aliases)
+
+def alias_sample(table, random):
+    """ Return an index drawn from an alias table, in O(1) with one random number. """
+    probabilities, aliases = table
+    u = random() * len(probabilities)
+    i = int(u)
+    return i if u - i < probabilities[i] else aliases[i]
+
+def branches(value):
+    """ Return [(probability, products)] of a reaction value. """
+    if isinstance(value, str):
+        return [(1.0, value)]
+    return [(branch["p"], branch["products"]) for branch in value]
+
+def validate(data, path):
+    def error(message):
+        raise ValueError(f"{path}: {message}")
+
+    for field in ["elements", "colors", "spawn", "reactions"]:
+        if field not in data:
+            error(f"missing {field!r}")
+    elements = {int(a) for a in data["elements"]}
+    colors = {int(a) for a in data["colors"]}
+    if elements - colors:
+        error(f"no color for atomic numbers {sorted(elements - colors)}")
+
+    def check_nuclide(text, where, particles=()):
+        if text in particles:
+            return
+        try:
+            a, z = parse_nuclide(text)
+        except (TypeError, ValueError):
+            error(f"{where}: {text!r} is not a nuclide (\"a,z\") or a particle")
+        if a not in elements:
+            error(f"{where}: no element with atomic number {a}")
+        if z < a:
+            error(f"{where}: mass number lower than atomic number in {text!r}")
+
+    def check_probabilities(probabilities, where):
+        if any(p < 0 for p in probabilities) or abs(sum(probabilities) - 1) > 1e-9:
+            error(f"{where}: probabilities must be positive and sum to 1")
+
+    for nuclide in data["spawn"]:
+        check_nuclide(nuclide, "spawn")
+    check_probabilities(list(data["spawn"].values()), "spawn")
+
+    for key, value in data["reactions"].items():
+        parts = key.split("-")
+        for part in parts:
+            check_nuclide(part, key, PARTICLES)
+        # one spelling per pair: the UI and the tools look reactions up by key
+        reactants = [parse_nuclide(part) for part in parts]
+        if len(reactants) == 2 and None not in reactants and reactants[0] > reactants[1]:
+            error(f"{key}: write the lighter nuclide first, \"{parts[1]}-{parts[0]}\"")
+        if not isinstance(value, (str, list)) or not value:
+            error(f"{key}: products must be a string or a list of branches")
+        if isinstance(value, list):
+            if not all(isinstance(b, dict) and {"products", "p"} <= set(b) for b in value):
+                error(f"{key}: every branch needs \"products\" and \"p\"")
+            check_probabilities([b["p"] for b in value], key)
+        for _, products in branches(value):
+            parts = products.split("-")
+            check_nuclide(parts[0], key)
+            for part in parts[1:]:
+                check_nuclide(part, key, PARTICLES)
+
+def resolve(name):
+    if os.path.exists(name):
+        return name
+    return os.path.join(RULESETS_DIR, f"{name}.json")
+
+def cache_dir():
+    """ Return the directory of the compiled rule sets of this user. """
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "2048-nuclear-fusion", "rulesets")
+
+def load_ruleset(name="full"):
+    """ Load a rule set by name or path, from the compiled cache when possible. """
+    path = resolve(name)
+    with open(path, "rb") as f:
+        raw = f.read()
+    file_hash = hashlib.sha1(raw).hexdigest()
+    cache_path = os.path.join(cache_dir(), f"{file_hash}.v{CACHE_VERSION}.pickle")
+    try:
+        with open(cache_path, "rb") as f:
+            ruleset = pickle.load(f)
+        if isinstance(ruleset, RuleSet):
+            return ruleset
+    except Exception:
+        pass # missing, truncated or stale (made by older code): a miss
+
+    data = json.loads(raw)
+    validate(data, path)
+    # the hash of the content, not of the formatting
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    ruleset = RuleSet(data, digest)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # a name of its own: the workers of a pool may all write it at once
+        fd, tmp = tempfile.mkstemp(".tmp", dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(ruleset, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass # read-only install: parse every time
+    return ruleset
+
+
+# the rule set in use
+RULESET = load_ruleset(os.environ.get("FUSION_RULES", "full"))
+
+ELEMENTS = RULESET.elements
+ELEMENT_COLORS = RULESET.colors
+RULES = RULESET.rules
+SPAWN = RULESET.spawn
+NUCLIDES = RULESET.nuclides
+CODES = RULESET.codes
+MERGE = RULESET.merge
+REACTION_KEYS = RULESET.reaction_keys
+OUTCOMES = RULESET.outcomes
+BRANCHES = RULESET.branches
+SPAWN_CODES = RULESET.spawn_codes
+# the order of the reaction counters in saved games (fusion/store.py, fusion/snapshot.py)
+REACTION_ORDER = sorted(RULES)
+
+def nuclide_name(code):
+    """ Return a readable name like "He-4" for a nuclide code. """
+    return RULESET.nuclide_name(code)
+
+def rules_hash():
+    """ Return the hash of the rule set, to tell apart files made with other rules. """
+    return RULESET.hash
@@ -0,0 +1,151 @@
+""" Headless runner: many games of one policy, one JSON line per game.
+
+Uses the pure engine only (no pygame, no display). Every game is written as
+soon as it's played, to stdout or to shards (the game with seed s goes to
+shard s % shards, so the same command always writes the same files), while
+the throughput is printed on stderr every few seconds.
+
+    python main.py run --policy greedy --seeds 0:10000 --workers 8 --out sweep/greedy --shards 8
+    python main.py run --policy corner --seeds 0:100 | jq .highest
+
+With --db the games and their replays also go to a SQLite store
+(fusion/store.py), written by a background thread, and the seeds already
+stored with the same policy and options are skipped. The shards are then
+appended to rather than overwritten, and a game played again because it
+hadn't reached the store isn't written twice.
+"""
+import json, os, sys, time
+from multiprocessing import Pool
+
+from fusion.ai import STRATEGIES
+from fusion.rules import RULESET
+from fusion.store import GameStore, stored_games
+from fusion.tournament import _init_worker, _play_chunk, load_results
+
+
+def parse_seeds(text):
+    """ Return the seeds of "first:last" (last excluded) or of a count "n" (0..n-1). """
+    if ":" in text:
+        first, last = text.split(":")
+        return range(int(first), int(last))
+    return range(int(text))
+
+def shard_paths(out, shards):
+    if shards == 1:
+        return [f"{out}.jsonl"]
+    return [f"{out}.{k:03d}-of-{shards:03d}.jsonl" for k in range(shards)]
+
+
+def run(policy, seeds, out=None, shards=1, size=4, workers=None, chunk=4, max_moves=None, report=5.0, db=None, **policy_options):
+    """ Play a game for every seed and stream the results, return (games, moves). """
+    written = set()
+    if out is None:
+        files = [sys.stdout]
+    else:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        paths = shard_paths(out, shards)
+        if db is not None:
+            # resuming from the store: keep what the shards already have
+            written = {(r["strategy"], r["seed"]) for path in paths for r in load_results(path)}
+        files = [open(path, "a" if db is not None else "w") for path in paths]
+
+    tasks = [(policy, seed) for seed in seeds]
+    if db is not None:
+        # the games already stored aren't played again: a killed run goes on
+        # from what reached the database, not from what reached the output
+        stored = stored_games(db, [policy], size, policy_options)
+        tasks = [task for task in tasks if task not in stored]
+        if stored:
+            print(f"{len(seeds) - len(tasks)} games already in {db}, skipped", file=sys.stderr, flush=True)
+    chunks = [tasks[i:i + chunk] for i in range(0, len(tasks), chunk)]
+    options = {"size": size, "max_moves": max_moves, "policy": policy_options, "replays": db is not None}
+    store = None if db is None else GameStore(db, size, policy_options)
+    rules = {"rules": RULESET.name, "rules_hash": RULESET.hash}
+
+    games = moves = 0
+    start = last_report = time.perf_counter()
+    last_games = last_moves = 0
+    def print_throughput(now):
+        elapsed = now - last_report
+        print(
+            f"[{now - start:7.1f}s] {games}/{len(tasks)} games, "
+            f"{(games - last_games) / elapsed:.1f} games/s, {(moves - last_moves) / elapsed:.0f} moves/s",
+            file=sys.stderr, flush=True,
+        )
+    try:
+        with Pool(workers, _init_worker, (options,)) as pool:
+            for results in pool.imap_unordered(_play_chunk, chunks):
+                for r in results:
+                    if store:
+                        store.add(r)
+                        del r["directions"]
+                    if (r["strategy"], r["seed"]) not in written:
+                        f = files[r["seed"] % len(files)]
+                        f.write(json.dumps({**r, **rules}) + "\n")
+                    games += 1
+                    moves += r["moves"]
+                for f in files:
+                    f.flush()
+                now = time.perf_counter()
+                if now - last_report >= report:
+                    print_throughput(now)
+                    last_report, last_games, last_moves = now, games, moves
+    finally:
+        if out is not None:
+            for f in files:
+                f.close()
+        if store:
+            store.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"done: {games} games, {moves} moves in {elapsed:.1f}s "
+        f"({games / elapsed:.1f} games/s, {moves / elapsed:.0f} moves/s)",
+        file=sys.stderr, flush=True,
+    )
+    return games, moves
+
+def add_arguments(parser):
+    parser.add_argument("--policy", default="greedy", choices=STRATEGIES)
+    parser.add_argument("--seeds", type=parse_seeds, default=range(100), help='"first:last" (last excluded) or a number of games')
+    parser.add_argument("--out", default=None, help="output prefix, stdout if not given")
+    parser.add_argument("--shards", type=int, default=1, help="number of output files (with --out)")
+    parser.add_argument("--db", default=None, help="also store the games and their replays in this SQLite file (see fusion/store.py)")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk", type=int, default=4, help="games per task sent to a worker")
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between throughput reports on stderr")
+    parser.add_argument("--depth", type=int, default=2, help="expectimax depth")
+    parser.add_argument("--rollouts", type=int, default=20, help="rollouts per move")
+    parser.add_argument("--length", type=int, default=20, help="rollout length")
+    parser.add_argument("--ntuple", default=None, help="n-tuple network used by expectimax")
+
+def main(args):
+    try:
+        run(
+            args.policy,
+            args.seeds,
+            args.out,
+            shards=args.shards,
+            size=args.size,
+            workers=args.workers,
+            chunk=args.chunk,
+            max_moves=args.max_moves,
+            report=args.report,
+            db=args.db,
+            depth=args.depth,
+            rollouts=args.rollouts,
+            length=args.length,
+            ntuple=args.ntuple,
+        )
+    except BrokenPipeError:
+        # the reader went away (e.g. | head): stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Play many headless games and stream their stats as JSON lines.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,327 @@
+""" Game server: thousands of games for remote clients, over TCP with asyncio.
+
+A session is a headless engine Game (a tuple of nuclide codes and a seeded
+Random), never Tile objects. The protocol is binary:
+
+client -> server, one byte per command:
+    0 1 2 3     a move (left, up, right, down, as engine.DIRECTIONS)
+    NEW         a new game (the next seed)
+    SYNC        ask for the whole board
+
+server -> client:
+    START   "S", version, size, rules hash (8 bytes), seed (8 bytes), board
+    DELTA   "D", slides, merges, flags, then (from, to) for every sliding
+            tile, (cell, product) for every merge, (cell, code) of the
+            spawn, the score gained (2 bytes). flags: 1 game over
+    NOOP    "N": the move didn't move anything
+    BOARD   "B", score (4 bytes), board
+    FULL    "F": too many sessions, the connection is closed
+
+so a move is 1 byte up and about 10 down. apply_delta() rebuilds the board
+on the client. A client sending faster than it reads is slowed down by TCP:
+the server reads a bounded batch of commands, answers them in one write and
+waits for the socket buffer to drain before reading more. Sessions silent
+for --idle seconds are closed. --processes N runs N event loops sharing the
+port (SO_REUSEPORT), one per core:
+
+    python -m fusion.server serve --port 7048 --processes 4
+    python -m fusion.server load --port 7048 --sessions 2000 --seconds 10 --server-cores 4
+"""
+import argparse, asyncio, itertools, struct, sys, time
+from multiprocessing import Pool, Process
+from random import Random
+
+from fusion.engine import DIRECTIONS, Game, move_targets, reward
+from fusion.rules import RULESET
+
+VERSION = 1
+NEW, SYNC = 4, 5
+START = struct.Struct(">cBB8sQ")
+DELTA = struct.Struct(">cBBB")
+GAIN = struct.Struct(">H")
+SCORE = struct.Struct(">I")
+OVER = 1
+BATCH = 256 # commands read at once per session
+HIGH_WATER = 64 * 1024 # bytes waiting to be sent before a session stops reading
+
+
+def encode_start(game):
+    return START.pack(b"S", VERSION, game.size, bytes.fromhex(RULESET.hash[:16]), game.seed) + bytes(game.board)
+
+def encode_delta(before, direction, game):
+    """ Encode the move game just played from the board before. """
+    slides = move_targets(before, direction)
+    merges = [(cell, product) for _, _, product, cell in game.last_reactions]
+    spawn = next(((i, code) for i, (a, code) in enumerate(zip(game.afterstate, game.board)) if code and not a), (0, 0))
+    flags = OVER if game.is_over() else 0
+    data = [DELTA.pack(b"D", len(slides), len(merges), flags)]
+    data += [bytes(pair) for pair in slides]
+    data += [bytes(pair) for pair in merges]
+    data.append(bytes(spawn))
+    data.append(GAIN.pack(min(reward(game.last_reactions), 0xFFFF)))
+    return b"".join(data)
+
+def apply_delta(board, data, offset=0):
+    """ Return (board, gained, over, offset of the next message) of a DELTA at data[offset:]. """
+    _, slides, merges, flags = DELTA.unpack_from(data, offset)
+    offset += DELTA.size
+    new_board = list(board)
+    moved = []
+    for k in range(slides):
+        i, j = data[offset + 2 * k], data[offset + 2 * k + 1]
+        moved.append((j, board[i]))
+        new_board[i] = 0
+    for j, code in moved:
+        new_board[j] = code
+    offset += 2 * slides
+    for k in range(merges):
+        new_board[data[offset + 2 * k]] = data[offset + 2 * k + 1]
+    offset += 2 * merges
+    cell, code = data[offset], data[offset + 1]
+    if code:
+        new_board[cell] = code
+    gained, = GAIN.unpack_from(data, offset + 2)
+    return tuple(new_board), gained, bool(flags & OVER), offset + 2 + GAIN.size
+
+def message_size(data, offset, cells):
+    """ Return the size of the server message at data[offset:], None if it
+    isn't all there. cells is the board size of the session (for BOARD). """
+    if offset >= len(data):
+        return None
+    kind = data[offset:offset + 1]
+    if kind in (b"N", b"F"):
+        size = 1
+    elif kind == b"S":
+        if offset + START.size > len(data):
+            return None
+        size = START.size + data[offset + 2] ** 2
+    elif kind == b"B":
+        size = 1 + SCORE.size + cells
+    elif kind == b"D":
+        if offset + DELTA.size > len(data):
+            return None
+        size = DELTA.size + 2 * (data[offset + 1] + data[offset + 2]) + 2 + GAIN.size
+    else:
+        raise ValueError(f"unknown message {kind!r}")
+    return size if offset + size <= len(data) else None
+
+
+class Session:
+    __slots__ = ("game", "last_seen", "writer")
+
+    def __init__(self, size, seed, writer):
+        self.game = Game(size, seed)
+        self.last_seen = time.monotonic()
+        self.writer = writer
+
+
+class Server:
+    """ One event loop serving sessions; several can share the port. """
+
+    def __init__(self, size=4, max_sessions=10000, idle=60.0, seed=None, index=0, processes=1):
+        self.size = size
+        self.max_sessions = max_sessions
+        self.idle = idle
+        self.sessions = set()
+        if seed is None:
+            rng = Random()
+            self.seeds = iter(lambda: rng.getrandbits(63), None)
+        else:
+            # the seeds of a process never collide with the other processes'
+            self.seeds = itertools.count(seed + index, processes)
+        self.moves = self.evicted = self.rejected = 0
+
+    def command(self, session, command):
+        game = session.game
+        if command < len(DIRECTIONS):
+            before = game.board
+            if not game.step(DIRECTIONS[command]):
+                return b"N"
+            self.moves += 1
+            return encode_delta(before, DIRECTIONS[command], game)
+        if command == NEW:
+            session.game = Game(self.size, next(self.seeds))
+            return encode_start(session.game)
+        if command == SYNC:
+            return b"B" + SCORE.pack(game.score) + bytes(game.board)
+        raise ValueError(f"unknown command {command}")
+
+    async def handle(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected += 1
+            writer.write(b"F")
+            writer.close()
+            return
+        writer.transport.set_write_buffer_limits(HIGH_WATER)
+        session = Session(self.size, next(self.seeds), writer)
+        self.sessions.add(session)
+        try:
+            writer.write(encode_start(session.game))
+            while True:
+                data = await reader.read(BATCH)
+                if not data:
+                    break
+                session.last_seen = time.monotonic()
+                writer.write(b"".join(self.command(session, command) for command in data))
+                # backpressure: a client that doesn't read stops being read
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def evict_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle, 1.0))
+            now = time.monotonic()
+            for session in [s for s in self.sessions if now - s.last_seen > self.idle]:
+                self.evicted += 1
+                self.sessions.discard(session)
+                session.writer.close()
+
+    async def report(self, index, every):
+        last, last_moves = time.perf_counter(), 0
+        while True:
+            await asyncio.sleep(every)
+            now = time.perf_counter()
+            print(
+                f"[process {index}] {len(self.sessions)} sessions, {(self.moves - last_moves) / (now - last):.0f} moves/s, "
+                f"{self.evicted} evicted, {self.rejected} rejected",
+                file=sys.stderr, flush=True,
+            )
+            last, last_moves = now, self.moves
+
+    async def serve(self, host, port, index=0, reuse_port=False, report=5.0):
+        server = await asyncio.start_server(self.handle, host, port, reuse_port=reuse_port, limit=BATCH)
+        # kept referenced, the event loop only holds weak references to tasks
+        self.tasks = [asyncio.create_task(self.evict_idle())]
+        if report:
+            self.tasks.append(asyncio.create_task(self.report(index, report)))
+        async with server:
+            await server.serve_forever()
+
+def _serve(host, port, index, processes, report, options):
+    server = Server(index=index, processes=processes, **options)
+    try:
+        asyncio.run(server.serve(host, port, index, processes > 1, report))
+    except KeyboardInterrupt:
+        pass
+
+def serve(host="127.0.0.1", port=7048, processes=1, report=5.0, **options):
+    """ Serve on processes event loops (processes), until interrupted. """
+    if processes == 1:
+        _serve(host, port, 0, 1, report, options)
+        return
+    workers = [Process(target=_serve, args=(host, port, k, processes, report, options)) for k in range(processes)]
+    for p in workers:
+        p.start()
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        for p in workers:
+            p.join()
+
+
+async def _client(host, port, deadline, rng, check, counts):
+    """ Play random moves on one session until deadline. """
+    reader, writer = await asyncio.open_connection(host, port)
+    buffer, cells, board = b"", None, None
+    async def receive():
+        nonlocal buffer
+        while True:
+            size = message_size(buffer, 0, cells)
+            if size:
+                message, buffer = buffer[:size], buffer[size:]
+                return message
+            data = await reader.read(4096)
+            if not data:
+                raise ConnectionError("closed by the server")
+            buffer += data
+    try:
+        message = await receive()
+        if message[:1] == b"F":
+            counts["rejected"] += 1
+            return
+        cells = message[2] ** 2
+        board = tuple(message[START.size:])
+        counts["sessions"] += 1
+        while time.perf_counter() < deadline:
+            writer.write(bytes([rng.randrange(len(DIRECTIONS))]))
+            message = await receive()
+            if message[:1] == b"N":
+                continue
+            board, _, over, _ = apply_delta(board, message)
+            counts["moves"] += 1
+            if check and counts["moves"] % check == 0:
+                writer.write(bytes([SYNC]))
+                message = await receive()
+                if tuple(message[1 + SCORE.size:]) != board:
+                    counts["mismatches"] += 1
+                    board = tuple(message[1 + SCORE.size:])
+            if over:
+                writer.write(bytes([NEW]))
+                message = await receive()
+                board = tuple(message[START.size:])
+                counts["games"] += 1
+    except ConnectionError:
+        counts["errors"] += 1
+    finally:
+        writer.close()
+
+def _load(task):
+    host, port, sessions, seconds, seed, check = task
+    async def main():
+        counts = dict.fromkeys(["sessions", "moves", "games", "rejected", "errors", "mismatches"], 0)
+        deadline = time.perf_counter() + seconds
+        rng = Random(seed)
+        await asyncio.gather(*(_client(host, port, deadline, Random(rng.random()), check, counts) for _ in range(sessions)))
+        return counts
+    return asyncio.run(main())
+
+def load(host="127.0.0.1", port=7048, sessions=1000, seconds=10.0, processes=1, server_cores=1, check=0, seed=0):
+    """ Open sessions (split over processes) playing random moves, print the throughput. """
+    tasks = [(host, port, sessions // processes + (k < sessions % processes), seconds, seed + k, check) for k in range(processes)]
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        results = pool.map(_load, tasks)
+    elapsed = time.perf_counter() - start
+    counts = {key: sum(r[key] for r in results) for key in results[0]}
+    moves_per_sec = counts["moves"] / elapsed
+    print(
+        f"{counts['sessions']} sessions ({counts['rejected']} rejected, {counts['errors']} errors), "
+        f"{counts['moves']} moves, {counts['games']} games in {elapsed:.1f}s: "
+        f"{moves_per_sec:.0f} moves/s, {moves_per_sec / server_cores:.0f} moves/s per server core"
+        + (f", {counts['mismatches']} boards out of sync" if check else "")
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve games over TCP, or load test a server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("serve")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=7048)
+    p.add_argument("--processes", type=int, default=1, help="event loops sharing the port, one per core")
+    p.add_argument("--size", type=int, default=4)
+    p.add_argument("--max-sessions", type=int, default=10000, help="per process")
+    p.add_argument("--idle", type=float, default=60.0, help="seconds before a silent session is closed")
+    p.add_argument("--seed", type=int, default=None, help="first seed (random seeds if not given)")
+    p.add_argument("--report", type=float, default=5.0, help="seconds between reports on stderr")
+    p = commands.add_parser("load")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=7048)
+    p.add_argument("--sessions", type=int, default=1000)
+    p.add_argument("--seconds", type=float, default=10.0)
+    p.add_argument("--processes", type=int, default=1, help="client processes")
+    p.add_argument("--server-cores", type=int, default=1, help="processes of the server, for the per core figure")
+    p.add_argument("--check", type=int, default=0, help="compare the board with the server's every CHECK moves")
+    p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.processes, args.report, size=args.size, max_sessions=args.max_sessions, idle=args.idle, seed=args.seed)
+    else:
+        load(args.host, args.port, args.sessions, args.seconds, args.processes, args.server_cores, args.check, args.seed)
@@ -0,0 +1,184 @@
+""" Binary snapshots of engine games: save a game in progress, load it back.
+
+A snapshot file is a header (format version, board size, rule-set hash,
+number of reaction counters) followed by fixed size records, one per game:
+
+    seed, flags, moves, score           the seed may be None (flags & HAS_SEED),
+                                        or an int in [0, 2**64)
+    board                               one byte per cell, the nuclide codes
+    RNG state                           the 625 words of the Mersenne Twister
+                                        and gauss_next (flags & HAS_GAUSS)
+    reactions                           one counter per rule, in key order
+
+2.6 KB per 4x4 game, almost all of it the RNG, so a loaded game goes on
+with exactly the spawns and branches it would have had. Since the records
+have one size per file, a file of many snapshots needs no index: record k
+is at header + k * record size, appending is a write at the end, and
+reading one is a seek and a read.
+
+    save(game, "bug.snap")
+    game = load("bug.snap")
+
+    with Snapshots("positions.snap", "a") as snapshots:
+        snapshots.append(game)
+    game = Snapshots("positions.snap")[1234]
+"""
+import os, struct
+from collections import Counter
+from random import Random
+
+from fusion.engine import Game
+from fusion.rules import REACTION_ORDER, RULESET
+
+MAGIC = b"NFSN"
+VERSION = 1
+HEADER = struct.Struct("<4sHB20sH") # magic, version, size, rules hash, reaction counters
+HAS_SEED, HAS_GAUSS = 1, 2
+MT_WORDS = 625 # Random.getstate()[1]: 624 words and the position in them
+
+
+def record_struct(size):
+    return struct.Struct(f"<QBIQ{size * size}s{MT_WORDS}Id{len(REACTION_ORDER)}I")
+
+def header(size):
+    return HEADER.pack(MAGIC, VERSION, size, bytes.fromhex(RULESET.hash), len(REACTION_ORDER))
+
+def read_header(data, path):
+    """ Return the board size of a snapshot file header, checking it can be loaded here. """
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a snapshot file")
+    magic, version, size, rules, reactions = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a snapshot file")
+    if version != VERSION:
+        raise ValueError(f"{path} is a version {version} snapshot, this is version {VERSION}")
+    if rules != bytes.fromhex(RULESET.hash) or reactions != len(REACTION_ORDER):
+        raise ValueError(f"{path} was saved with other rules")
+    return size
+
+
+def pack(game, record=None):
+    record = record or record_struct(game.size)
+    if game.seed is not None and not (isinstance(game.seed, int) and 0 <= game.seed < 2 ** 64):
+        raise ValueError(f"can't save the seed {game.seed!r}: only None or an int in [0, 2**64)")
+    version, state, gauss = game.rng.getstate()
+    flags = (HAS_SEED if game.seed is not None else 0) | (HAS_GAUSS if gauss is not None else 0)
+    return record.pack(
+        0 if game.seed is None else game.seed, flags, game.moves, game.score, bytes(game.board),
+        *state, gauss or 0.0, *(game.reactions.get(key, 0) for key in REACTION_ORDER),
+    )
+
+def unpack(data, size, record=None, offset=0):
+    """ Return the Game of a record at data[offset:]. """
+    record = record or record_struct(size)
+    values = record.unpack_from(data, offset)
+    seed, flags, moves, score, board = values[:5]
+    state = values[5:5 + MT_WORDS]
+    gauss = values[5 + MT_WORDS]
+    counts = values[6 + MT_WORDS:]
+
+    # not Random(): seeding it from the OS would take longer than all the rest
+    rng = Random.__new__(Random)
+    rng.setstate((3, state, gauss if flags & HAS_GAUSS else None))
+    return Game(
+        size, seed if flags & HAS_SEED else None, rng=rng, board=tuple(board), moves=moves, score=score,
+        reactions=Counter({key: n for key, n in zip(REACTION_ORDER, counts) if n}),
+    )
+
+
+def save(game, path):
+    """ Write one game to path, atomically. """
+    with open(path + ".tmp", "wb") as f:
+        f.write(header(game.size) + pack(game))
+    os.replace(path + ".tmp", path)
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return unpack(data, read_header(data, path), offset=HEADER.size)
+
+
+class Snapshots:
+    """ A file of many snapshots: mode "r" to read, "a" to append (and read). """
+
+    def __init__(self, path, mode="r", size=4):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if mode == "r" or exists:
+            self.file = open(path, "rb" if mode == "r" else "r+b", buffering=0)
+            self.size = read_header(self.file.read(HEADER.size), path)
+        else:
+            self.file = open(path, "w+b", buffering=0)
+            self.size = size
+            self.file.write(header(size))
+        self.record = record_struct(self.size)
+        # a record cut by a crash is ignored, and overwritten by the next append
+        self.count = (os.fstat(self.file.fileno()).st_size - HEADER.size) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError("no such snapshot")
+        self.file.seek(HEADER.size + k * self.record.size)
+        return unpack(self.file.read(self.record.size), self.size, self.record)
+
+    def append(self, game):
+        """ Add a game, return its index. """
+        return self.extend([game])
+
+    def extend(self, games):
+        """ Add games in one write, return the index of the first one. """
+        if any(game.size != self.size for game in games):
+            raise ValueError(f"{self.path} holds {self.size}x{self.size} games")
+        first = self.count
+        self.file.seek(HEADER.size + first * self.record.size)
+        self.file.write(b"".join(pack(game, self.record) for game in games))
+        self.count += len(games)
+        return first
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse, time
+    from random import choice
+
+    parser = argparse.ArgumentParser(description="Save random positions and time loading them back.")
+    parser.add_argument("path")
+    parser.add_argument("--games", type=int, default=1000)
+    args = parser.parse_args()
+
+    with Snapshots(args.path, "a") as snapshots:
+        games = []
+        for seed in range(args.games):
+            game = Game(snapshots.size, seed)
+            for _ in range(seed % 200):
+                if game.is_over():
+                    break
+                game.step(choice(game.legal_moves()))
+            games.append(game)
+        start = time.perf_counter()
+        snapshots.extend(games)
+        saved = time.perf_counter() - start
+
+    snapshots = Snapshots(args.path)
+    indices = [seed * 7919 % len(snapshots) for seed in range(args.games)]
+    start = time.perf_counter()
+    for k in indices:
+        snapshots[k]
+    loaded = time.perf_counter() - start
+    print(
+        f"{len(snapshots)} snapshots, {snapshots.record.size} bytes each: "
+        f"{1e6 * saved / args.games:.1f} us to save, {1e6 * loaded / args.games:.1f} us to load at random"
+    )
@@ -0,0 +1,368 @@
+""" Exact solver for small grids (2x2 and 3x3).
+
+Every reachable board is enumerated breadth first and stored, sorted, in a
+memory-mapped .npy file, so the state space is not limited by RAM. The
+transitions are then written once to disk and value iteration runs on them
+with numpy, split by state ranges across all cores. Every phase writes a
+checkpoint in meta.json and a killed run resumes where it stopped.
+
+    python -m fusion.solver --size 2 --out solver_2x2
+    python -m fusion.solver --size 3 --out solver_3x3 --objective reach --target C
+"""
+import argparse, json, os, time
+from multiprocessing import Pool
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from fusion.engine import DIRECTIONS, move_outcomes, spawn_outcomes
+from fusion.rules import NUCLIDES, nuclide_name, rules_hash
+
+BASE = len(NUCLIDES) + 1
+CHUNK = 1 << 15
+TERMINAL = 255
+
+
+def encode(board):
+    key = 0
+    for code in reversed(board):
+        key = key * BASE + code
+    return key
+
+def decode(key, size):
+    board = []
+    for _ in range(size * size):
+        key, code = divmod(int(key), BASE)
+        board.append(code)
+    return tuple(board)
+
+def initial_states(size):
+    """ Return {board: probability} of the first position of a game. """
+    states = {}
+    for p1, board in spawn_outcomes((0,) * (size * size)):
+        for p2, board2 in spawn_outcomes(board):
+            states[board2] = states.get(board2, 0) + p1 * p2
+    return states
+
+def successors(board):
+    """ Yield (direction index, probability, next board) for every legal move. """
+    for d, direction in enumerate(DIRECTIONS):
+        outcomes = move_outcomes(board, direction)
+        if outcomes[0][1] != board:
+            for p_move, after, _ in outcomes:
+                for p, next_board in spawn_outcomes(after):
+                    yield d, p_move * p, next_board
+
+def highest_codes(keys, size):
+    """ Return the highest nuclide code of every encoded board. """
+    keys = np.asarray(keys, dtype=np.uint64)
+    highest = np.zeros(len(keys), dtype=np.uint64)
+    for _ in range(size * size):
+        highest = np.maximum(highest, keys % np.uint64(BASE))
+        keys = keys // np.uint64(BASE)
+    return highest
+
+def parse_target(text):
+    """ Return the code of a nuclide given as "Si-28" or just "Si" (lightest isotope). """
+    for code in range(1, BASE):
+        name = nuclide_name(code)
+        if text in (name, name.split("-")[0]):
+            return code
+    raise ValueError(f"unknown nuclide: {text}")
+
+
+# checkpoints
+
+def load_meta(out):
+    path = os.path.join(out, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_meta(out, meta):
+    path = os.path.join(out, "meta.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def save_array(path, array):
+    """ Write an array to a .npy file atomically. """
+    np.save(path + ".tmp.npy", array)
+    os.replace(path + ".tmp.npy", path)
+
+
+# enumeration
+
+def _level_path(out, name, level):
+    return os.path.join(out, f"{name}_{level:04d}.npy")
+
+def _expand(args):
+    out, size, level, lo, hi = args
+    frontier = np.load(_level_path(out, "frontier", level), mmap_mode="r")
+    keys = set()
+    for key in frontier[lo:hi]:
+        for _, _, next_board in successors(decode(key, size)):
+            keys.add(encode(next_board))
+    return np.array(sorted(keys), dtype=np.uint64)
+
+def merge_sorted(states_path, new, out_path):
+    """ Merge a sorted array into a sorted .npy file without loading the file. """
+    states = np.load(states_path, mmap_mode="r")
+    merged = open_memmap(out_path + ".tmp.npy", mode="w+", dtype=np.uint64, shape=(len(states) + len(new),))
+    for lo in range(0, len(states), CHUNK):
+        block = states[lo:lo + CHUNK]
+        merged[np.arange(lo, lo + len(block)) + np.searchsorted(new, block)] = block
+    merged[np.searchsorted(states, new) + np.arange(len(new))] = new
+    merged.flush()
+    del merged
+    os.replace(out_path + ".tmp.npy", out_path)
+
+def enumerate_states(out, size, meta, pool):
+    """ Breadth first search, every level is a new pair of sorted files.
+
+    The meta.json checkpoint only moves to the next level once both files are
+    written, so a run killed in the middle of a level redoes just that level.
+    """
+    level = meta["level"]
+    if level == 0 and not os.path.exists(_level_path(out, "states", 0)):
+        keys = np.array(sorted(encode(b) for b in initial_states(size)), dtype=np.uint64)
+        save_array(_level_path(out, "frontier", 0), keys)
+        save_array(_level_path(out, "states", 0), keys)
+
+    while True:
+        frontier = np.load(_level_path(out, "frontier", level), mmap_mode="r")
+        if len(frontier) == 0:
+            break
+        tasks = [(out, size, level, lo, min(lo + CHUNK, len(frontier))) for lo in range(0, len(frontier), CHUNK)]
+        new = np.unique(np.concatenate([np.empty(0, np.uint64)] + pool.map(_expand, tasks)))
+        del frontier
+
+        # drop the boards that were already visited
+        states_path = _level_path(out, "states", level)
+        states = np.load(states_path, mmap_mode="r")
+        idx = np.searchsorted(states, new)
+        seen = idx < len(states)
+        seen[seen] = states[idx[seen]] == new[seen]
+        new = new[~seen]
+        del states
+
+        merge_sorted(states_path, new, _level_path(out, "states", level + 1))
+        save_array(_level_path(out, "frontier", level + 1), new)
+        level += 1
+        meta["level"] = level
+        meta["num_states"] = int(len(np.load(_level_path(out, "states", level), mmap_mode="r")))
+        save_meta(out, meta)
+        os.remove(states_path)
+        os.remove(_level_path(out, "frontier", level - 1))
+        print(f"level {level}: {len(new)} new, {meta['num_states']} states")
+
+    # the phase first: from here on a resumed run only has to finish the files
+    meta["phase"] = "transitions"
+    save_meta(out, meta)
+    finish_states(out, level)
+
+def finish_states(out, level):
+    """ Move the last level's states to states.npy and drop its (empty)
+    frontier; does nothing for the steps already done, so it can be redone. """
+    if not os.path.exists(os.path.join(out, "states.npy")):
+        os.replace(_level_path(out, "states", level), os.path.join(out, "states.npy"))
+    if os.path.exists(_level_path(out, "frontier", level)):
+        os.remove(_level_path(out, "frontier", level))
+
+
+# transitions
+
+def _chunk_path(out, k, name):
+    return os.path.join(out, "transitions", f"{k:06d}_{name}.npy")
+
+def _transitions(args):
+    """ Write, for a range of states, the successors of every (state, direction) slot. """
+    out, size, k, lo, hi = args
+    states = np.load(os.path.join(out, "states.npy"), mmap_mode="r")
+    counts = np.zeros((hi - lo, len(DIRECTIONS)), dtype=np.int32)
+    succ, prob = [], []
+    for s in range(lo, hi):
+        for d, p, next_board in successors(decode(states[s], size)):
+            counts[s - lo, d] += 1
+            succ.append(encode(next_board))
+            prob.append(p)
+    succ = np.searchsorted(states, np.array(succ, dtype=np.uint64)).astype(np.int64)
+    save_array(_chunk_path(out, k, "succ"), succ)
+    save_array(_chunk_path(out, k, "prob"), np.array(prob, dtype=np.float64))
+    # counts last: its presence marks the chunk as done
+    save_array(_chunk_path(out, k, "counts"), counts)
+    return k
+
+def build_transitions(out, size, meta, pool):
+    finish_states(out, meta["level"]) # if the run was killed right after the enumeration
+    os.makedirs(os.path.join(out, "transitions"), exist_ok=True)
+    n = meta["num_states"]
+    tasks = [
+        (out, size, k, lo, min(lo + CHUNK, n))
+        for k, lo in enumerate(range(0, n, CHUNK))
+        if not os.path.exists(_chunk_path(out, k, "counts"))
+    ]
+    for done, _ in enumerate(pool.imap_unordered(_transitions, tasks), 1):
+        print(f"transitions: {done}/{len(tasks)} chunks")
+    meta["phase"] = "iterate"
+    save_meta(out, meta)
+
+
+# value iteration
+
+def _sweep(args):
+    out, size, k, lo, hi, objective, target, discount = args
+    values = np.load(os.path.join(out, "values.npy"), mmap_mode="r")
+    next_values = np.load(os.path.join(out, "values_next.npy"), mmap_mode="r+")
+    policy = np.load(os.path.join(out, "policy.npy"), mmap_mode="r+")
+    counts = np.load(_chunk_path(out, k, "counts")).reshape(-1)
+    succ = np.load(_chunk_path(out, k, "succ"), mmap_mode="r")
+    prob = np.load(_chunk_path(out, k, "prob"), mmap_mode="r")
+
+    slots = np.repeat(np.arange(len(counts)), counts)
+    expected = np.bincount(slots, weights=prob * values[succ], minlength=len(counts))
+    q = 1 + discount * expected if objective == "moves" else expected
+    q[counts == 0] = -np.inf
+    q = q.reshape(-1, len(DIRECTIONS))
+
+    best = q.argmax(axis=1)
+    new = q[np.arange(len(q)), best]
+    terminal = np.isneginf(new)
+    new[terminal] = 0
+    best[terminal] = TERMINAL
+    if objective == "reach":
+        states = np.load(os.path.join(out, "states.npy"), mmap_mode="r")
+        reached = highest_codes(states[lo:hi], size) >= target
+        new[reached] = 1
+        best[reached] = TERMINAL
+
+    delta = float(np.abs(new - values[lo:hi]).max(initial=0))
+    next_values[lo:hi] = new
+    policy[lo:hi] = best
+    next_values.flush()
+    policy.flush()
+    return delta
+
+def iterate_values(out, size, meta, pool, tolerance, max_sweeps):
+    n = meta["num_states"]
+    values_path = os.path.join(out, "values.npy")
+    next_path = os.path.join(out, "values_next.npy")
+    policy_path = os.path.join(out, "policy.npy")
+    if not os.path.exists(values_path):
+        save_array(values_path, np.zeros(n))
+    if not os.path.exists(policy_path):
+        save_array(policy_path, np.full(n, TERMINAL, dtype=np.uint8))
+
+    target = meta["target"]
+    tasks = [
+        (out, size, k, lo, min(lo + CHUNK, n), meta["objective"], target, meta["discount"])
+        for k, lo in enumerate(range(0, n, CHUNK))
+    ]
+    while meta["sweep"] < max_sweeps:
+        save_array(next_path, np.zeros(n))
+        delta = max(pool.map(_sweep, tasks), default=0)
+        os.replace(next_path, values_path)
+        meta["sweep"] += 1
+        meta["delta"] = delta
+        save_meta(out, meta)
+        print(f"sweep {meta['sweep']}: delta {delta:.3g}")
+        if delta < tolerance:
+            meta["phase"] = "done"
+            save_meta(out, meta)
+            break
+
+
+class Oracle:
+    """ Exact values and optimal moves read from a finished solver directory. """
+
+    def __init__(self, out):
+        self.meta = load_meta(out)
+        self.size = self.meta["size"]
+        self.states = np.load(os.path.join(out, "states.npy"), mmap_mode="r")
+        self.values = np.load(os.path.join(out, "values.npy"), mmap_mode="r")
+        self.policy = np.load(os.path.join(out, "policy.npy"), mmap_mode="r")
+
+    def index(self, board):
+        key = np.uint64(encode(board))
+        i = int(np.searchsorted(self.states, key))
+        if i == len(self.states) or self.states[i] != key:
+            raise KeyError(f"unreachable board: {board}")
+        return i
+
+    def value(self, board):
+        return float(self.values[self.index(board)])
+
+    def best_move(self, board):
+        """ Return the optimal direction, None if the game is over. """
+        d = int(self.policy[self.index(board)])
+        return None if d == TERMINAL else DIRECTIONS[d]
+
+    def expected_outcome(self):
+        """ Return the optimal expected value from the start of a game. """
+        return sum(p * self.value(board) for board, p in initial_states(self.size).items())
+
+
+def solve(out, size, objective="moves", target=None, discount=0.999, tolerance=1e-9, max_sweeps=100000, workers=None):
+    if BASE ** (size * size) >= 2 ** 64:
+        raise ValueError(f"a {size}x{size} board doesn't fit in 64 bits")
+    os.makedirs(out, exist_ok=True)
+
+    meta = {
+        "size": size,
+        "rules": rules_hash(),
+        "objective": objective,
+        "target": target if target is not None else BASE - 1,
+        "discount": discount,
+        "phase": "enumerate",
+        "level": 0,
+        "num_states": 0,
+        "sweep": 0,
+        "delta": None,
+    }
+    saved = load_meta(out)
+    if saved:
+        for key in ["size", "rules", "objective", "target", "discount"]:
+            if saved[key] != meta[key]:
+                raise ValueError(f"{out} was started with {key}={saved[key]!r}, not {meta[key]!r}")
+        meta = saved
+        print(f"resuming from phase {meta['phase']}")
+    save_meta(out, meta)
+
+    start = time.time()
+    with Pool(workers or os.cpu_count()) as pool:
+        if meta["phase"] == "enumerate":
+            enumerate_states(out, size, meta, pool)
+        if meta["phase"] == "transitions":
+            build_transitions(out, size, meta, pool)
+        if meta["phase"] == "iterate":
+            iterate_values(out, size, meta, pool, tolerance, max_sweeps)
+    print(f"solved in {time.time() - start:.1f}s")
+    return Oracle(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exact solver for small fusion grids.")
+    parser.add_argument("--size", type=int, default=2, choices=[2, 3])
+    parser.add_argument("--out", default=None, help="directory of the state files (default: solver_<size>x<size>)")
+    parser.add_argument("--objective", default="moves", choices=["moves", "reach"],
+                        help="moves: expected (discounted) moves survived, reach: probability to reach --target")
+    parser.add_argument("--target", default=None, help="nuclide to reach, e.g. Si-28 or C")
+    parser.add_argument("--discount", type=float, default=0.999)
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    parser.add_argument("--max-sweeps", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    oracle = solve(
+        args.out or f"solver_{args.size}x{args.size}",
+        args.size,
+        objective=args.objective,
+        target=parse_target(args.target) if args.target else None,
+        discount=args.discount,
+        tolerance=args.tolerance,
+        max_sweeps=args.max_sweeps,
+        workers=args.workers,
+    )
+    print(f"states: {oracle.meta['num_states']}, sweeps: {oracle.meta['sweep']}")
+    print(f"expected outcome: {oracle.expected_outcome():.6f}")
@@ -0,0 +1,291 @@
+""" Store of finished games in SQLite: stats, reaction counts and replays.
+
+The runners (fusion/runner.py, fusion/tournament.py with --db) hand every
+game to a GameStore, which only appends it to a list: full batches go
+through a queue to a writer thread that inserts each one in a single
+transaction, so neither the pool nor the loop reading its results ever
+waits for the disk. The database is in WAL mode, so it can be queried while
+a run is writing to it.
+
+    games       one narrow row per game, the rule set and policy as ids
+    replays     the moves of a game, 2 bits each, apart so scans skip them
+    rulesets    hash, name and the order of the reaction counters
+    policies    strategy name and options (expectimax depth, ...)
+
+The two indexes are those of the queries below, so neither sorts the games:
+best_runs() reads the top of (ruleset, highest, score) once per nuclide at
+or above the one asked for and merges those few rows, and median_survival()
+reads the middle of (ruleset, policy, moves) for every rule set and policy.
+
+    python -m fusion.store games.db best Si-28 --top 10
+    python -m fusion.store games.db median
+    python -m fusion.store games.db replay 1234
+"""
+import argparse, json, queue, sqlite3, threading, time
+from array import array
+
+from fusion.engine import DIRECTIONS, Game
+from fusion.rules import REACTION_ORDER, RULESET
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rulesets (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    reactions TEXT NOT NULL -- JSON list of the rule keys, the order of games.reactions
+);
+CREATE TABLE IF NOT EXISTS policies (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    options TEXT NOT NULL,
+    UNIQUE (name, options)
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    ruleset INTEGER NOT NULL REFERENCES rulesets,
+    policy INTEGER NOT NULL REFERENCES policies,
+    size INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    highest INTEGER NOT NULL, -- nuclide code
+    over INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    reactions BLOB NOT NULL -- one uint32 per rule
+);
+CREATE TABLE IF NOT EXISTS replays (
+    game INTEGER PRIMARY KEY REFERENCES games,
+    directions BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_best ON games (ruleset, highest, score);
+CREATE INDEX IF NOT EXISTS games_survival ON games (ruleset, policy, moves);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path, isolation_level=None) # transactions are explicit
+    db.execute("PRAGMA journal_mode = WAL")
+    # a crash can lose the last transactions, never corrupt the file
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("PRAGMA busy_timeout = 10000")
+    db.executescript(SCHEMA)
+    return db
+
+def ruleset_id(db):
+    """ Return the id of the rule set in use, adding it if it's new. """
+    db.execute(
+        "INSERT OR IGNORE INTO rulesets (hash, name, reactions) VALUES (?, ?, ?)",
+        (RULESET.hash, RULESET.name, json.dumps(REACTION_ORDER)),
+    )
+    return db.execute("SELECT id FROM rulesets WHERE hash = ?", (RULESET.hash,)).fetchone()[0]
+
+def policy_id(db, name, options):
+    db.execute("INSERT OR IGNORE INTO policies (name, options) VALUES (?, ?)", (name, options))
+    return db.execute("SELECT id FROM policies WHERE name = ? AND options = ?", (name, options)).fetchone()[0]
+
+
+def options_key(policy_options):
+    return json.dumps(policy_options or {}, sort_keys=True)
+
+def stored_games(path, strategies, size=4, policy_options=None):
+    """ Return the (strategy, seed) pairs already in the store at path, played
+    with the rule set in use, on size x size boards and with policy_options.
+    A killed run resumes from these: the games it had only buffered are
+    in its JSONL output but not here, so they're played again. """
+    db = connect(path)
+    try:
+        return set(db.execute(
+            f"SELECT p.name, g.seed FROM games g JOIN policies p ON p.id = g.policy "
+            f"WHERE g.ruleset = ? AND g.size = ? AND p.options = ? AND p.name IN ({', '.join('?' * len(strategies))})",
+            (ruleset_id(db), size, options_key(policy_options), *strategies),
+        ).fetchall())
+    finally:
+        db.close()
+
+def pack_directions(directions):
+    """ Return the moves of a game as bytes, four per byte. """
+    data = bytearray((len(directions) + 3) // 4)
+    for k, direction in enumerate(directions):
+        data[k >> 2] |= DIRECTIONS.index(direction) << (2 * (k & 3))
+    return bytes(data)
+
+def unpack_directions(data, moves):
+    return [DIRECTIONS[data[k >> 2] >> (2 * (k & 3)) & 3] for k in range(moves)]
+
+def pack_reactions(reactions):
+    return array("I", (reactions.get(key, 0) for key in REACTION_ORDER)).tobytes()
+
+
+class GameStore(threading.Thread):
+    """ Collects finished games in batches, written by this (background) thread. """
+
+    def __init__(self, path, size=4, policy_options=None, batch=1000, interval=2.0):
+        super().__init__(daemon=True)
+        self.path = path
+        self.size = size
+        self.options = options_key(policy_options)
+        self.batch = batch
+        self.interval = interval # seconds a partial batch may wait
+        self.rows = []
+        self.last_flush = time.monotonic()
+        # never bounded: add() must not wait, and a batch is written much
+        # faster than the pool plays it
+        self.queue = queue.Queue()
+        self.written = 0
+        self.error = None
+        self.start()
+
+    def add(self, result):
+        """ Queue a result of tournament.play_game (with "strategy" and,
+        for a replay, "directions" packed by pack_directions). """
+        self.rows.append((
+            result["strategy"], self.size, result["seed"], result["moves"], result["score"],
+            result["highest_code"], result["over"], result["duration"],
+            pack_reactions(result["reactions"]), result.get("directions"),
+        ))
+        if len(self.rows) >= self.batch or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.error:
+            raise self.error
+        if self.rows:
+            self.queue.put(self.rows)
+            self.rows = []
+        self.last_flush = time.monotonic()
+
+    def run(self):
+        try:
+            db = connect(self.path)
+            ruleset = ruleset_id(db)
+            policies = {}
+            while (rows := self.queue.get()) is not None:
+                for name in {row[0] for row in rows} - policies.keys():
+                    policies[name] = policy_id(db, name, self.options)
+                # IMMEDIATE: no other writer between reading the last id and inserting
+                db.execute("BEGIN IMMEDIATE")
+                first = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM games").fetchone()[0]
+                db.executemany(
+                    "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((first + k, ruleset, policies[row[0]], *row[1:-1]) for k, row in enumerate(rows)),
+                )
+                db.executemany(
+                    "INSERT INTO replays VALUES (?, ?)",
+                    ((first + k, row[-1]) for k, row in enumerate(rows) if row[-1] is not None),
+                )
+                db.execute("COMMIT")
+                self.written += len(rows)
+            db.close()
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """ Write what's left and wait for the thread to finish. """
+        self.flush()
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+
+def nuclide_code(name):
+    """ Return the code of a nuclide named like "Si-28". """
+    for code in range(1, len(RULESET.nuclides) + 1):
+        if RULESET.nuclide_name(code).lower() == name.lower():
+            return code
+    raise ValueError(f"no nuclide {name} in the rule set {RULESET.name}")
+
+def best_runs(db, nuclide, top=10):
+    """ Return the best scoring games that reached nuclide (a code) with the
+    rule set in use: (id, policy, seed, moves, score, highest). """
+    # highest >= nuclide is a range: the index is in score order only for
+    # one highest at a time, so take the top of each and merge them
+    ruleset = ruleset_id(db)
+    runs = []
+    for highest in range(nuclide, len(RULESET.nuclides) + 1):
+        runs += db.execute(
+            "SELECT g.id, p.name, g.seed, g.moves, g.score, g.highest FROM games g JOIN policies p ON p.id = g.policy "
+            "WHERE g.ruleset = ? AND g.highest = ? ORDER BY g.score DESC LIMIT ?",
+            (ruleset, highest, top),
+        ).fetchall()
+    return sorted(runs, key=lambda run: run[4], reverse=True)[:top]
+
+def median_survival(db):
+    """ Return (rule set, policy, options, games, median moves) for every rule set and policy. """
+    medians = []
+    groups = db.execute(
+        "SELECT g.ruleset, r.name, g.policy, p.name, p.options, g.n FROM "
+        "(SELECT ruleset, policy, COUNT(*) AS n FROM games GROUP BY ruleset, policy) g "
+        "JOIN rulesets r ON r.id = g.ruleset JOIN policies p ON p.id = g.policy"
+    ).fetchall()
+    for ruleset, ruleset_name, policy, name, options, n in groups:
+        # the middle entry of the index, no sort
+        median = db.execute(
+            "SELECT moves FROM games WHERE ruleset = ? AND policy = ? ORDER BY moves LIMIT 1 OFFSET ?",
+            (ruleset, policy, (n - 1) // 2),
+        ).fetchone()[0]
+        medians.append((ruleset_name, name, options, n, median))
+    return medians
+
+def load_games(db, top=None, sort="score", strategy=None):
+    """ Return the stored games of the rule set in use with a replay, best
+    first by sort, as tournament results with their "directions". """
+    where, values = "g.ruleset = ?", [ruleset_id(db)]
+    if strategy:
+        where += " AND p.name = ?"
+        values.append(strategy)
+    rows = db.execute(
+        f"SELECT p.name, g.seed, g.moves, g.score, g.highest, r.directions FROM games g "
+        f"JOIN policies p ON p.id = g.policy JOIN replays r ON r.game = g.id "
+        f"WHERE {where} ORDER BY g.{'highest' if sort == 'highest_code' else sort} DESC LIMIT ?",
+        (*values, top or -1),
+    ).fetchall()
+    return [
+        {"strategy": name, "seed": seed, "moves": moves, "score": score, "highest_code": highest,
+         "directions": unpack_directions(data, moves)}
+        for name, seed, moves, score, highest, data in rows
+    ]
+
+def load_replay(db, game_id):
+    """ Return the Game of a stored game played again from its seed and moves. """
+    row = db.execute(
+        "SELECT g.size, g.seed, g.moves, r.directions FROM games g JOIN replays r ON r.game = g.id WHERE g.id = ?",
+        (game_id,),
+    ).fetchone()
+    if row is None:
+        raise KeyError(f"no replay of game {game_id}")
+    size, seed, moves, data = row
+    game = Game(size, seed)
+    for direction in unpack_directions(data, moves):
+        game.step(direction)
+    return game
+
+
+if __name__ == "__main__":
+    from fusion.rules import nuclide_name
+
+    parser = argparse.ArgumentParser(description="Query the store of finished games.")
+    parser.add_argument("path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    best = commands.add_parser("best", help="best runs reaching a nuclide")
+    best.add_argument("nuclide", help='e.g. "Si-28"')
+    best.add_argument("--top", type=int, default=10)
+    commands.add_parser("median", help="median survival (moves) per rule set and policy")
+    replay = commands.add_parser("replay", help="play a stored game again and check it")
+    replay.add_argument("id", type=int)
+    args = parser.parse_args()
+
+    db = connect(args.path)
+    if args.command == "best":
+        print(f"{'id':>10}{'policy':>12}{'seed':>12}{'moves':>8}{'score':>8}{'highest':>9}")
+        for game_id, policy, seed, moves, score, highest in best_runs(db, nuclide_code(args.nuclide), args.top):
+            print(f"{game_id:>10}{policy:>12}{seed:>12}{moves:>8}{score:>8}{nuclide_name(highest):>9}")
+    elif args.command == "median":
+        print(f"{'rules':<10}{'policy':<12}{'games':>10}{'median':>8}  options")
+        for ruleset, policy, options, n, median in median_survival(db):
+            print(f"{ruleset:<10}{policy:<12}{n:>10}{median:>8}  {options}")
+    else:
+        game = load_replay(db, args.id)
+        score = db.execute("SELECT score FROM games WHERE id = ?", (args.id,)).fetchone()[0]
+        print(f"game {args.id}: {game.moves} moves, score {game.score}, highest {nuclide_name(game.highest())}"
+              + ("" if game.score == score else f" (stored score {score}: played with other rules?)"))
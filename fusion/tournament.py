@@ -0,0 +1,171 @@
+""" Tournament of AI strategies over many seeds, played headless on all cores.
+
+Every game is one JSON line in the output file, written as soon as its chunk
+of games comes back from the pool, with the rule set, board size and policy
+options it was played with. Running the same command again skips the
+(strategy, seed) pairs already in the file (in the store, with --db) with
+the same ones, so a killed run resumes; the games of other settings stay in
+the file but are played again and left out of the table.
+
+    python -m fusion.tournament --strategies random greedy corner expectimax --seeds 100
+"""
+import argparse, json, os, time
+from multiprocessing import Pool
+from random import Random
+from statistics import mean, median
+
+from fusion.ai import STRATEGIES, make_policy
+from fusion.engine import Game
+from fusion.rules import RULESET, nuclide_name
+from fusion.store import GameStore, options_key, pack_directions, stored_games
+
+_options = {}
+_policies = {}
+
+
+def policy_rng(seed):
+    """ Return the RNG of the policy's choices in the game of seed: a stream
+    of its own, not correlated with the spawns of Game(size, seed). """
+    return Random(f"policy {seed}")
+
+def play_game(policy, size, seed, max_moves=None, directions=None):
+    """ Play a full game and return its statistics as a dict. The moves
+    played are appended to the list directions, if given. """
+    game = Game(size, seed)
+    rng = policy_rng(seed)
+    start = time.perf_counter()
+    while not game.is_over() and (max_moves is None or game.moves < max_moves):
+        direction = policy(game.board, rng)
+        game.step(direction)
+        if directions is not None:
+            directions.append(direction)
+    duration = time.perf_counter() - start
+    return {
+        "seed": seed,
+        "moves": game.moves,
+        "score": game.score,
+        "highest": nuclide_name(game.highest()),
+        "highest_code": game.highest(),
+        "reactions": dict(game.reactions),
+        "over": game.is_over(),
+        "duration": duration,
+        "moves_per_sec": game.moves / duration if duration else 0.0,
+    }
+
+def _init_worker(options):
+    _options.update(options)
+
+def _play_chunk(chunk):
+    """ Play a chunk of (strategy, seed) games in a worker. """
+    results = []
+    for strategy, seed in chunk:
+        if strategy not in _policies:
+            _policies[strategy] = make_policy(strategy, **_options["policy"])
+        # the moves too, packed, when the games go to a store (fusion/store.py)
+        directions = [] if _options.get("replays") else None
+        result = play_game(_policies[strategy], _options["size"], seed, _options["max_moves"], directions)
+        if directions is not None:
+            result["directions"] = pack_directions(directions)
+        results.append({"strategy": strategy, **result})
+    return results
+
+
+def load_results(path):
+    """ Return the games already in a JSONL file, dropping a truncated last line. """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    complete = data[:data.rfind(b"\n") + 1]
+    if len(complete) != len(data):
+        with open(path, "r+b") as f:
+            f.truncate(len(complete))
+    return [json.loads(line) for line in complete.splitlines() if line.strip()]
+
+def summarize(results):
+    """ Print aggregate stats per strategy. """
+    by_strategy = {}
+    for r in results:
+        by_strategy.setdefault(r["strategy"], []).append(r)
+
+    print(f"{'strategy':<12}{'games':>7}{'moves':>10}{'max':>8}{'score':>10}{'best':>8}{'median':>8}{'reactions':>11}{'moves/s':>10}")
+    for strategy, games in by_strategy.items():
+        moves = [g["moves"] for g in games]
+        highest = [g["highest_code"] for g in games]
+        reactions = [sum(g["reactions"].values()) for g in games]
+        duration = sum(g["duration"] for g in games)
+        print(
+            f"{strategy:<12}{len(games):>7}{mean(moves):>10.1f}{max(moves):>8}"
+            f"{mean(g['score'] for g in games):>10.1f}"
+            f"{nuclide_name(max(highest)):>8}{nuclide_name(int(median(highest))):>8}"
+            f"{mean(reactions):>11.1f}{sum(moves) / duration if duration else 0:>10.0f}"
+        )
+
+def run(strategies, seeds, out, size=4, workers=None, chunk=4, max_moves=None, db=None, **policy_options):
+    # what the games of this run are compared on, as in the store
+    settings = {"rules_hash": RULESET.hash, "size": size, "options": options_key(policy_options)}
+    results = [r for r in load_results(out) if all(r.get(key) == value for key, value in settings.items())]
+    done = {(r["strategy"], r["seed"]) for r in results}
+    # with a store the games in it are those done: a killed run may have
+    # written games to the JSONL that were still waiting for the database
+    played = done if db is None else stored_games(db, strategies, size, policy_options)
+    tasks = [(s, seed) for seed in seeds for s in strategies if (s, seed) not in played]
+    if played:
+        print(f"resuming: {len(played)} games done, {len(tasks)} to play")
+    chunks = [tasks[i:i + chunk] for i in range(0, len(tasks), chunk)]
+
+    options = {"size": size, "max_moves": max_moves, "policy": policy_options, "replays": db is not None}
+    store = None if db is None else GameStore(db, size, policy_options)
+    start = time.time()
+    try:
+        with open(out, "a") as f, Pool(workers, _init_worker, (options,)) as pool:
+            for i, chunk_results in enumerate(pool.imap_unordered(_play_chunk, chunks), 1):
+                for r in chunk_results:
+                    if store:
+                        store.add(r)
+                        del r["directions"]
+                    if (r["strategy"], r["seed"]) not in done:
+                        r.update(settings)
+                        f.write(json.dumps(r) + "\n")
+                        results.append(r)
+                f.flush()
+                print(f"\r{i}/{len(chunks)} chunks, {time.time() - start:.0f}s", end="", flush=True)
+    finally:
+        if store:
+            store.close()
+    print()
+    summarize(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play AI strategies against each other over many seeds.")
+    parser.add_argument("--strategies", nargs="+", default=STRATEGIES, choices=STRATEGIES)
+    parser.add_argument("--seeds", type=int, default=100, help="number of seeds")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--out", default="tournament.jsonl")
+    parser.add_argument("--db", default=None, help="also store the games and their replays in this SQLite file")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk", type=int, default=4, help="games per task sent to a worker")
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=2, help="expectimax depth")
+    parser.add_argument("--rollouts", type=int, default=20, help="rollouts per move")
+    parser.add_argument("--length", type=int, default=20, help="rollout length")
+    parser.add_argument("--ntuple", default=None, help="n-tuple network used by expectimax")
+    args = parser.parse_args()
+
+    run(
+        args.strategies,
+        range(args.first_seed, args.first_seed + args.seeds),
+        args.out,
+        size=args.size,
+        workers=args.workers,
+        chunk=args.chunk,
+        max_moves=args.max_moves,
+        db=args.db,
+        depth=args.depth,
+        rollouts=args.rollouts,
+        length=args.length,
+        ntuple=args.ntuple,
+    )
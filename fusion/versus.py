@@ -0,0 +1,321 @@
+""" Versus: two players race on two boards with the same seed.
+
+Both boards are headless engine games (fusion/engine.py) seeded alike, so
+they get the same spawn sequence as long as the players make the same
+choices; each is drawn by a BoardView, which slides the tile surfaces from
+the cells move_targets() gives and shows the new board when they arrive, so
+nothing depends on the global board and Tile.instances of fusion/game.py.
+
+Side by side on one keyboard (WASD on the left, arrows on the right):
+
+    python main.py versus
+
+or over a socket, one player per window. Only the inputs are sent: a byte
+per move, plus a hash of the board every HASH_EVERY moves. Both windows
+play both games from the same inputs (lockstep), and the hashes catch a
+desync as soon as it happens instead of letting the boards drift apart:
+
+    python main.py versus --listen 7050
+    python main.py versus --connect 127.0.0.1:7050
+"""
+import socket, struct, zlib
+from random import Random
+
+from fusion.engine import DIRECTIONS, Game, move_targets
+from fusion.rules import NUCLIDES, OUTCOMES, RULESET
+
+VERSION = 1
+HELLO = struct.Struct(">2sBQ8s") # "VS", version, seed, rules hash
+HASH = struct.Struct(">BI") # HASH_TAG, crc32 of the board
+HASH_TAG = 0x10
+HASH_EVERY = 32
+
+KEYS = {
+    "wasd": {"a": "left", "w": "up", "d": "right", "s": "down"},
+    "arrows": {"left": "left", "up": "up", "right": "right", "down": "down"},
+}
+
+
+def board_hash(game):
+    return zlib.crc32(bytes(game.board) + game.moves.to_bytes(4, "big") + game.score.to_bytes(4, "big"))
+
+
+class BoardView:
+    """ Draws one game at origin, animating the moves it plays. """
+
+    def __init__(self, renderer, sprites, game, origin, label):
+        from fusion.config import TILE_PADDING, TILE_SIZE, TILE_SPEED
+        self.renderer = renderer
+        self.sprites = sprites # tile surface of every code, index 0 unused
+        self.game = game
+        self.origin = origin
+        self.label = label
+        self.pitch = TILE_SIZE + TILE_PADDING
+        self.speed = TILE_SPEED
+        # the animation in progress: board before the move, {from: to}, time
+        self.before = None
+        self.targets = {}
+        self.elapsed = self.duration = 0.0
+        self.reactions = []
+        self.desync = False
+
+    def cell_pos(self, index):
+        i, j = divmod(index, self.game.size)
+        return self.origin[0] + j * self.pitch, self.origin[1] + i * self.pitch
+
+    def play(self, direction):
+        """ Play a move, return False if it doesn't move anything. """
+        before = self.game.board
+        if not self.game.step(direction):
+            return False
+        self.finish() # a new move skips the end of the previous one
+        self.before = before
+        self.targets = dict(move_targets(before, direction))
+        self.reactions = self.game.last_reactions
+        self.elapsed = 0.0
+        self.duration = max(self.distance(i, j) for i, j in self.targets.items()) / self.speed
+        return True
+
+    def distance(self, i, j):
+        (x0, y0), (x1, y1) = self.cell_pos(i), self.cell_pos(j)
+        return abs(x1 - x0) + abs(y1 - y0)
+
+    def update(self, dt):
+        if self.before is None:
+            return
+        self.elapsed += dt
+        if self.elapsed >= self.duration:
+            self.finish()
+
+    def finish(self):
+        """ End the animation: the reactions give off their particles. """
+        if self.before is None:
+            return
+        from fusion.config import TILE_SIZE
+        for passive, active, product, cell in self.reactions:
+            side = next(side for _, code, side in OUTCOMES[passive][active] if code == product)
+            x, y = self.cell_pos(cell)
+            self.renderer.particles.emit(side, x + TILE_SIZE / 2, y + TILE_SIZE / 2)
+        self.before = None
+
+    def draw(self, screen):
+        from fusion.config import TILE_PADDING
+        grid = self.renderer.grid_surf
+        screen.blit(grid, (self.origin[0] - TILE_PADDING, self.origin[1] - TILE_PADDING))
+        if self.before is None:
+            screen.blits([(self.sprites[code], self.cell_pos(i)) for i, code in enumerate(self.game.board) if code], False)
+            return
+        # every tile at the same speed, the moving ones on top of those they merge into
+        still = [(self.sprites[code], self.cell_pos(i)) for i, code in enumerate(self.before) if code and i not in self.targets]
+        moving = []
+        step = self.elapsed * self.speed
+        for i, j in self.targets.items():
+            (x0, y0), (x1, y1) = self.cell_pos(i), self.cell_pos(j)
+            t = min(step / self.distance(i, j), 1.0)
+            moving.append((self.sprites[self.before[i]], (x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)))
+        screen.blits(still + moving, False)
+
+
+class Link:
+    """ The socket to the other player: moves and board hashes, never boards. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        self.buffer = b""
+        self.outgoing = bytearray() # not taken by the socket yet
+        self.sent = 0
+
+    def send_move(self, direction, game):
+        data = bytes([DIRECTIONS.index(direction)])
+        if game.moves % HASH_EVERY == 0:
+            data += HASH.pack(HASH_TAG, board_hash(game))
+        self.outgoing += data
+        self.sent += len(data)
+        self.flush()
+
+    def flush(self):
+        """ Send what the socket takes without blocking, the rest on the next calls. """
+        try:
+            while self.outgoing:
+                del self.outgoing[:self.sock.send(self.outgoing)]
+        except BlockingIOError:
+            pass # the socket buffer is full: a later frame sends the rest
+
+    def receive(self):
+        """ Return the messages arrived so far: ("move", direction) or ("hash", crc). """
+        self.flush()
+        try:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("the other player left")
+            self.buffer += data
+        except BlockingIOError:
+            pass
+        messages = []
+        while self.buffer:
+            tag = self.buffer[0]
+            if tag < len(DIRECTIONS):
+                messages.append(("move", DIRECTIONS[tag]))
+                self.buffer = self.buffer[1:]
+            elif tag == HASH_TAG:
+                if len(self.buffer) < HASH.size:
+                    break
+                messages.append(("hash", HASH.unpack_from(self.buffer)[1]))
+                self.buffer = self.buffer[HASH.size:]
+            else:
+                raise ConnectionError(f"unknown message {tag}")
+        return messages
+
+    def close(self):
+        self.sock.close()
+
+def handshake(sock, seed):
+    """ Agree on the seed (the listening side's) and check the rule sets match. """
+    rules = bytes.fromhex(RULESET.hash[:16])
+    if seed is not None:
+        sock.sendall(HELLO.pack(b"VS", VERSION, seed, rules))
+    data = b""
+    while len(data) < HELLO.size:
+        chunk = sock.recv(HELLO.size - len(data))
+        if not chunk:
+            raise ConnectionError("the other player left during the handshake")
+        data += chunk
+    magic, version, their_seed, their_rules = HELLO.unpack(data)
+    if magic != b"VS" or version != VERSION:
+        raise ConnectionError("not a versus game of the same version")
+    if their_rules != rules:
+        raise ConnectionError("the other player uses another rule set")
+    if seed is None:
+        sock.sendall(HELLO.pack(b"VS", VERSION, their_seed, rules))
+    return their_seed
+
+def connect(listen=None, address=None, seed=None):
+    """ Return (socket, seed, left): left is True for the listening side. """
+    if listen is not None:
+        server = socket.create_server(("", listen))
+        print(f"waiting for the other player on port {listen}...")
+        sock, _ = server.accept()
+        server.close()
+        seed = Random().getrandbits(32) if seed is None else seed
+        handshake(sock, seed)
+        return sock, seed, True
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)))
+    return sock, handshake(sock, None), False
+
+
+def run(seed=None, listen=None, address=None):
+    import pygame
+    from fusion.config import COLORS, GRID_SIZE, SCREEN_HEIGHT, SCREEN_WIDTH, TABLE_OFFSET_Y, TABLE_SIZE
+    from fusion.renderer import Renderer
+
+    link = None
+    if listen is not None or address is not None:
+        sock, seed, host = connect(listen, address, seed)
+        link = Link(sock)
+    elif seed is None:
+        seed = Random().getrandbits(32)
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("2048 - Nuclear Synthesis: versus")
+    clock = pygame.time.Clock()
+    renderer = Renderer(screen)
+    sprites = [None] + [renderer.tile_surface(a, z) for a, z in NUCLIDES]
+
+    def new_views(seed):
+        origins = [(SCREEN_WIDTH * k / 4 - TABLE_SIZE / 2, TABLE_OFFSET_Y) for k in (1, 3)]
+        if link is None:
+            labels = ["Player 1 (WASD)", "Player 2 (arrows)"]
+        else:
+            labels = ["You", "Them"] if host else ["Them", "You"]
+        return [BoardView(renderer, sprites, Game(GRID_SIZE, seed), origin, label) for origin, label in zip(origins, labels)]
+    views = new_views(seed)
+    # the views each keyboard plays: local play, or the own board in a network game
+    if link is None:
+        controls = [(KEYS["wasd"], views[0]), (KEYS["arrows"], views[1])]
+    else:
+        mine = views[0] if host else views[1]
+        controls = [(KEYS["wasd"], mine), (KEYS["arrows"], mine)]
+    theirs = None if link is None else views[1] if host else views[0]
+    status = ""
+
+    running = True
+    try:
+        while running:
+            dt = clock.tick(60) / 1000
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    name = pygame.key.name(event.key)
+                    if event.key == pygame.K_ESCAPE:
+                        running = False
+                    elif event.key == pygame.K_r and link is None:
+                        seed += 1
+                        views = new_views(seed)
+                        controls = [(KEYS["wasd"], views[0]), (KEYS["arrows"], views[1])]
+                    for keys, view in controls:
+                        if name in keys and not view.game.is_over() and not status and view.play(keys[name]) and link:
+                            try:
+                                link.send_move(keys[name], view.game)
+                            except OSError:
+                                status = "the other player left"
+
+            if link is not None and not status:
+                try:
+                    for kind, value in link.receive():
+                        if kind == "move":
+                            theirs.desync |= not theirs.play(value)
+                        elif value != board_hash(theirs.game):
+                            theirs.desync = True
+                except ConnectionError as e:
+                    status = str(e)
+                if theirs.desync:
+                    status = f"desync after move {theirs.game.moves}"
+
+            renderer.particles.begin_frame()
+            for view in views:
+                view.update(dt)
+            renderer.particles.update(dt)
+
+            screen.fill(COLORS["background"])
+            for view in views:
+                view.draw(screen)
+                x = view.origin[0] + TABLE_SIZE / 2
+                label = renderer.glyphs.render(f"{view.label}: {view.game.score}", 40, COLORS["text"], COLORS["text_outline"], 2)
+                screen.blit(label, label.get_frect(midbottom=(x, view.origin[1] - 25)))
+                if view.game.is_over():
+                    over = renderer.glyphs.render("Game over", 60, COLORS["text"], COLORS["text_outline"], 2)
+                    screen.blit(over, over.get_frect(center=(x, SCREEN_HEIGHT / 2)))
+            renderer.particles.draw(screen)
+            footer = f"seed {seed}"
+            if link is not None:
+                moves = max(views[0].game.moves if host else views[1].game.moves, 1)
+                footer += f"   {link.sent / moves:.2f} bytes/move sent"
+            if status:
+                footer += f"   {status}"
+            text = renderer.glyphs.render(footer, 28, COLORS["text"])
+            screen.blit(text, text.get_frect(midbottom=(SCREEN_WIDTH / 2, SCREEN_HEIGHT - 10)))
+            pygame.display.flip()
+    finally:
+        if link is not None:
+            link.close()
+        pygame.quit()
+
+def add_arguments(parser):
+    parser.add_argument("--seed", type=int, default=None, help="seed of both games (the listening side's in a network game)")
+    parser.add_argument("--listen", type=int, default=None, metavar="PORT", help="wait for the other player on this port")
+    parser.add_argument("--connect", default=None, metavar="HOST:PORT", help="join a player waiting with --listen")
+
+def main(args):
+    run(args.seed, listen=args.listen, address=args.connect)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Two players, two boards, the same seed.")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,253 @@
+""" Spectator wall: dozens of live AI games as thumbnails in one window.
+
+The games are played flat out by worker processes with the pure engine; each
+one publishes its boards in shared memory, guarded by a version counter that
+is odd while it writes (a seqlock: no lock, and the window never waits for a
+worker). Every frame the window copies all the boards at once, skips the
+ones caught half written, and blits only the cells that changed since they
+were last drawn, from one atlas of tiny tiles scaled once from the tile
+cache. Only the rectangles of the thumbnails that changed are sent to the
+display.
+
+    python main.py wall --policy greedy --games 64
+    python -m fusion.wall --policy expectimax --games 16 --depth 1
+"""
+import math, os, time
+from multiprocessing import Process
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from fusion.ai import STRATEGIES, make_policy
+from fusion.engine import Game
+from fusion.rules import NUCLIDES, nuclide_name
+from fusion.tournament import policy_rng
+
+# columns of the stats array
+VERSION, SEED, MOVES, SCORE, FINISHED = range(5)
+# control slots
+STOP = 0
+
+HUD_HEIGHT = 40
+MARGIN = 6 # between thumbnails
+
+
+def _play(index, names, games, cells, workers, strategy, size, first_seed, options):
+    """ Play the games index, index + workers, ... until told to stop. """
+    memories = []
+    def attach(name, shape, dtype):
+        memory = SharedMemory(name=names[name])
+        memories.append(memory)
+        return np.ndarray(shape, dtype, buffer=memory.buf)
+    boards = attach("boards", (games, cells), np.uint8)
+    stats = attach("stats", (games, 5), np.int64)
+    control = attach("control", (1,), np.int64)
+    progress = attach("progress", (workers,), np.int64)
+
+    def publish(i, game):
+        stats[i, VERSION] += 1 # odd: being written
+        boards[i] = game.board
+        stats[i, SEED], stats[i, MOVES], stats[i, SCORE] = game.seed, game.moves, game.score
+        stats[i, VERSION] += 1
+
+    policy = make_policy(strategy, **options)
+    mine = range(index, games, workers)
+    playing = {i: Game(size, first_seed + i) for i in mine}
+    rngs = {i: policy_rng(first_seed + i) for i in mine}
+    for i in mine:
+        publish(i, playing[i])
+    try:
+        while not control[STOP]:
+            for i in mine:
+                game = playing[i]
+                if game.is_over():
+                    # the slot goes on with the next seed of its column
+                    seed = game.seed + games
+                    playing[i], rngs[i] = Game(size, seed), policy_rng(seed)
+                    stats[i, FINISHED] += 1
+                else:
+                    game.step(policy(game.board, rngs[i]))
+                    progress[index] += 1
+                publish(i, playing[i])
+    finally:
+        del boards, stats, control, progress
+        for memory in memories:
+            memory.close()
+
+
+class Wall:
+    """ The worker processes and the shared boards of the wall. """
+
+    def __init__(self, games=64, workers=None, strategy="greedy", size=4, first_seed=0, **options):
+        self.games = games
+        self.workers = min(workers or max(os.cpu_count() - 1, 1), games)
+        self.cells = size * size
+
+        self.memories = {}
+        arrays = {}
+        for name, shape, dtype in [
+            ("boards", (games, self.cells), np.uint8),
+            ("stats", (games, 5), np.int64),
+            ("control", (1,), np.int64),
+            ("progress", (self.workers,), np.int64),
+        ]:
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.memories[name] = SharedMemory(create=True, size=nbytes)
+            arrays[name] = np.ndarray(shape, dtype, buffer=self.memories[name].buf)
+            arrays[name][:] = 0
+        self.boards, self.stats = arrays["boards"], arrays["stats"]
+        self.control, self.progress = arrays["control"], arrays["progress"]
+
+        names = {name: memory.name for name, memory in self.memories.items()}
+        self.processes = []
+        for k in range(self.workers):
+            p = Process(target=_play, args=(k, names, games, self.cells, self.workers, strategy, size, first_seed, options), daemon=True)
+            p.start()
+            self.processes.append(p)
+
+    def snapshot(self):
+        """ Return (boards, stats, ok): copies of the shared arrays, ok False
+        for the games that were being written while copying. """
+        before = self.stats[:, VERSION].copy()
+        boards = self.boards.copy()
+        stats = self.stats.copy()
+        ok = (before == stats[:, VERSION]) & (before % 2 == 0)
+        return boards, stats, ok
+
+    def moves(self):
+        """ Return the moves played so far by all the workers, read without locks. """
+        return int(self.progress.sum())
+
+    def close(self):
+        self.control[STOP] = 1
+        for p in self.processes:
+            p.join()
+        del self.boards, self.stats, self.control, self.progress
+        for memory in self.memories.values():
+            memory.close()
+            memory.unlink()
+
+
+def grid_layout(n, width, height):
+    """ Return (columns, rows, side) of the biggest square thumbnails fitting n in width x height. """
+    best = None
+    for cols in range(1, n + 1):
+        rows = math.ceil(n / cols)
+        side = min(width // cols, height // rows)
+        if best is None or side > best[2]:
+            best = (cols, rows, side)
+    return best
+
+def build_atlas(renderer, pitch, cell):
+    """ One opaque sprite per code (0: empty cell), side by side: the board
+    color around a tile of cell pixels, scaled once from the tile cache. """
+    import pygame
+    from fusion.config import COLORS
+    atlas = pygame.Surface((pitch * (len(NUCLIDES) + 1), pitch))
+    atlas.fill(COLORS["board"])
+    offset = (pitch - cell) // 2
+    radius = max(cell // 8, 1)
+    pygame.draw.rect(atlas, COLORS["empty_tile"], (offset, offset, cell, cell), border_radius=radius)
+    for code, (a, z) in enumerate(NUCLIDES, 1):
+        tile = pygame.transform.smoothscale(renderer.tile_surface(a, z), (cell, cell))
+        atlas.blit(tile, (code * pitch + offset, offset))
+    areas = [pygame.Rect(code * pitch, 0, pitch, pitch) for code in range(len(NUCLIDES) + 1)]
+    return atlas.convert(), areas
+
+
+def run(strategy="greedy", games=64, workers=None, size=4, first_seed=0, fps=60, **options):
+    import pygame
+    from fusion.config import COLORS, SCREEN_HEIGHT, SCREEN_WIDTH
+    from fusion.renderer import Renderer
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption(f"2048 - Nuclear Synthesis: {games} {strategy} games")
+    clock = pygame.time.Clock()
+    renderer = Renderer(screen)
+
+    cols, rows, side = grid_layout(games, SCREEN_WIDTH, SCREEN_HEIGHT - HUD_HEIGHT)
+    pitch = (side - MARGIN) // size
+    cell = max(pitch - max(pitch // 8, 1), 1)
+    atlas, areas = build_atlas(renderer, pitch, cell)
+
+    # top left corner of every thumbnail and of every cell on the screen
+    left = (SCREEN_WIDTH - cols * side) // 2
+    thumbs = [pygame.Rect(left + (i % cols) * side, HUD_HEIGHT + (i // cols) * side, pitch * size, pitch * size) for i in range(games)]
+    cells = [[(t.x + (c % size) * pitch, t.y + (c // size) * pitch) for c in range(size * size)] for t in thumbs]
+
+    wall = Wall(games, workers, strategy, size, first_seed, **options)
+    screen.fill(COLORS["background"])
+    pygame.display.flip()
+    # 255 is no code: everything is drawn on the first frame
+    drawn = np.full((games, size * size), 255, np.uint8)
+
+    hud_rect = pygame.Rect(0, 0, SCREEN_WIDTH, HUD_HEIGHT)
+    last_hud, last_moves = time.perf_counter(), 0
+    try:
+        running = True
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    running = False
+
+            boards, stats, ok = wall.snapshot()
+            changed = (boards != drawn) & ok[:, None]
+            indices, positions = np.nonzero(changed)
+            codes = boards[indices, positions]
+            screen.blits([(atlas, cells[i][c], areas[code]) for i, c, code in zip(indices.tolist(), positions.tolist(), codes.tolist())], False)
+            drawn[changed] = boards[changed]
+            dirty = [thumbs[i] for i in np.unique(indices).tolist()]
+
+            now = time.perf_counter()
+            if now - last_hud >= 0.5:
+                moves = wall.moves()
+                text = (
+                    f"{games} {strategy} games on {wall.workers} workers   "
+                    f"{(moves - last_moves) / (now - last_hud):,.0f} moves/s   "
+                    f"{int(stats[:, FINISHED].sum())} finished   best {nuclide_name(int(boards.max()))}   "
+                    f"{clock.get_fps():.0f} FPS"
+                )
+                screen.fill(COLORS["background"], hud_rect)
+                screen.blit(renderer.glyphs.render(text, 28, COLORS["text"]), (10, 8))
+                dirty.append(hud_rect)
+                last_hud, last_moves = now, moves
+
+            pygame.display.update(dirty)
+            clock.tick(fps)
+    finally:
+        wall.close()
+        pygame.quit()
+
+def add_arguments(parser):
+    parser.add_argument("--policy", default="greedy", choices=STRATEGIES)
+    parser.add_argument("--games", type=int, default=64, help="number of games shown (16 to 100 fit well)")
+    parser.add_argument("--workers", type=int, default=None, help="processes playing the games (default: all the cores but one)")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--depth", type=int, default=2, help="expectimax depth")
+    parser.add_argument("--rollouts", type=int, default=20, help="rollouts per move")
+    parser.add_argument("--length", type=int, default=20, help="rollout length")
+    parser.add_argument("--ntuple", default=None, help="n-tuple network used by expectimax")
+
+def main(args):
+    run(
+        args.policy,
+        args.games,
+        workers=args.workers,
+        size=args.size,
+        first_seed=args.first_seed,
+        fps=args.fps,
+        depth=args.depth,
+        rollouts=args.rollouts,
+        length=args.length,
+        ntuple=args.ntuple,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Watch many AI games at once.")
+    add_arguments(parser)
+    main(parser.parse_args())